@@ -1,13 +1,24 @@
 from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
 import os
+import logging
 from dotenv import load_dotenv
 
 # Import database connection
 from db import init_db
 
+# Import shared HTTP client pool
+from utils.http_client import close_http_clients
+from utils.auth import password_hasher
+from utils.tier_catalog import load_tier_catalog, start_tier_catalog_refresh, stop_tier_catalog_refresh
+from utils.job_queue import start_job_workers, stop_job_workers
+from utils.metrics import MetricsMiddleware
+from utils.logging_config import configure_logging, RequestIdMiddleware
+from utils.loop_monitor import TaskRouteMiddleware, start_loop_monitor, stop_loop_monitor
+from utils.profiler import ProfilerMiddleware, PROFILING_ENABLED, PROFILE_DIR
+
 # Import route modules
-from routes import auth, courses, subscription
+from routes import auth, courses, subscription, admin, jobs, metrics
 
 # Import document models
 from models.user import User
@@ -17,6 +28,10 @@ from models.subscription import SubscriptionTier
 # Load environment variables
 load_dotenv()
 
+# JSON logs through a background writer thread (configured before anything logs)
+configure_logging()
+logger = logging.getLogger(__name__)
+
 # Create FastAPI application
 app = FastAPI(title="Course Generator API")
 
@@ -27,24 +42,62 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Location", "X-Request-ID", "X-Profile-Id"],
 )
 
+# Record request latency and status per route for /metrics
+app.add_middleware(MetricsMiddleware)
+
+# Tag every log line written while serving a request with its X-Request-ID
+app.add_middleware(RequestIdMiddleware)
+
+# Let the event-loop watchdog tell which route a blocking callback belongs to
+app.add_middleware(TaskRouteMiddleware)
+
+# Opt-in request profiling (X-Profile: 1 from an admin, or PROFILE_SAMPLE_RATE); not installed when off
+# The admin profile endpoints list and serve the same directory the middleware writes to
+app.state.profile_dir = PROFILE_DIR
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilerMiddleware, directory=app.state.profile_dir)
+
 # Include routers from modules
 app.include_router(auth.router, tags=["Authentication"])
 app.include_router(courses.router, tags=["Courses"])
+app.include_router(jobs.router, tags=["Jobs"])
 app.include_router(subscription.router, tags=["Subscription"])
+app.include_router(admin.router, tags=["Admin"])
+app.include_router(metrics.router, tags=["Metrics"])
 
 # Startup event to initialize database
 @app.on_event("startup")
 async def startup_db_client():
+    # Measure event-loop lag and report callbacks that block it
+    start_loop_monitor()
+
     try:
         await init_db()
-        print("Database connection established")
+        logger.info("Database connection established")
         
         # Initialize subscription tiers if they don't exist
         await initialize_subscription_tiers()
-    except Exception as e:
-        print(f"Failed to connect to database: {str(e)}")
+        
+        # Load the tier catalog into memory and keep it fresh
+        await load_tier_catalog()
+        start_tier_catalog_refresh()
+
+        # Process queued course generations (including jobs left by a previous run)
+        start_job_workers()
+    except Exception:
+        logger.exception("Failed to connect to database")
+
+# Shutdown event to release pooled upstream connections and worker pools
+@app.on_event("shutdown")
+async def shutdown_http_clients():
+    await stop_job_workers()
+    await stop_loop_monitor()
+    await close_http_clients()
+    password_hasher.shutdown()
+    stop_tier_catalog_refresh()
 
 async def initialize_subscription_tiers():
     """Initialize default subscription tiers if they don't exist"""
@@ -81,7 +134,7 @@ async def initialize_subscription_tiers():
         for tier in tiers:
             await tier.insert()
             
-        print(f"Initialized {len(tiers)} default subscription tiers")
+        logger.info("Initialized %s default subscription tiers", len(tiers))
 
 @app.get("/")
 async def root():
@@ -0,0 +1,137 @@
+"""
+Benchmark and fuzz check for the LLM JSON extractor.
+
+Compares parse_json_object against the previous extractor (regex fence stripping,
+find/rfind slicing, then a validation parse followed by a second parse) on a corpus
+built from stub_responses/course.txt: clean, fenced, with chatter around it, with
+trailing commas and truncated.
+
+With --fuzz N it also feeds N random truncations and mutations of the corpus and
+checks that the parser never raises and that a truncated reply keeps a prefix of
+the original keys.
+
+Usage (from the backend directory):
+    python benchmarks/bench_json_extract.py --iterations 2000
+    python benchmarks/bench_json_extract.py --fuzz 20000
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+from typing import Any, Dict, List, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from utils.json_extract import parse_json_object
+
+
+def legacy_extract(text: str) -> Optional[Any]:
+    """The extractor parse_json_object replaced, without its fake-course fallback"""
+    text = re.sub(r'```json', '', text)
+    text = re.sub(r'```', '', text)
+    json_start = text.find('{')
+    json_end = text.rfind('}')
+    if json_start >= 0 and json_end > json_start:
+        json_str = text[json_start:json_end + 1]
+        try:
+            json.loads(json_str)
+            return json.loads(json_str)
+        except ValueError:
+            return None
+    return None
+
+
+def build_corpus(response: str) -> Dict[str, str]:
+    course = json.loads(response)
+    compact = json.dumps(course, ensure_ascii=False)
+    with_commas = compact.replace('"]', '",]').replace('"}', '",}')
+    return {
+        "clean": response,
+        "compact": compact,
+        "fenced": f"```json\n{response}\n```",
+        "chatter": f"Sure! Here is your course:\n\n{response}\n\nLet me know if you need anything else.",
+        "trailing_commas": with_commas,
+        "truncated": response[:int(len(response) * 0.8)]
+    }
+
+
+def time_per_call(fn, text: str, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(text)
+    return (time.perf_counter() - start) / iterations * 1_000_000
+
+
+def run_benchmark(corpus: Dict[str, str], iterations: int):
+    print(f"iterations per case: {iterations}")
+    print(f"{'case':>16} {'chars':>7} {'legacy us':>10} {'new us':>9} {'legacy ok':>10} {'new ok':>7}")
+    for name, text in corpus.items():
+        legacy_us = time_per_call(legacy_extract, text, iterations)
+        new_us = time_per_call(parse_json_object, text, iterations)
+        legacy_ok = isinstance(legacy_extract(text), dict)
+        new_ok = isinstance(parse_json_object(text), dict)
+        print(f"{name:>16} {len(text):>7} {legacy_us:>10.1f} {new_us:>9.1f} {str(legacy_ok):>10} {str(new_ok):>7}")
+
+
+def mutate(text: str, rng: random.Random) -> str:
+    """Apply one random defect: insert, delete or replace a structural character"""
+    position = rng.randrange(len(text))
+    noise = rng.choice('{}[]",:\\` \n')
+    operation = rng.randrange(3)
+    if operation == 0:
+        return text[:position] + noise + text[position:]
+    if operation == 1:
+        return text[:position] + text[position + 1:]
+    return text[:position] + noise + text[position + 1:]
+
+
+def run_fuzz(corpus: Dict[str, str], reference: Dict[str, Any], runs: int, seed: int):
+    rng = random.Random(seed)
+    sources: List[str] = list(corpus.values())
+    keys = list(reference.keys())
+    recovered = 0
+
+    for run in range(runs):
+        text = rng.choice(sources)
+        if run % 2 == 0:
+            # Truncation of the clean reply: whatever comes back must be a prefix of the course
+            text = corpus["clean"][:rng.randrange(1, len(corpus["clean"]))]
+            result = parse_json_object(text)
+            if result is not None:
+                assert isinstance(result, dict), text
+                assert list(result.keys()) == keys[:len(result)], text
+                recovered += 1
+        else:
+            for _ in range(rng.randint(1, 5)):
+                text = mutate(text, rng)
+            result = parse_json_object(text)
+            if result is not None:
+                recovered += 1
+
+    print(f"fuzz runs: {runs}, recovered an object: {recovered}, no exceptions raised")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the LLM JSON extractor")
+    parser.add_argument("--iterations", type=int, default=1000, help="parses per corpus case")
+    parser.add_argument("--fuzz", type=int, default=0, help="random truncations/mutations to check")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--response", default=os.path.join(BACKEND_DIR, "stub_responses", "course.txt"),
+                        help="recorded LLM reply used to build the corpus")
+    args = parser.parse_args()
+
+    with open(args.response, encoding="utf-8") as f:
+        response = f.read()
+    corpus = build_corpus(response)
+
+    run_benchmark(corpus, args.iterations)
+    if args.fuzz:
+        run_fuzz(corpus, json.loads(response), args.fuzz, args.seed)
+
+
+if __name__ == "__main__":
+    main()
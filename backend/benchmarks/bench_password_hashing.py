@@ -0,0 +1,83 @@
+"""
+Login throughput benchmark for the bcrypt worker pool.
+
+Runs a burst of concurrent password verifications through PasswordHasher for an
+increasing number of workers and reports logins per second together with the worst
+event-loop lag seen during the burst (which should stay near zero).
+
+Usage (from the backend directory):
+    python benchmarks/bench_password_hashing.py --logins 200
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.auth import PasswordHasher, get_password_hash
+
+
+async def measure_loop_lag(stop: asyncio.Event, interval: float = 0.005) -> float:
+    """Return the largest delay between when a sleep should end and when it does"""
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+async def run_burst(workers: int, logins: int, password_hash: str, use_processes: bool) -> dict:
+    hasher = PasswordHasher(workers=workers, max_pending=logins, use_processes=use_processes)
+
+    # Warm up the pool so worker start-up is not measured
+    await asyncio.gather(*[hasher.verify("password", password_hash) for _ in range(workers)])
+
+    stop = asyncio.Event()
+    lag_task = asyncio.ensure_future(measure_loop_lag(stop))
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[hasher.verify("password", password_hash) for _ in range(logins)])
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    worst_lag = await lag_task
+    hasher.shutdown()
+
+    assert all(results)
+    return {
+        "workers": workers,
+        "logins_per_second": logins / elapsed,
+        "elapsed": elapsed,
+        "max_loop_lag_ms": worst_lag * 1000
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark password verification throughput")
+    parser.add_argument("--logins", type=int, default=100, help="verifications per run")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--processes", action="store_true", help="use a process pool instead of threads")
+    args = parser.parse_args()
+
+    password_hash = get_password_hash("password")
+
+    worker_counts = []
+    workers = 1
+    while workers < args.max_workers:
+        worker_counts.append(workers)
+        workers *= 2
+    worker_counts.append(args.max_workers)
+
+    print(f"CPU cores: {os.cpu_count()}, logins per run: {args.logins}")
+    print(f"{'workers':>8} {'logins/s':>10} {'elapsed s':>10} {'max lag ms':>11}")
+    for workers in worker_counts:
+        result = await run_burst(workers, args.logins, password_hash, args.processes)
+        print(f"{result['workers']:>8} {result['logins_per_second']:>10.1f} "
+              f"{result['elapsed']:>10.2f} {result['max_loop_lag_ms']:>11.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
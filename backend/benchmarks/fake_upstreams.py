@@ -0,0 +1,118 @@
+"""
+Local stand-ins for the OpenRouter and Wompi APIs, with injected latency and errors.
+
+OpenRouter chat completions are served by the router of stub_llm_server (recorded
+responses, see STUB_RESPONSES_PATH), streamed or not. Wompi payment links are kept in
+memory, and every transaction looked up by reference is APPROVED.
+
+Usage (from the backend directory):
+    python benchmarks/fake_upstreams.py --port 8001 --llm-latency 1.5 --llm-error-rate 0.02
+    OPENROUTER_API_URL=http://localhost:8001/api/v1/chat/completions \\
+    WOMPI_API_URL=http://localhost:8001/v1 uvicorn app:app
+"""
+import os
+import sys
+import uuid
+import random
+import asyncio
+import argparse
+from typing import Any, Dict, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import uvicorn
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse
+
+import stub_llm_server
+
+app = FastAPI(title="Fake upstream APIs")
+
+# Injected behaviour per upstream: mean latency and jitter in seconds, share of failed requests
+settings: Dict[str, Dict[str, float]] = {
+    "llm": {"latency": 0.0, "jitter": 0.0, "error_rate": 0.0, "error_status": 503},
+    "wompi": {"latency": 0.0, "jitter": 0.0, "error_rate": 0.0, "error_status": 503},
+}
+
+payment_links: Dict[str, Dict[str, Any]] = {}
+
+
+async def inject(upstream: str) -> Optional[JSONResponse]:
+    """Sleep for the configured latency; returns an error response for a share of requests"""
+    config = settings[upstream]
+    delay = config["latency"] + random.uniform(-config["jitter"], config["jitter"])
+    if delay > 0:
+        await asyncio.sleep(delay)
+    if random.random() < config["error_rate"]:
+        return JSONResponse({"error": {"message": "Injected failure"}}, status_code=int(config["error_status"]))
+    return None
+
+
+@app.get("/")
+async def root():
+    return {"status": "ok"}
+
+
+async def inject_llm_failures():
+    """Dependency of the stub LLM routes: the same latency and errors, raised as HTTP errors"""
+    error = await inject("llm")
+    if error is not None:
+        raise HTTPException(status_code=error.status_code, detail="Injected failure")
+
+
+# OpenAI-compatible chat completions, shared with stub_llm_server
+app.include_router(stub_llm_server.router, dependencies=[Depends(inject_llm_failures)])
+
+
+@app.post("/v1/payment_links")
+async def create_payment_link(request: Request):
+    """Wompi payment link creation"""
+    error = await inject("wompi")
+    if error is not None:
+        return error
+
+    body: Dict[str, Any] = await request.json()
+    link_id = uuid.uuid4().hex[:12]
+    payment_links[body["reference"]] = {"id": link_id, "amount_in_cents": body.get("amount_in_cents", 0)}
+    return JSONResponse({"data": {"id": link_id, "url": f"https://checkout.example/l/{link_id}"}}, status_code=201)
+
+
+@app.get("/v1/transactions")
+async def get_transactions(reference: str):
+    """Wompi transactions by reference; every known reference has been paid"""
+    error = await inject("wompi")
+    if error is not None:
+        return error
+
+    link = payment_links.get(reference)
+    if link is None:
+        return {"data": []}
+    return {"data": [{
+        "id": f"txn-{link['id']}",
+        "status": "APPROVED",
+        "payment_method_type": "CARD",
+        "amount_in_cents": link["amount_in_cents"],
+        "reference": reference
+    }]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    for upstream in settings:
+        parser.add_argument(f"--{upstream}-latency", type=float, default=0.0, help="Mean latency in seconds")
+        parser.add_argument(f"--{upstream}-jitter", type=float, default=0.0, help="Uniform jitter in seconds")
+        parser.add_argument(f"--{upstream}-error-rate", type=float, default=0.0, help="Share of failed requests")
+        parser.add_argument(f"--{upstream}-error-status", type=int, default=503)
+    args = parser.parse_args()
+
+    for upstream, config in settings.items():
+        for key in config:
+            config[key] = getattr(args, f"{upstream}_{key}")
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
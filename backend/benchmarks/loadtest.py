@@ -0,0 +1,449 @@
+"""
+End-to-end load test of the API against local stand-ins.
+
+Boots app:app with uvicorn in a child process, backed by mongomock-motor (default) or a
+local MongoDB, with OpenRouter and Wompi replaced by benchmarks/fake_upstreams.py. Virtual
+users register, log in and subscribe, then run a weighted mix of requests until the time
+is up. Latency percentiles, throughput, status codes and the server's event-loop lag
+while each request was in flight are reported per endpoint and written as JSON, so runs
+can be compared across commits.
+
+Usage (from the backend directory):
+    python benchmarks/loadtest.py --users 20 --duration 30 --output before.json
+    python benchmarks/loadtest.py --users 20 --duration 30 --baseline before.json
+    python benchmarks/loadtest.py --mongo mongodb://localhost:27017 --llm-latency 2 --llm-error-rate 0.05
+"""
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import socket
+import asyncio
+import argparse
+import platform
+import subprocess
+from bisect import bisect_left, bisect_right
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import httpx
+
+OPERATIONS = ("register", "token", "subscribe", "generate", "save", "list", "get", "delete")
+DEFAULT_MIX = "register=0.5,token=1,generate=2,save=2,list=6,get=6,delete=1,subscribe=0.5"
+
+# Courses asked for by the virtual users; fewer topics mean more generation cache hits
+LEVELS = ["beginner", "intermediate", "advanced"]
+TIMES = ["2 weeks", "1 month", "10 hours"]
+
+# Loop lag samples kept by the server under test (at 10ms, about half an hour)
+LAG_INTERVAL_SECONDS = 0.01
+LAG_SAMPLES = 200000
+
+
+# --- Server under test -----------------------------------------------------------------
+
+def serve(args):
+    """Run app:app in this process, with the loop lag sampler the driver reads at the end"""
+    os.chdir(BACKEND_DIR)
+    import uvicorn
+    import app as app_module
+
+    if args.mongo == "mock":
+        import beanie
+        from mongomock_motor import AsyncMongoMockClient
+        from db import DOCUMENT_MODELS
+        from utils.indexes import start_index_build
+
+        async def init_mock_db():
+            client = AsyncMongoMockClient()
+            await beanie.init_beanie(database=client["loadtest"], document_models=DOCUMENT_MODELS, skip_indexes=True)
+            start_index_build(DOCUMENT_MODELS)
+
+        app_module.init_db = init_mock_db
+
+    lag_samples: deque = deque(maxlen=LAG_SAMPLES)
+
+    async def sample_loop_lag():
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(LAG_INTERVAL_SECONDS)
+            now = time.monotonic()
+            lag_samples.append((now, now - started - LAG_INTERVAL_SECONDS))
+
+    async def start_lag_sampler():
+        asyncio.ensure_future(sample_loop_lag())
+
+    async def get_lag_samples():
+        return list(lag_samples)
+
+    app_module.app.add_event_handler("startup", start_lag_sampler)
+    app_module.app.add_api_route("/__loadtest/lag", get_lag_samples, methods=["GET"], include_in_schema=False)
+    uvicorn.run(app_module.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_servers(args) -> Tuple[str, List[subprocess.Popen]]:
+    """Start the fake upstreams and the API; returns the API base URL and the processes"""
+    upstream_port, api_port = free_port(), free_port()
+    upstream_url = f"http://127.0.0.1:{upstream_port}"
+
+    upstream = subprocess.Popen([
+        sys.executable, os.path.join(BACKEND_DIR, "benchmarks", "fake_upstreams.py"),
+        "--port", str(upstream_port),
+        "--llm-latency", str(args.llm_latency), "--llm-jitter", str(args.llm_jitter),
+        "--llm-error-rate", str(args.llm_error_rate),
+        "--wompi-latency", str(args.wompi_latency), "--wompi-error-rate", str(args.wompi_error_rate),
+    ])
+
+    env = dict(
+        os.environ,
+        LLM_PROVIDER="openrouter",
+        OPENROUTER_API_URL=f"{upstream_url}/api/v1/chat/completions",
+        WOMPI_API_URL=f"{upstream_url}/v1",
+        WOMPI_SIMULATION_MODE="false",
+        RATE_LIMIT_ENABLED="true" if args.rate_limit else "false",
+        LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"),
+    )
+    if args.mongo != "mock":
+        env.update(MONGO_URI=args.mongo, DB_NAME=args.db_name)
+    api = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "serve", "--port", str(api_port), "--mongo", args.mongo],
+        env=env
+    )
+    return f"http://127.0.0.1:{api_port}", [api, upstream]
+
+
+async def wait_until_ready(base_url: str, processes: List[subprocess.Popen], timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if any(process.poll() is not None for process in processes):
+                raise RuntimeError("A server exited during start-up")
+            try:
+                if (await client.get(f"{base_url}/subscription-tiers")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{base_url} did not become ready in {timeout:.0f}s")
+
+
+# --- Load generation --------------------------------------------------------------------
+
+class Recorder:
+    """Start, end and status of every request, by endpoint"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[Tuple[float, float, str]]] = {}
+
+    async def request(self, client: httpx.AsyncClient, endpoint: str, method: str, url: str,
+                      **kwargs) -> Optional[httpx.Response]:
+        started = time.monotonic()
+        try:
+            response = await client.request(method, url, **kwargs)
+            status = str(response.status_code)
+        except httpx.HTTPError as e:
+            response, status = None, type(e).__name__
+        self.samples.setdefault(endpoint, []).append((started, time.monotonic(), status))
+        return response
+
+
+class VirtualUser:
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder, rng: random.Random, args):
+        self.client = client
+        self.recorder = recorder
+        self.rng = rng
+        self.args = args
+        self.username = ""
+        self.headers: Dict[str, str] = {}
+        self.course: Optional[Dict[str, Any]] = None
+        self.course_ids: List[str] = []
+
+    async def request(self, endpoint: str, **kwargs) -> Optional[httpx.Response]:
+        method, path = endpoint.split(" ", 1)
+        url = kwargs.pop("url", path)
+        return await self.recorder.request(self.client, endpoint, method, url, **kwargs)
+
+    def ok(self, response: Optional[httpx.Response]) -> bool:
+        return response is not None and response.status_code < 400
+
+    async def register(self) -> str:
+        username = f"load_{uuid.uuid4().hex[:12]}"
+        await self.request("POST /register", json={
+            "username": username, "email": f"{username}@loadtest.example", "password": "loadtest-password"
+        })
+        return username
+
+    async def token(self):
+        response = await self.request("POST /token", data={"username": self.username, "password": "loadtest-password"})
+        if self.ok(response):
+            self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    async def subscribe(self):
+        response = await self.request("POST /create-payment", json={"tier_id": self.args.tier}, headers=self.headers)
+        if self.ok(response) and response.json().get("reference"):
+            await self.request("POST /verify-payment", json={"reference": response.json()["reference"]},
+                               headers=self.headers)
+
+    async def generate(self):
+        response = await self.request("POST /generate-course", headers=self.headers, json={
+            "topic": f"Load test topic {self.rng.randrange(self.args.topics)}",
+            "experience_level": self.rng.choice(LEVELS),
+            "available_time": self.rng.choice(TIMES)
+        })
+        if self.ok(response):
+            self.course = response.json()
+
+    async def save(self):
+        course = self.course or {"title": "Load test course", "modules": [], "roadmap": {}}
+        response = await self.request("POST /save-course", headers=self.headers, json={
+            "title": course.get("title") or "Load test course",
+            "prompt": "load test",
+            "content": course,
+            "experience_level": "beginner",
+            "available_time": "2 weeks"
+        })
+        if self.ok(response):
+            self.course_ids.append(response.json()["id"])
+
+    async def list(self):
+        await self.request("GET /courses", url="/courses?limit=20", headers=self.headers)
+
+    async def get(self):
+        if not self.course_ids:
+            return await self.list()
+        course_id = self.rng.choice(self.course_ids)
+        await self.request("GET /courses/{course_id}", url=f"/courses/{course_id}", headers=self.headers)
+
+    async def delete(self):
+        if not self.course_ids:
+            return await self.list()
+        course_id = self.course_ids.pop(self.rng.randrange(len(self.course_ids)))
+        await self.request("DELETE /courses/{course_id}", url=f"/courses/{course_id}", headers=self.headers)
+
+    async def run(self, mix: Dict[str, float], deadline: float):
+        self.username = await self.register()
+        await self.token()
+        if self.args.tier:
+            await self.subscribe()
+
+        operations = list(mix)
+        weights = [mix[name] for name in operations]
+        while time.monotonic() < deadline:
+            operation = self.rng.choices(operations, weights)[0]
+            if operation == "register":
+                # A fresh account, without switching this user to it
+                await self.register()
+            else:
+                await getattr(self, operation)()
+            if self.args.think_time:
+                await asyncio.sleep(self.rng.expovariate(1 / self.args.think_time))
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """Parse "operation=weight,..." into a {operation: weight} map"""
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Unknown operation: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+# --- Report -----------------------------------------------------------------------------
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return None
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def summarize(values: List[float]) -> Dict[str, Optional[float]]:
+    """p50/p95/p99/max/mean in milliseconds"""
+    values = sorted(values)
+    result = {f"p{q}": percentile(values, q) for q in (50, 95, 99)}
+    result["max"] = values[-1] if values else None
+    result["mean"] = sum(values) / len(values) if values else None
+    return {key: round(value * 1000, 2) if value is not None else None for key, value in result.items()}
+
+
+def lag_during(times: List[float], lags: List[float], started: float, ended: float) -> float:
+    """Worst loop lag sampled while a request was in flight"""
+    # A sample is taken when a sleep that began one interval earlier wakes up late
+    lo = bisect_left(times, started)
+    hi = bisect_right(times, ended + LAG_INTERVAL_SECONDS)
+    return max(lags[lo:hi], default=0.0)
+
+
+def build_report(recorder: Recorder, lag_samples: Optional[List[List[float]]], elapsed: float,
+                 args, mix: Dict[str, float]) -> Dict[str, Any]:
+    times = [sample[0] for sample in lag_samples or []]
+    lags = [sample[1] for sample in lag_samples or []]
+
+    endpoints = {}
+    total = errors = 0
+    for endpoint, samples in sorted(recorder.samples.items()):
+        statuses: Dict[str, int] = {}
+        for _, _, status in samples:
+            statuses[status] = statuses.get(status, 0) + 1
+        failed = sum(count for status, count in statuses.items() if not status.isdigit() or int(status) >= 400)
+        total += len(samples)
+        errors += failed
+
+        endpoints[endpoint] = {
+            "requests": len(samples),
+            "rps": round(len(samples) / elapsed, 2),
+            "errors": failed,
+            "statuses": statuses,
+            "latency_ms": summarize([ended - started for started, ended, _ in samples]),
+            "loop_lag_ms": summarize([lag_during(times, lags, started, ended) for started, ended, _ in samples])
+            if lag_samples is not None else None,
+        }
+
+    return {
+        "started_at": datetime.utcnow().isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "config": {
+            "users": args.users, "duration": args.duration, "mix": mix, "topics": args.topics,
+            "tier": args.tier, "mongo": "mock" if args.mongo == "mock" else "mongodb",
+            "rate_limit": args.rate_limit, "think_time": args.think_time,
+            "llm_latency": args.llm_latency, "llm_jitter": args.llm_jitter, "llm_error_rate": args.llm_error_rate,
+            "wompi_latency": args.wompi_latency, "wompi_error_rate": args.wompi_error_rate,
+        },
+        "elapsed_seconds": round(elapsed, 2),
+        "requests": total,
+        "rps": round(total / elapsed, 2),
+        "errors": errors,
+        "loop_lag_ms": summarize(lags) if lag_samples is not None else None,
+        "endpoints": endpoints,
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _change(new: Optional[float], old: Optional[float]) -> str:
+    if new is None or old is None or old == 0:
+        return ""
+    return f" ({(new - old) / old:+.0%})"
+
+
+def print_report(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None):
+    base = (baseline or {}).get("endpoints", {})
+    print(f"\n{report['requests']} requests in {report['elapsed_seconds']}s: "
+          f"{report['rps']} req/s, {report['errors']} errors")
+    if report["loop_lag_ms"]:
+        print(f"Server loop lag: p99 {report['loop_lag_ms']['p99']} ms, max {report['loop_lag_ms']['max']} ms")
+    print(f"\n{'endpoint':<30} {'reqs':>6} {'rps':>8} {'err':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'lag p99':>8}")
+    for endpoint, stats in report["endpoints"].items():
+        latency = stats["latency_ms"]
+        old = base.get(endpoint, {})
+        lag = stats["loop_lag_ms"]["p99"] if stats["loop_lag_ms"] else ""
+        print(f"{endpoint:<30} {stats['requests']:>6} {stats['rps']:>8} {stats['errors']:>5} "
+              f"{latency['p50']:>9} {latency['p95']:>9} {latency['p99']:>9} {lag:>8}")
+        if old:
+            print(f"{'  vs baseline':<30} {'':>6} {_change(stats['rps'], old.get('rps')):>8} {'':>5} "
+                  f"{_change(latency['p50'], old['latency_ms'].get('p50')):>9} "
+                  f"{_change(latency['p95'], old['latency_ms'].get('p95')):>9} "
+                  f"{_change(latency['p99'], old['latency_ms'].get('p99')):>9}")
+
+
+async def run(args) -> Dict[str, Any]:
+    mix = parse_mix(args.mix)
+    processes: List[subprocess.Popen] = []
+    base_url = args.url
+    try:
+        if base_url is None:
+            base_url, processes = start_servers(args)
+            await wait_until_ready(base_url, processes)
+
+        recorder = Recorder()
+        limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+        async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+            started = time.monotonic()
+            deadline = started + args.duration
+            users = [VirtualUser(client, recorder, random.Random(args.seed + i), args) for i in range(args.users)]
+            await asyncio.gather(*[user.run(mix, deadline) for user in users])
+            elapsed = time.monotonic() - started
+
+            lag_samples = None
+            response = await client.get("/__loadtest/lag")
+            if response.status_code == 200:
+                lag_samples = [sample for sample in response.json() if sample[0] >= started]
+
+        return build_report(recorder, lag_samples, elapsed, args, mix)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", nargs="?", choices=["run", "serve"], default="run",
+                        help=argparse.SUPPRESS)
+    parser.add_argument("--users", type=int, default=20, help="Concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of load after the users sign up")
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+                        help="Weighted operations, from: " + ", ".join(OPERATIONS))
+    parser.add_argument("--topics", type=int, default=50, help="Distinct course topics")
+    parser.add_argument("--tier", default="tier_unlimited", help="Tier every user subscribes to (empty: stay free)")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Mean pause between a user's requests")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Client timeout per request")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--mongo", default="mock", help="'mock' for mongomock-motor, or a MongoDB URI")
+    parser.add_argument("--db-name", default="course_loadtest", help="Database used with --mongo URI")
+    parser.add_argument("--rate-limit", action="store_true", help="Keep the generation rate limits on")
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--llm-jitter", type=float, default=0.2)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--wompi-latency", type=float, default=0.2)
+    parser.add_argument("--wompi-error-rate", type=float, default=0.0)
+    parser.add_argument("--url", help="Drive an already running API instead of starting one")
+    parser.add_argument("--port", type=int, default=8000, help=argparse.SUPPRESS)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Results of an earlier run to compare with")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args)
+        return
+
+    report = asyncio.run(run(args))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
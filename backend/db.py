@@ -1,4 +1,5 @@
 import os
+import logging
 from motor.motor_asyncio import AsyncIOMotorClient
 from beanie import init_beanie
 from dotenv import load_dotenv
@@ -6,9 +7,21 @@ from dotenv import load_dotenv
 from models.user import User
 from models.course import Course
 from models.subscription import SubscriptionTier
+from models.generation_cache import CachedCourse
+from models.generation_lock import GenerationLock
+from models.generation_job import GenerationJob
+from models.payment import Payment
+from models.rate_limit import RateLimitBucket
+from utils.indexes import start_index_build
+from utils.metrics import MongoCommandMetrics
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Document models registered with Beanie
+DOCUMENT_MODELS = [User, Course, SubscriptionTier, CachedCourse, GenerationLock, GenerationJob, RateLimitBucket, Payment]
+
 async def init_db():
     # Get MongoDB connection details from environment variables
     mongo_uri = os.getenv("MONGO_URI")
@@ -17,13 +30,16 @@ async def init_db():
     if not mongo_uri or not db_name:
         raise ValueError("MONGO_URI and DB_NAME must be set in .env file")
     
-    # Connect to MongoDB
-    client = AsyncIOMotorClient(mongo_uri)
+    # Connect to MongoDB, timing every command for /metrics
+    client = AsyncIOMotorClient(mongo_uri, event_listeners=[MongoCommandMetrics()])
     
     # Initialize Beanie with the document models
+    # Indexes are built in the background instead of blocking startup
     await init_beanie(
         database=client[db_name],
-        document_models=[User, Course, SubscriptionTier]
+        document_models=DOCUMENT_MODELS,
+        skip_indexes=True
     )
+    start_index_build(DOCUMENT_MODELS)
     
-    print(f"Connected to MongoDB database: {db_name}")
+    logger.info("Connected to MongoDB database: %s", db_name)
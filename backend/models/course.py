@@ -2,17 +2,35 @@ from beanie import Document
 from datetime import datetime
 from typing import Dict
 from uuid import uuid4
+from pydantic import BaseModel, Field
+from pymongo import IndexModel, ASCENDING, DESCENDING
 
 
 class Course(Document):
-    id: str = str(uuid4())
+    id: str = Field(default_factory=lambda: str(uuid4()))
     user_id: str  # referenciando ID del usuario
     title: str
     prompt: str
     content: Dict  # JSON-like content
     experience_level: str
     available_time: str
-    created_at: datetime = datetime.utcnow()
+    created_at: datetime = Field(default_factory=datetime.utcnow)
 
     class Settings:
         name = 'courses'
+        indexes = [
+            # Serves the per-user listing (newest first, _id breaks ties) and ownership checks
+            IndexModel(
+                [("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+                name="user_id_created_at_id"
+            )
+        ]
+
+
+class CourseSummary(BaseModel):
+    """Listing view of a course; used as a projection so the content is never loaded"""
+    id: str = Field(alias="_id")
+    title: str
+    experience_level: str
+    available_time: str
+    created_at: datetime
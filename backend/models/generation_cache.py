@@ -0,0 +1,22 @@
+import os
+from beanie import Document
+from datetime import datetime
+from typing import Dict
+from pydantic import Field
+from pymongo import IndexModel, ASCENDING
+
+# How long a generated course stays in the persistent cache
+COURSE_CACHE_TTL_SECONDS = int(os.getenv("COURSE_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+
+class CachedCourse(Document):
+    id: str  # hash of the normalized generation parameters
+    content: Dict  # generated course JSON
+    model: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+    class Settings:
+        name = 'generated_course_cache'
+        indexes = [
+            IndexModel([("created_at", ASCENDING)], expireAfterSeconds=COURSE_CACHE_TTL_SECONDS)
+        ]
@@ -0,0 +1,52 @@
+import os
+import uuid
+from beanie import Document
+from datetime import datetime
+from typing import Any, Dict, Optional
+from pydantic import Field
+from pymongo import IndexModel, ASCENDING, DESCENDING
+
+# How long finished jobs (and their results) are kept
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", str(7 * 24 * 3600)))
+
+# Job statuses
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+
+class GenerationJob(Document):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str
+    topic: str
+    experience_level: str
+    available_time: str
+    tier: Optional[str] = None
+    callback_url: Optional[str] = None
+    status: str = JOB_QUEUED
+    attempts: int = 0
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    # Not picked up before this time (used to back off while the provider is down)
+    available_at: datetime = Field(default_factory=datetime.utcnow)
+    # Worker holding the job and until when; an expired lease makes the job claimable again
+    lease_owner: Optional[str] = None
+    lease_expires_at: Optional[datetime] = None
+    callback_status: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Settings:
+        name = 'generation_jobs'
+        indexes = [
+            # Claim query: oldest available job per status
+            IndexModel(
+                [("status", ASCENDING), ("available_at", ASCENDING), ("created_at", ASCENDING)],
+                name="status_available_at_created_at"
+            ),
+            IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_id_created_at"),
+            # Finished jobs are removed by MongoDB after the retention period
+            IndexModel([("finished_at", ASCENDING)], expireAfterSeconds=JOB_RETENTION_SECONDS)
+        ]
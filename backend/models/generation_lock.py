@@ -0,0 +1,16 @@
+from beanie import Document
+from datetime import datetime
+from pymongo import IndexModel, ASCENDING
+
+
+class GenerationLock(Document):
+    id: str  # key of the generation being computed
+    owner: str  # process that holds the lock
+    expires_at: datetime
+
+    class Settings:
+        name = 'generation_locks'
+        indexes = [
+            # Locks left behind by crashed workers are removed by MongoDB
+            IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0)
+        ]
@@ -0,0 +1,50 @@
+import os
+import uuid
+from beanie import Document
+from datetime import datetime
+from typing import Optional
+from pydantic import Field
+from pymongo import IndexModel, ASCENDING, DESCENDING
+
+# Pending payments nobody completed are removed after this long
+PAYMENT_PENDING_TTL_SECONDS = int(os.getenv("PAYMENT_PENDING_TTL_SECONDS", str(2 * 24 * 3600)))
+
+# Payment statuses (the Wompi transaction statuses)
+PAYMENT_PENDING = "PENDING"
+PAYMENT_APPROVED = "APPROVED"
+PAYMENT_DECLINED = "DECLINED"
+PAYMENT_VOIDED = "VOIDED"
+PAYMENT_ERROR = "ERROR"
+
+
+class Payment(Document):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    reference: str  # sent to Wompi and used to look the payment up
+    user_id: str
+    plan_id: str
+    plan_name: str
+    amount: float
+    amount_in_cents: int
+    status: str = PAYMENT_PENDING
+    simulated: bool = False
+    payment_url: Optional[str] = None
+    transaction_id: Optional[str] = None
+    payment_method_type: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    # Set once the subscription has been granted, so it is granted exactly once
+    subscription_applied_at: Optional[datetime] = None
+
+    class Settings:
+        name = 'payments'
+        indexes = [
+            IndexModel([("reference", ASCENDING)], unique=True, name="reference_unique"),
+            IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_id_created_at"),
+            # Abandoned payments expire while pending; approved ones are kept
+            IndexModel(
+                [("created_at", ASCENDING)],
+                expireAfterSeconds=PAYMENT_PENDING_TTL_SECONDS,
+                partialFilterExpression={"status": PAYMENT_PENDING},
+                name="pending_ttl"
+            )
+        ]
@@ -0,0 +1,18 @@
+from beanie import Document
+from datetime import datetime
+from pydantic import Field
+from pymongo import IndexModel, ASCENDING
+
+
+class RateLimitBucket(Document):
+    id: str  # rate limit key, e.g. "user:<id>" or "tier:<tier id>"
+    tokens: float
+    updated: float  # epoch seconds of the last refill, compared on update
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+    class Settings:
+        name = 'rate_limit_buckets'
+        indexes = [
+            # Idle buckets are full again and can be dropped
+            IndexModel([("updated_at", ASCENDING)], expireAfterSeconds=3600)
+        ]
@@ -1,5 +1,6 @@
 from beanie import Document
 from typing import Optional
+from pymongo import IndexModel, ASCENDING
 
 
 class SubscriptionTier(Document):
@@ -11,3 +12,6 @@ class SubscriptionTier(Document):
 
     class Settings:
         name = 'subscription_tiers'
+        indexes = [
+            IndexModel([("price", ASCENDING)], name="price")
+        ]
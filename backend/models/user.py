@@ -3,6 +3,7 @@ from pydantic import EmailStr
 from datetime import datetime
 from typing import Optional
 from uuid import uuid4
+from pymongo import IndexModel, ASCENDING
 
 
 class User(Document):
@@ -13,6 +14,11 @@ class User(Document):
     created_at: datetime = datetime.utcnow()
     subscription_tier: Optional[str] = None
     subscription_expiration: Optional[datetime] = None
+    course_count: Optional[int] = None  # saved courses; None until first computed
 
     class Settings:
         name = 'users'
+        indexes = [
+            IndexModel([("username", ASCENDING)], unique=True, name="username_unique"),
+            IndexModel([("email", ASCENDING)], unique=True, name="email_unique")
+        ]
@@ -1,60 +1,159 @@
-import requests
 import os
+import asyncio
 from datetime import datetime
 import uuid
+import logging
+import httpx
+
+from models.payment import Payment, PAYMENT_PENDING, PAYMENT_APPROVED, PAYMENT_ERROR
+from utils.http_client import get_http_client
+from utils.resilience import RetryPolicy, RETRYABLE_STATUS_CODES, is_retryable
 
 # Modo de simulación local (sin llamadas a Wompi)
-SIMULATION_MODE = True
+SIMULATION_MODE = os.getenv("WOMPI_SIMULATION_MODE", "true").lower() == "true"
 
 # Claves de API de Wompi - Se usarán solo cuando SIMULATION_MODE sea False
-WOMPI_PUBLIC_KEY = "pub_test_O0CfpGEg1hMlgpWy2RzJLnMIBkVOwqnL"
-WOMPI_PRIVATE_KEY = "prv_test_i8MiyYHbcIQDvKS1Dle8h5dEOw1dbwKE"
-WOMPI_API_URL = "https://sandbox.wompi.co/v1"  # URL de sandbox
+WOMPI_PUBLIC_KEY = os.getenv("WOMPI_PUBLIC_KEY", "pub_test_O0CfpGEg1hMlgpWy2RzJLnMIBkVOwqnL")
+WOMPI_PRIVATE_KEY = os.getenv("WOMPI_PRIVATE_KEY", "prv_test_i8MiyYHbcIQDvKS1Dle8h5dEOw1dbwKE")
+WOMPI_API_URL = os.getenv("WOMPI_API_URL", "https://sandbox.wompi.co/v1")  # URL de sandbox
+
+# Tiempo máximo por llamada a Wompi (segundos); el cliente HTTP compartido espera hasta 90s por defecto
+WOMPI_TIMEOUT_SECONDS = float(os.getenv("WOMPI_TIMEOUT_SECONDS", "10"))
+
+# Reintentos de la verificación (idempotente); la creación de enlaces nunca se reintenta
+WOMPI_VERIFY_RETRIES = int(os.getenv("WOMPI_VERIFY_RETRIES", "2"))
+WOMPI_RETRY_BASE_DELAY_SECONDS = float(os.getenv("WOMPI_RETRY_BASE_DELAY_SECONDS", "0.25"))
+WOMPI_RETRY_MAX_DELAY_SECONDS = float(os.getenv("WOMPI_RETRY_MAX_DELAY_SECONDS", "2"))
+
+logger = logging.getLogger(__name__)
+
+
+class WompiClient:
+    """
+    Cliente asíncrono de la API de Wompi sobre el pool HTTP compartido,
+    con timeout explícito y reintentos solo en llamadas idempotentes
+    """
+
+    def __init__(self, api_url: str, private_key: str, timeout: float, retry_policy: RetryPolicy):
+        self.api_url = api_url.rstrip("/")
+        self.private_key = private_key
+        self.timeout = httpx.Timeout(timeout)
+        self.retry_policy = retry_policy
+
+    def _headers(self):
+        return {"Authorization": f"Bearer {self.private_key}"}
+
+    async def create_payment_link(self, payload) -> httpx.Response:
+        """POST /payment_links (sin reintentos: repetirlo podría crear dos enlaces)"""
+        client = get_http_client(self.api_url)
+        return await client.post(
+            f"{self.api_url}/payment_links",
+            json=payload,
+            headers=self._headers(),
+            timeout=self.timeout
+        )
+
+    async def find_transactions(self, reference) -> httpx.Response:
+        """GET /transactions?reference=..., reintentando errores transitorios (timeouts, 429, 5xx)"""
+        client = get_http_client(self.api_url)
+        attempt = 0
+        while True:
+            try:
+                response = await client.get(
+                    f"{self.api_url}/transactions",
+                    params={"reference": reference},
+                    headers=self._headers(),
+                    timeout=self.timeout
+                )
+                if response.status_code in RETRYABLE_STATUS_CODES:
+                    response.raise_for_status()
+                return response
+            except Exception as e:
+                if attempt >= self.retry_policy.max_retries or not is_retryable(e):
+                    raise
+                delay = self.retry_policy.delay(attempt, e)
+                logger.warning("Wompi verify failed (%s), retrying in %.2fs", type(e).__name__, delay)
+                attempt += 1
+                await asyncio.sleep(delay)
 
-# Almacenamiento local de simulación para pagos
-simulated_payments = {}
 
-def create_payment_link(user_id, plan_id, plan_name, amount):
+wompi = WompiClient(
+    api_url=WOMPI_API_URL,
+    private_key=WOMPI_PRIVATE_KEY,
+    timeout=WOMPI_TIMEOUT_SECONDS,
+    retry_policy=RetryPolicy(WOMPI_VERIFY_RETRIES, WOMPI_RETRY_BASE_DELAY_SECONDS, WOMPI_RETRY_MAX_DELAY_SECONDS)
+)
+
+async def _transition_payment(payment, status, **fields):
+    """
+    Pasa un pago de PENDING a otro estado con una sola actualización condicional,
+    de modo que entre varias peticiones (o workers) solo una gana la transición
+    """
+    result = await Payment.get_motor_collection().update_one(
+        {"_id": payment.id, "status": PAYMENT_PENDING},
+        {"$set": {"status": status, "updated_at": datetime.utcnow(), **fields}}
+    )
+    updated = await Payment.get(payment.id)
+    if result.modified_count != 1:
+        logger.info("Payment %s was already %s", payment.reference, updated.status)
+    return updated
+
+def _payment_result(payment):
+    return {
+        "success": True,
+        "status": payment.status,
+        "payment_method_type": payment.payment_method_type,
+        "amount": payment.amount,
+        "reference": payment.reference,
+        "plan_id": payment.plan_id
+    }
+
+async def _find_payment(reference, user_id=None):
+    payment = await Payment.find_one(Payment.reference == reference)
+    if payment is None or (user_id is not None and payment.user_id != user_id):
+        return None
+    return payment
+
+async def create_payment_link(user_id, plan_id, plan_name, amount):
     """
     Crea un enlace de pago en Wompi o simula uno en modo local
     """
-    print(f"Creating payment link for user {user_id}, plan {plan_name}, amount {amount}")
+    logger.info("Creating payment link for user %s, plan %s, amount %s", user_id, plan_name, amount)
     
     # Calcular el valor en centavos (Wompi trabaja con la moneda en centavos)
     # El monto viene en pesos colombianos (por ejemplo 19900 para $19.900)
     amount_in_cents = int(float(amount)) * 100
     
-    # Crear una referencia única para el pago
-    reference = f"plan_{plan_id}_{user_id}_{int(datetime.now().timestamp())}"
+    # Crear una referencia única para el pago (el sufijo evita choques dentro del mismo segundo)
+    reference = f"plan_{plan_id}_{user_id}_{int(datetime.now().timestamp())}_{uuid.uuid4().hex[:8]}"
+    
+    # El pago se guarda como PENDING antes de llamar a Wompi, para no perderlo si el proceso muere
+    payment = Payment(
+        reference=reference,
+        user_id=user_id,
+        plan_id=plan_id,
+        plan_name=plan_name,
+        amount=float(amount),
+        amount_in_cents=amount_in_cents,
+        simulated=SIMULATION_MODE
+    )
     
     if SIMULATION_MODE:
-        print("Running in simulation mode - creating local payment link")
-        
-        # Generar un ID único para el pago simulado
-        payment_id = str(uuid.uuid4())
+        logger.info("Running in simulation mode - creating local payment link")
         
         # Crear URL de pago simulada
-        payment_url = f"http://localhost:3000/simulated-payment?reference={reference}&amount={amount}&plan={plan_name}"
-        
-        # Guardar información del pago simulado
-        simulated_payments[reference] = {
-            "id": payment_id,
-            "status": "PENDING",
-            "amount": amount,
-            "amount_in_cents": amount_in_cents,
-            "plan_id": plan_id,
-            "plan_name": plan_name,
-            "user_id": user_id,
-            "created_at": datetime.now().isoformat()
-        }
+        payment.payment_url = f"http://localhost:3000/simulated-payment?reference={reference}&amount={amount}&plan={plan_name}"
+        await payment.insert()
         
         return {
             "success": True,
-            "payment_url": payment_url,
+            "payment_url": payment.payment_url,
             "reference": reference,
             "simulated": True
         }
     
+    await payment.insert()
+    
     # Datos para crear el enlace de pago en Wompi
     payload = {
         "name": f"Suscripción Plan {plan_name} - Skills Hub",
@@ -66,107 +165,82 @@ def create_payment_link(user_id, plan_id, plan_name, amount):
         "reference": reference
     }
     
-    headers = {
-        "Authorization": f"Bearer {WOMPI_PRIVATE_KEY}",
-        "Content-Type": "application/json"
-    }
-    
-    print(f"Sending request to Wompi: {payload}")
+    logger.info("Sending payment link request to Wompi", extra={"reference": reference})
     
     try:
-        response = requests.post(
-            f"{WOMPI_API_URL}/payment_links",
-            json=payload,
-            headers=headers
-        )
+        response = await wompi.create_payment_link(payload)
         
-        print(f"Wompi response status: {response.status_code}")
-        print(f"Wompi response: {response.text}")
+        # Response bodies carry customer data: only the status is logged outside DEBUG
+        logger.info("Wompi payment link response status: %s", response.status_code)
+        logger.debug("Wompi payment link response: %.500s", response.text)
         
         if response.status_code in [200, 201]:
+            payment_url = response.json()["data"]["url"]
+            await Payment.get_motor_collection().update_one(
+                {"_id": payment.id},
+                {"$set": {"payment_url": payment_url, "updated_at": datetime.utcnow()}}
+            )
             return {
                 "success": True,
-                "payment_url": response.json()["data"]["url"],
+                "payment_url": payment_url,
                 "reference": reference
             }
         else:
+            await _transition_payment(payment, PAYMENT_ERROR)
             return {
                 "success": False,
                 "error": f"Error al crear el enlace de pago: {response.text}"
             }
     except Exception as e:
-        print(f"Exception in create_payment_link: {str(e)}")
+        logger.exception("Exception in create_payment_link")
+        await _transition_payment(payment, PAYMENT_ERROR)
         return {
             "success": False,
             "error": f"Error de conexión: {str(e)}"
         }
 
-def verify_payment(reference):
+async def verify_payment(reference, user_id=None):
     """
-    Verifica el estado de un pago por su referencia
+    Verifica el estado de un pago por su referencia (solo los pagos de user_id, si se indica)
     """
-    print(f"Verifying payment with reference: {reference}")
+    logger.info("Verifying payment with reference: %s", reference)
+    
+    payment = await _find_payment(reference, user_id)
+    if payment is None:
+        return {
+            "success": False,
+            "error": "No se encontró el pago"
+        }
+    
+    # Un pago que ya salió de PENDING tiene su estado final guardado
+    if payment.status != PAYMENT_PENDING:
+        return _payment_result(payment)
     
     if SIMULATION_MODE:
-        print("Running in simulation mode - checking local payment status")
+        logger.info("Running in simulation mode - approving local payment")
         
-        # Verificar si existe el pago simulado
-        if reference in simulated_payments:
-            payment = simulated_payments[reference]
-            
-            # En modo simulación, asumimos que todos los pagos son exitosos después de verificar
-            if payment["status"] == "PENDING":
-                payment["status"] = "APPROVED"
-                simulated_payments[reference] = payment
-            
-            return {
-                "success": True,
-                "status": payment["status"],
-                "payment_method_type": "SIMULATED",
-                "amount": payment["amount"],
-                "reference": reference
-            }
-        else:
-            # Para pruebas, simular un pago exitoso si la referencia tiene un formato específico
-            if reference.startswith("plan_"):
-                print("Simulating successful payment in simulation mode")
-                return {
-                    "success": True,
-                    "status": "APPROVED",
-                    "payment_method_type": "SIMULATED",
-                    "amount": 19900,  # Valor por defecto
-                    "reference": reference
-                }
-            
-            return {
-                "success": False,
-                "error": "No se encontró el pago simulado"
-            }
-    
-    headers = {
-        "Authorization": f"Bearer {WOMPI_PRIVATE_KEY}"
-    }
+        # En modo simulación, asumimos que todos los pagos son exitosos después de verificar
+        payment = await _transition_payment(payment, PAYMENT_APPROVED, payment_method_type="SIMULATED")
+        return _payment_result(payment)
     
     try:
-        response = requests.get(
-            f"{WOMPI_API_URL}/transactions?reference={reference}",
-            headers=headers
-        )
+        response = await wompi.find_transactions(reference)
         
-        print(f"Wompi verify response status: {response.status_code}")
-        print(f"Wompi verify response: {response.text}")
+        logger.info("Wompi verify response status: %s", response.status_code)
+        logger.debug("Wompi verify response: %.500s", response.text)
         
         if response.status_code == 200:
             data = response.json()["data"]
             if data and len(data) > 0:
                 transaction = data[0]
-                return {
-                    "success": True,
-                    "status": transaction["status"],
-                    "payment_method_type": transaction["payment_method_type"],
-                    "amount": transaction["amount_in_cents"] / 100,
-                    "reference": transaction["reference"]
-                }
+                if transaction["status"] != PAYMENT_PENDING:
+                    payment = await _transition_payment(
+                        payment,
+                        transaction["status"],
+                        transaction_id=transaction.get("id"),
+                        payment_method_type=transaction["payment_method_type"]
+                    )
+                return _payment_result(payment)
             
             return {
                 "success": False,
@@ -178,41 +252,49 @@ def verify_payment(reference):
             "error": f"Error al consultar el pago: {response.text}"
         }
     except Exception as e:
-        print(f"Exception in verify_payment: {str(e)}")
+        logger.exception("Exception in verify_payment")
         return {
             "success": False,
             "error": f"Error de conexión: {str(e)}"
         }
 
 # Función para aprobar manualmente un pago simulado (para pruebas)
-def approve_simulated_payment(reference):
+async def approve_simulated_payment(reference, user_id=None):
     """
     Aprueba manualmente un pago simulado por su referencia
     """
     if not SIMULATION_MODE:
         return {"success": False, "error": "Esta función solo está disponible en modo simulación"}
     
-    if reference in simulated_payments:
-        payment = simulated_payments[reference]
-        payment["status"] = "APPROVED"
-        simulated_payments[reference] = payment
-        return {"success": True, "payment": payment}
+    payment = await _find_payment(reference, user_id)
+    if payment is None:
+        return {"success": False, "error": "No se encontró el pago simulado"}
     
-    return {"success": False, "error": "No se encontró el pago simulado"}
+    payment = await _transition_payment(payment, PAYMENT_APPROVED, payment_method_type="SIMULATED")
+    if payment.status != PAYMENT_APPROVED:
+        return {"success": False, "error": f"El pago ya está en estado {payment.status}"}
+    
+    return _payment_result(payment)
 
 # Función para pruebas
 if __name__ == "__main__":
-    # Probar la creación de un enlace de pago
-    test_result = create_payment_link(
-        user_id="test_user_123",
-        plan_id="tier_pro",
-        plan_name="Pro",
-        amount=19900
-    )
+    async def main():
+        from db import init_db
+        await init_db()
+        
+        # Probar la creación de un enlace de pago
+        test_result = await create_payment_link(
+            user_id="test_user_123",
+            plan_id="tier_pro",
+            plan_name="Pro",
+            amount=19900
+        )
     
-    print("\nTest result:", test_result)
+        print("\nTest result:", test_result)
     
-    # Si se creó exitosamente, verificar el pago (simulando)
-    if test_result["success"]:
-        verify_result = verify_payment(test_result["reference"])
-        print("\nVerify result:", verify_result) 
\ No newline at end of file
+        # Si se creó exitosamente, verificar el pago (simulando)
+        if test_result["success"]:
+            verify_result = await verify_payment(test_result["reference"])
+            print("\nVerify result:", verify_result)
+
+    asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,73 @@
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.responses import FileResponse
+
+from db import DOCUMENT_MODELS
+from utils.auth import require_admin
+from utils.indexes import index_report
+from utils.tier_catalog import load_tier_catalog
+from utils.course_cache import cache_stats, clear_memory_cache
+from utils.openrouter import course_flight
+from utils.llm_providers import provider_stats
+from utils.rate_limit import rate_limit_stats
+from utils.loop_monitor import loop_monitor
+from utils.profiler import list_profiles, profile_path, PROFILE_DIR
+
+# Create router (every endpoint requires the admin token)
+router = APIRouter(prefix="/admin", dependencies=[Depends(require_admin)])
+
+@router.get("/cache-stats")
+async def get_cache_stats():
+    """Get hit/miss counters of the course generation cache"""
+    return dict(cache_stats(), singleflight=course_flight.stats())
+
+@router.post("/cache/clear")
+async def clear_course_cache():
+    """Clear the in-process tier of the course generation cache"""
+    clear_memory_cache()
+    return {"success": True}
+
+@router.get("/indexes")
+async def get_index_report():
+    """Get the build status of declared indexes and report missing or unused ones"""
+    return await index_report(DOCUMENT_MODELS)
+
+@router.post("/tier-catalog/refresh")
+async def refresh_tier_catalog():
+    """Reload the subscription tier catalog of this worker from MongoDB"""
+    catalog = await load_tier_catalog()
+    return {"success": True, "tiers": len(catalog.tiers), "etag": catalog.etag}
+
+@router.get("/llm-stats")
+async def get_llm_stats():
+    """Get request counts, latency and token usage per LLM provider"""
+    return provider_stats()
+
+@router.get("/rate-limits")
+async def get_rate_limit_stats():
+    """Get rate limiter counters and the in-flight LLM requests of this worker"""
+    return rate_limit_stats()
+
+@router.get("/event-loop")
+async def get_event_loop_stats():
+    """Get the event-loop lag histogram of this worker and the callbacks that blocked it, with their stacks"""
+    return loop_monitor.get_stats()
+
+def profile_dir(request: Request) -> str:
+    """Directory the profiler middleware of this app writes to"""
+    return getattr(request.app.state, "profile_dir", PROFILE_DIR)
+
+@router.get("/profiles")
+async def get_profiles(request: Request):
+    """List the stored request profiles of this worker, newest first"""
+    return list_profiles(profile_dir(request))
+
+@router.get("/profiles/{name}")
+async def get_profile(name: str, request: Request):
+    """Download a request profile as collapsed stacks (for flamegraph.pl or speedscope)"""
+    path = profile_path(name, profile_dir(request))
+    if path is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profile not found"
+        )
+    return FileResponse(path, media_type="text/plain", filename=name)
@@ -3,13 +3,15 @@ from fastapi.security import OAuth2PasswordRequestForm
 from datetime import timedelta
 from typing import Optional
 import uuid
+from pymongo.errors import DuplicateKeyError
 
 from models.user import User
 from utils.auth import (
     create_access_token, 
     authenticate_user, 
-    get_password_hash, 
+    password_hasher, 
     get_current_user, 
+    build_token_claims, 
     ACCESS_TOKEN_EXPIRE_MINUTES
 )
 
@@ -56,7 +58,7 @@ async def register(user_data: UserCreate):
         )
     
     # Create new user
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await password_hasher.hash(user_data.password)
     
     # Create and save new user
     new_user = User(
@@ -64,10 +66,18 @@ async def register(user_data: UserCreate):
         username=user_data.username,
         email=user_data.email,
         password_hash=hashed_password,
-        subscription_tier="free"
+        subscription_tier="free",
+        course_count=0
     )
     
-    await new_user.insert()
+    try:
+        await new_user.insert()
+    except DuplicateKeyError:
+        # A concurrent registration took the username or email (enforced by unique indexes)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Username or email already registered"
+        )
     
     # Create response without password
     return UserResponse(
@@ -94,7 +104,7 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data=build_token_claims(user), expires_delta=access_token_expires
     )
     
     return {"access_token": access_token, "token_type": "bearer"}
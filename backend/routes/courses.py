@@ -1,12 +1,34 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List, Dict, Any, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple
+from datetime import datetime
+from pymongo import DESCENDING
+import base64
+import json
+import logging
+import math
 import uuid
 
 from models.user import User
-from models.course import Course
-from utils.auth import get_current_user
-from utils.openrouter import generate_course_with_ai
-from utils.payment import get_remaining_courses
+from models.course import Course, CourseSummary
+from utils.auth import get_current_user, get_current_principal, TokenUser
+from utils.openrouter import (
+    generate_course_with_ai,
+    generate_topic_with_ai,
+    generate_module_with_ai,
+    stream_course_with_ai,
+    fill_missing_fields,
+    missing_course_fields,
+    course_cache_key
+)
+from utils.llm_providers import select_model, circuit_retry_after
+from utils.resilience import CircuitOpenError
+from utils.rate_limit import limit_generation_rate, limit_llm_concurrency
+from utils.course_cache import get_cached_course, store_course
+from utils.json_stream import StreamingObjectParser
+from utils.payment import get_remaining_courses, reserve_course_slot, release_course_slot
+
+logger = logging.getLogger(__name__)
 
 # Pydantic models for requests and responses
 from pydantic import BaseModel
@@ -53,10 +75,24 @@ class ModuleReplacementRequest(BaseModel):
     current_module_title: str
     experience_level: str
 
+# Largest page accepted by the course listing
+MAX_COURSE_PAGE_SIZE = 100
+
 # Create router
 router = APIRouter()
 
-@router.post("/generate-course", response_model=CourseResponse)
+# Generation endpoints are rate limited per user and hold an LLM slot while they run
+GENERATION_DEPENDENCIES = [Depends(limit_generation_rate), Depends(limit_llm_concurrency)]
+
+def generator_unavailable(retry_after: float) -> HTTPException:
+    """503 answered while the LLM provider's circuit is open"""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="The course generator is temporarily unavailable, please try again shortly",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
+@router.post("/generate-course", response_model=CourseResponse, dependencies=GENERATION_DEPENDENCIES)
 async def generate_course(request: CourseRequest, current_user: User = Depends(get_current_user)):
     """Generate a course with AI"""
     # Check remaining courses based on subscription
@@ -69,17 +105,87 @@ async def generate_course(request: CourseRequest, current_user: User = Depends(g
         )
     
     # Generate the course with AI
-    course_content = await generate_course_with_ai(
-        topic=request.topic,
-        experience_level=request.experience_level,
-        available_time=request.available_time
-    )
+    try:
+        course_content = await generate_course_with_ai(
+            topic=request.topic,
+            experience_level=request.experience_level,
+            available_time=request.available_time,
+            tier=current_user.subscription_tier
+        )
+    except CircuitOpenError as e:
+        raise generator_unavailable(e.retry_after)
     
     return course_content
 
-@router.post("/save-course")
-async def save_course(course_data: SavedCourseRequest, current_user: User = Depends(get_current_user)):
-    """Save a generated course"""
+def format_sse(event: str, data: Any) -> str:
+    """Format a server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_course_events(request: CourseRequest, model: str) -> AsyncIterator[str]:
+    """
+    Relay the course completion as server-sent events:
+    "token" for every text delta, "section" for every completed top-level field
+    (modules are sent one by one) and a final "done" event with the whole course
+    """
+    # Streams always use the single-completion prompt, whatever COURSE_PIPELINE is
+    cache_key = course_cache_key(
+        request.topic, request.experience_level, request.available_time, model, pipeline="single"
+    )
+    cached_course = await get_cached_course(cache_key)
+    if cached_course is not None:
+        # Cache hit: replay the sections without calling the model
+        for key, value in cached_course.items():
+            if key == "modules":
+                for index, module in enumerate(value):
+                    yield format_sse("section", {"key": key, "index": index, "value": module})
+            else:
+                yield format_sse("section", {"key": key, "value": value})
+        yield format_sse("done", cached_course)
+        return
+
+    parser = StreamingObjectParser(split_arrays=("modules",))
+    course: Dict[str, Any] = {}
+
+    try:
+        async for delta in stream_course_with_ai(
+            topic=request.topic,
+            experience_level=request.experience_level,
+            available_time=request.available_time,
+            model=model
+        ):
+            yield format_sse("token", {"text": delta})
+
+            for key, index, value in parser.feed(delta):
+                if index is None:
+                    course[key] = value
+                    yield format_sse("section", {"key": key, "value": value})
+                else:
+                    course.setdefault(key, []).append(value)
+                    yield format_sse("section", {"key": key, "index": index, "value": value})
+    except Exception as e:
+        logger.exception("Error streaming course")
+        yield format_sse("error", {"detail": f"Error generating course: {str(e)}"})
+        return
+
+    if not course:
+        yield format_sse("error", {"detail": "No valid JSON found in response"})
+        return
+
+    # Only a reply that ended normally with every section parsed is cached; a truncated
+    # or partly malformed one is still sent, completed with placeholders
+    missing = missing_course_fields(course)
+    fill_missing_fields(course)
+    if parser.done and not parser.skipped and not missing:
+        await store_course(cache_key, course, model)
+    else:
+        logger.warning("Streamed course is incomplete, not caching it", extra={
+            "finished": parser.done, "skipped_sections": parser.skipped, "missing": missing
+        })
+    yield format_sse("done", course)
+
+@router.post("/generate-course/stream", dependencies=GENERATION_DEPENDENCIES)
+async def generate_course_stream(request: CourseRequest, current_user: User = Depends(get_current_user)):
+    """Generate a course with AI, streaming sections as server-sent events"""
     # Check remaining courses based on subscription
     remaining_courses = await get_remaining_courses(current_user)
     
@@ -89,6 +195,27 @@ async def save_course(course_data: SavedCourseRequest, current_user: User = Depe
             detail="You have reached your course limit for your subscription tier"
         )
     
+    # Fail fast while the provider is down instead of opening a stream that can only error
+    retry_after = circuit_retry_after()
+    if retry_after > 0:
+        raise generator_unavailable(retry_after)
+
+    return StreamingResponse(
+        stream_course_events(request, select_model(current_user.subscription_tier)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/save-course")
+async def save_course(course_data: SavedCourseRequest, current_user: User = Depends(get_current_user)):
+    """Save a generated course"""
+    # Check the quota and count the course in one atomic update, so parallel saves cannot exceed it
+    if not await reserve_course_slot(current_user):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You have reached your course limit for your subscription tier"
+        )
+    
     # Create and save new course
     new_course = Course(
         id=str(uuid.uuid4()),
@@ -100,15 +227,59 @@ async def save_course(course_data: SavedCourseRequest, current_user: User = Depe
         available_time=course_data.available_time
     )
     
-    await new_course.insert()
+    try:
+        await new_course.insert()
+    except Exception:
+        await release_course_slot(current_user)
+        raise
     
     return {"id": new_course.id, "message": "Course saved successfully"}
 
+def encode_course_cursor(course: CourseSummary) -> str:
+    """Opaque pagination cursor pointing after the given course"""
+    raw = f"{course.created_at.isoformat()}|{course.id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_course_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Decode a pagination cursor into (created_at, id)"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        created_at, course_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), course_id
+    except (ValueError, UnicodeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor"
+        )
+
 @router.get("/courses")
-async def get_courses(current_user: User = Depends(get_current_user)):
-    """Get all courses for the current user"""
-    # Find all courses for the user
-    courses = await Course.find(Course.user_id == current_user.id).to_list()
+async def get_courses(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_COURSE_PAGE_SIZE),
+    after: Optional[str] = None,
+    current_user: TokenUser = Depends(get_current_principal)
+):
+    """
+    Get the courses of the current user, newest first.
+    With ?limit= the list is paginated: pass the X-Next-Cursor header of a page as ?after= to get the next one.
+    """
+    filters: Dict[str, Any] = {"user_id": current_user.id}
+    if after:
+        created_at, course_id = decode_course_cursor(after)
+        filters["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": course_id}}
+        ]
+    
+    # Only the listing fields are fetched, never the course content
+    query = Course.find(filters).sort([("created_at", DESCENDING), ("_id", DESCENDING)])
+    if limit:
+        query = query.limit(limit + 1)
+    courses = await query.project(CourseSummary).to_list()
+    
+    if limit and len(courses) > limit:
+        courses = courses[:limit]
+        response.headers["X-Next-Cursor"] = encode_course_cursor(courses[-1])
     
     # Format the response
     course_list = [
@@ -125,7 +296,7 @@ async def get_courses(current_user: User = Depends(get_current_user)):
     return course_list
 
 @router.get("/courses/{course_id}")
-async def get_course(course_id: str, current_user: User = Depends(get_current_user)):
+async def get_course(course_id: str, current_user: TokenUser = Depends(get_current_principal)):
     """Get a specific course by ID"""
     # Find the course
     course = await Course.find_one(Course.id == course_id, Course.user_id == current_user.id)
@@ -147,7 +318,7 @@ async def get_course(course_id: str, current_user: User = Depends(get_current_us
     }
 
 @router.delete("/courses/{course_id}")
-async def delete_course(course_id: str, current_user: User = Depends(get_current_user)):
+async def delete_course(course_id: str, current_user: TokenUser = Depends(get_current_principal)):
     """Delete a course"""
     # Find the course
     course = await Course.find_one(Course.id == course_id, Course.user_id == current_user.id)
@@ -159,13 +330,15 @@ async def delete_course(course_id: str, current_user: User = Depends(get_current
         )
     
     # Delete the course
-    await course.delete()
+    result = await course.delete()
+    if result is not None and result.deleted_count:
+        await release_course_slot(current_user)
     
     return {"success": True}
 
-@router.post("/replace-topic")
+@router.post("/replace-topic", dependencies=GENERATION_DEPENDENCIES)
 async def replace_topic(request: TopicReplacementRequest, current_user: User = Depends(get_current_user)):
-    """Replace a specific topic in a course with AI-generated content"""
+    """Replace a specific roadmap topic in a course with AI-generated content"""
     # Find the course
     course = await Course.find_one(Course.id == request.course_id, Course.user_id == current_user.id)
     
@@ -175,26 +348,54 @@ async def replace_topic(request: TopicReplacementRequest, current_user: User = D
             detail="Course not found or access denied"
         )
     
-    # Generate a new section with AI
-    prompt = f"Rewrite the following section in a {request.experience_level} level for {course.title}: {request.current_topic}"
+    roadmap = course.content.get("roadmap") or {}
+    section_topics = roadmap.get(request.section)
+    if not isinstance(section_topics, list) or request.current_topic not in section_topics:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Topic not found in the course roadmap"
+        )
+    
+    # Generate only the new topic, with the rest of the section as context
+    try:
+        new_topic = await generate_topic_with_ai(
+            course_title=course.title,
+            section=request.section,
+            current_topic=request.current_topic,
+            experience_level=request.experience_level,
+            section_topics=section_topics,
+            tier=current_user.subscription_tier
+        )
+    except CircuitOpenError as e:
+        raise generator_unavailable(e.retry_after)
+    except Exception:
+        logger.exception("Error generating topic replacement")
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail="Failed to generate replacement"
+        )
     
-    # Basic generation for this example
-    # In a real implementation, you'd want to call a more specialized AI function
-    response = await generate_course_with_ai(
-        topic=f"Rewrite section: {request.current_topic}",
-        experience_level=request.experience_level,
-        available_time="N/A"
+    # Patch only the replaced topic in the stored course
+    topic_index = section_topics.index(request.current_topic)
+    if "." in request.section or request.section.startswith("$"):
+        # Section names that are not valid field paths are patched by replacing the whole roadmap
+        section_topics[topic_index] = new_topic
+        update = {"$set": {"content.roadmap": roadmap}}
+    else:
+        update = {"$set": {f"content.roadmap.{request.section}.{topic_index}": new_topic}}
+    await Course.get_motor_collection().update_one(
+        {"_id": course.id, "user_id": current_user.id},
+        update
     )
     
-    # Return the generated content
-    # In a real implementation, you might want to update the course content directly
     return {
         "original": request.current_topic,
-        "replacement": response.get("summary", "Failed to generate replacement"),
+        "replacement": new_topic,
+        "replacement_topic": new_topic,
         "success": True
     }
 
-@router.post("/replace-module")
+@router.post("/replace-module", dependencies=GENERATION_DEPENDENCIES)
 async def replace_module(request: ModuleReplacementRequest, current_user: User = Depends(get_current_user)):
     """Replace a specific module in a course with AI-generated content"""
     # Find the course
@@ -206,31 +407,41 @@ async def replace_module(request: ModuleReplacementRequest, current_user: User =
             detail="Course not found or access denied"
         )
     
-    # Generate a new module with AI
-    prompt = f"Rewrite the following module in a {request.experience_level} level for {course.title}: {request.current_module_title}"
+    modules = course.content.get("modules") or []
+    if request.module_index < 0 or request.module_index >= len(modules):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Module not found in the course"
+        )
     
-    # Basic generation for this example
-    # In a real implementation, you'd want to call a more specialized AI function
-    response = await generate_course_with_ai(
-        topic=f"Rewrite module: {request.current_module_title}",
-        experience_level=request.experience_level,
-        available_time="N/A"
-    )
+    # Generate only the new module, with the course outline as context
+    try:
+        new_module = await generate_module_with_ai(
+            course_title=course.title,
+            course_objective=course.content.get("objective", ""),
+            current_module_title=request.current_module_title,
+            experience_level=request.experience_level,
+            module_titles=[module.get("title", "") for module in modules if isinstance(module, dict)],
+            tier=current_user.subscription_tier
+        )
+    except CircuitOpenError as e:
+        raise generator_unavailable(e.retry_after)
+    except Exception:
+        logger.exception("Error generating module replacement")
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail="Failed to generate replacement"
+        )
     
-    # Extract just the first module from the response
-    if response and "modules" in response and len(response["modules"]) > 0:
-        new_module = response["modules"][0]
-    else:
-        new_module = {
-            "title": f"Revised: {request.current_module_title}",
-            "steps": ["Failed to generate new module content"],
-            "example": ""
-        }
+    # Patch only the replaced module in the stored course
+    await Course.get_motor_collection().update_one(
+        {"_id": course.id, "user_id": current_user.id},
+        {"$set": {f"content.modules.{request.module_index}": new_module}}
+    )
     
-    # Return the generated content
-    # In a real implementation, you might want to update the course content directly
     return {
         "original_title": request.current_module_title,
         "new_module": new_module,
+        "replacement_module": new_module,
         "success": True
-    } 
\ No newline at end of file
+    }
@@ -0,0 +1,76 @@
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from typing import Optional
+from pydantic import BaseModel, HttpUrl
+
+from models.user import User
+from models.generation_job import GenerationJob
+from utils.auth import get_current_user, get_current_principal, TokenUser
+from utils.payment import get_remaining_courses
+from utils.rate_limit import limit_generation_rate
+from utils.job_queue import (
+    enqueue_job, count_pending_jobs, job_payload, callback_host_allowed, JOB_MAX_PENDING_PER_USER
+)
+
+class CourseJobRequest(BaseModel):
+    topic: str
+    experience_level: str
+    available_time: str
+    callback_url: Optional[HttpUrl] = None
+
+# Create router
+router = APIRouter()
+
+@router.post("/generate-course/jobs", status_code=status.HTTP_202_ACCEPTED,
+             dependencies=[Depends(limit_generation_rate)])
+async def create_course_job(request: CourseJobRequest, response: Response,
+                            current_user: User = Depends(get_current_user)):
+    """
+    Queue a course generation and return immediately.
+    Poll GET /jobs/{job_id} for the result, or pass a callback_url to receive it.
+    """
+    if request.callback_url and not callback_host_allowed(str(request.callback_url)):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="callback_url host is not allowed"
+        )
+
+    # Check remaining courses based on subscription
+    remaining_courses = await get_remaining_courses(current_user)
+
+    if remaining_courses == 0:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You have reached your course limit for your subscription tier"
+        )
+
+    if await count_pending_jobs(current_user.id) >= JOB_MAX_PENDING_PER_USER:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many course generations in progress, wait for one to finish"
+        )
+
+    job = await enqueue_job(
+        user_id=current_user.id,
+        topic=request.topic,
+        experience_level=request.experience_level,
+        available_time=request.available_time,
+        tier=current_user.subscription_tier,
+        callback_url=str(request.callback_url) if request.callback_url else None
+    )
+
+    status_url = f"/jobs/{job.id}"
+    response.headers["Location"] = status_url
+    return {"job_id": job.id, "status": job.status, "status_url": status_url}
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, current_user: TokenUser = Depends(get_current_principal)):
+    """Get the status of a generation job, and its course once it has succeeded"""
+    job = await GenerationJob.find_one(GenerationJob.id == job_id, GenerationJob.user_id == current_user.id)
+
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found or access denied"
+        )
+
+    return job_payload(job)
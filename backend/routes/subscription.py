@@ -1,15 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from fastapi.responses import JSONResponse
 from typing import List, Dict, Any
 from datetime import datetime
 
 from models.user import User
 from models.subscription import SubscriptionTier
 from utils.auth import get_current_user
+from utils.tier_catalog import get_catalog, load_tier_catalog, TIER_CATALOG_REFRESH_SECONDS
 from utils.payment import (
+    get_subscription_tier, 
     create_payment, 
     verify_and_update_subscription, 
     approve_simulated_payment_and_update,
-    is_subscription_active
+    is_subscription_active,
+    set_user_subscription
 )
 
 # Pydantic models for requests and responses
@@ -22,29 +26,28 @@ class SubscriptionUpdate(BaseModel):
 router = APIRouter()
 
 @router.get("/subscription-tiers")
-async def get_subscription_tiers():
-    """Get all available subscription tiers"""
-    tiers = await SubscriptionTier.find_all().to_list()
+async def get_subscription_tiers(request: Request):
+    """Get all available subscription tiers (served from the in-memory catalog)"""
+    catalog = get_catalog()
+    if not catalog.tiers:
+        catalog = await load_tier_catalog()
     
-    # Format the response
-    tier_list = [
-        {
-            "id": tier.id,
-            "name": tier.name,
-            "price": tier.price,
-            "course_limit": tier.course_limit,
-            "description": tier.description
-        }
-        for tier in tiers
-    ]
+    headers = {
+        "ETag": catalog.etag,
+        "Cache-Control": f"public, max-age={int(TIER_CATALOG_REFRESH_SECONDS)}"
+    }
+    
+    # The client already has the current catalog
+    if request.headers.get("if-none-match") == catalog.etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
     
-    return tier_list
+    return JSONResponse(content=catalog.listing, headers=headers)
 
 @router.post("/subscribe")
 async def subscribe(subscription: SubscriptionUpdate, current_user: User = Depends(get_current_user)):
     """Subscribe to a tier (direct update)"""
     # Make sure the tier exists
-    tier = await SubscriptionTier.find_one(SubscriptionTier.id == subscription.tier_id)
+    tier = await get_subscription_tier(subscription.tier_id)
     if not tier:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -53,11 +56,8 @@ async def subscribe(subscription: SubscriptionUpdate, current_user: User = Depen
     
     # For free tier, update directly
     if tier.price == 0:
-        # Update user subscription
-        current_user.subscription_tier = tier.id
-        # Free tier has no expiration
-        current_user.subscription_expiration = None
-        await current_user.save()
+        # Update user subscription (free tier has no expiration)
+        await set_user_subscription(current_user, tier.id, None)
         
         return {
             "success": True,
@@ -78,10 +78,10 @@ async def get_subscription_status(current_user: User = Depends(get_current_user)
     """Get the current user's subscription status"""
     # Get user's subscription tier
     tier_id = current_user.subscription_tier or "free"
-    tier = await SubscriptionTier.find_one(SubscriptionTier.id == tier_id)
+    tier = await get_subscription_tier(tier_id)
     
     if not tier:
-        tier = await SubscriptionTier.find_one(SubscriptionTier.id == "free")
+        tier = await get_subscription_tier("free")
         if not tier:
             # Create a default free tier if it doesn't exist
             tier = SubscriptionTier(
@@ -92,6 +92,7 @@ async def get_subscription_status(current_user: User = Depends(get_current_user)
                 description="Access to 1 course only"
             )
             await tier.insert()
+            await load_tier_catalog()
     
     # Check if subscription is active
     is_active = await is_subscription_active(current_user)
@@ -119,7 +120,7 @@ async def get_subscription_status(current_user: User = Depends(get_current_user)
 async def create_payment_route(subscription: SubscriptionUpdate, current_user: User = Depends(get_current_user)):
     """Create a payment for a subscription"""
     # Get the tier
-    tier = await SubscriptionTier.find_one(SubscriptionTier.id == subscription.tier_id)
+    tier = await get_subscription_tier(subscription.tier_id)
     if not tier:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -128,9 +129,7 @@ async def create_payment_route(subscription: SubscriptionUpdate, current_user: U
     
     # For free tier, update directly
     if tier.price == 0:
-        current_user.subscription_tier = tier.id
-        current_user.subscription_expiration = None
-        await current_user.save()
+        await set_user_subscription(current_user, tier.id, None)
         
         return {
             "success": True,
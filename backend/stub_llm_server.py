@@ -0,0 +1,66 @@
+"""
+Local stand-in for the OpenRouter chat completions API.
+
+Replays recorded responses (see STUB_RESPONSES_PATH) deterministically, with or
+without streaming, so the backend can be run and load-tested without network access:
+
+    uvicorn stub_llm_server:app --port 8001
+    OPENROUTER_API_URL=http://localhost:8001/api/v1/chat/completions uvicorn app:app
+"""
+import json
+import time
+import uuid
+from typing import Any, Dict
+from fastapi import APIRouter, FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+from utils.llm_providers import StubProvider
+
+router = APIRouter()
+provider = StubProvider()
+
+
+@router.post("/api/v1/chat/completions")
+async def chat_completions(request: Request):
+    """OpenAI-compatible chat completion endpoint"""
+    body: Dict[str, Any] = await request.json()
+    messages = body.get("messages", [])
+    model = body.get("model", "stub")
+    max_tokens = int(body.get("max_tokens") or 0)
+    temperature = float(body.get("temperature") or 0)
+    completion_id = f"stub-{uuid.uuid4().hex}"
+
+    if body.get("stream"):
+        async def events():
+            async for delta in provider.stream(messages, model, max_tokens, temperature):
+                chunk = {
+                    "id": completion_id,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}]
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    completion = await provider.complete(messages, model, max_tokens, temperature)
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": completion.text},
+            "finish_reason": completion.finish_reason
+        }],
+        "usage": {
+            "prompt_tokens": completion.prompt_tokens,
+            "completion_tokens": completion.completion_tokens,
+            "total_tokens": completion.prompt_tokens + completion.completion_tokens
+        }
+    }
+
+
+app = FastAPI(title="Stub LLM API")
+app.include_router(router)
@@ -1,20 +1,55 @@
+import os
+import hmac
+import time
+import calendar
+import asyncio
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Any, Callable, Optional, Union
 from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, Header, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from pydantic import BaseModel
 import jwt
 from models.user import User
+from utils.cache import TTLCache
+from utils.metrics import PASSWORD_HASH_DURATION, PASSWORD_HASH_REJECTED, register_cache
 
 # Authentication constants
 SECRET_KEY = "your-super-secret-key-replace-in-production"  # Should be loaded from environment in production
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Embed user id and subscription claims in tokens so read endpoints can skip the user lookup
+JWT_EMBED_CLAIMS = os.getenv("JWT_EMBED_CLAIMS", "true").lower() == "true"
+
+# Users loaded by get_current_user are cached for a short time
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+
+# Token required by the admin endpoints (sent as X-Admin-Token); admin endpoints are disabled when unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Cached user documents keyed by username
+_user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+register_cache("user", _user_cache.stats)
+
+class TokenUser(BaseModel):
+    """Identity and subscription of a user as carried by an access token"""
+    id: str
+    username: str
+    subscription_tier: Optional[str] = None
+    subscription_expiration: Optional[datetime] = None
+
+# bcrypt runs in a bounded worker pool so logins never block the event loop
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+PASSWORD_HASH_USE_PROCESSES = os.getenv("PASSWORD_HASH_EXECUTOR", "thread").lower() == "process"
+
 def get_password_hash(password: str) -> str:
     """Hash a password for storing"""
     return pwd_context.hash(password)
@@ -23,12 +58,74 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against a hash"""
     return pwd_context.verify(plain_password, hashed_password)
 
+class PasswordHasher:
+    """
+    Runs bcrypt in a worker pool with a cap on queued jobs.
+    When more than max_pending jobs are waiting for a worker, new jobs are rejected
+    with 503 instead of queueing without bound during a login storm.
+    """
+
+    def __init__(self, workers: int, max_pending: int, use_processes: bool = False):
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.use_processes = use_processes
+        self.pending = 0
+        self.rejected = 0
+        self._executor: Optional[Executor] = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.use_processes:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        return self._executor
+
+    async def _run(self, operation: str, fn: Callable[..., Any], *args: Any) -> Any:
+        if self.pending >= self.workers + self.max_pending:
+            self.rejected += 1
+            PASSWORD_HASH_REJECTED.inc()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Authentication service is busy, please try again",
+                headers={"Retry-After": "1"},
+            )
+
+        self.pending += 1
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.pending -= 1
+            PASSWORD_HASH_DURATION.observe(time.perf_counter() - started, (operation,))
+
+    async def hash(self, password: str) -> str:
+        """Hash a password without blocking the event loop"""
+        return await self._run("hash", get_password_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """Verify a password without blocking the event loop"""
+        return await self._run("verify", verify_password, plain_password, hashed_password)
+
+    def shutdown(self):
+        """Stop the worker pool"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+password_hasher = PasswordHasher(
+    workers=PASSWORD_HASH_WORKERS,
+    max_pending=PASSWORD_HASH_MAX_PENDING,
+    use_processes=PASSWORD_HASH_USE_PROCESSES
+)
+
 async def authenticate_user(username: str, password: str) -> Optional[User]:
     """Authenticate a user by username and password"""
     user = await User.find_one(User.username == username)
     if not user:
         return None
-    if not verify_password(password, user.password_hash):
+    if not await password_hasher.verify(password, user.password_hash):
         return None
     return user
 
@@ -45,8 +142,17 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
-    """Get the current user from the JWT token"""
+def build_token_claims(user: User) -> dict:
+    """Claims for a user's access token, including the subscription claims when enabled"""
+    claims = {"sub": user.username}
+    if JWT_EMBED_CLAIMS:
+        claims["uid"] = user.id
+        claims["tier"] = user.subscription_tier
+        claims["tier_exp"] = calendar.timegm(user.subscription_expiration.utctimetuple()) if user.subscription_expiration else None
+    return claims
+
+def decode_access_token(token: str) -> dict:
+    """Decode a JWT token, raising 401 if it is invalid or has no subject"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -61,8 +167,75 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
     except jwt.PyJWTError:
         raise credentials_exception
     
-    user = await User.find_one(User.username == username)
+    return payload
+
+async def load_user(username: str) -> Optional[User]:
+    """Load a user by username, going through the in-memory user cache"""
+    user = _user_cache.get(username)
     if user is None:
-        raise credentials_exception
+        user = await User.find_one(User.username == username)
+        if user is None:
+            return None
+        _user_cache.set(username, user)
+    
+    # Each request gets its own copy so handlers can modify it freely
+    return user.model_copy()
+
+def invalidate_user_cache(user: Union[User, TokenUser]):
+    """Drop a user from the cache; call after every write to the user document"""
+    _user_cache.delete(user.username)
+
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
+    """Get the current user from the JWT token"""
+    payload = decode_access_token(token)
+    
+    user = await load_user(payload["sub"])
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
         
-    return user 
\ No newline at end of file
+    return user
+
+async def get_current_principal(token: str = Depends(oauth2_scheme)) -> TokenUser:
+    """
+    Get the identity of the current user, from the token claims when present.
+    Tokens issued with JWT_EMBED_CLAIMS need no database lookup at all; the
+    subscription claims may be stale until the token is renewed, so endpoints that
+    enforce the subscription must use get_current_user instead.
+    """
+    payload = decode_access_token(token)
+    
+    if "uid" in payload:
+        expiration = payload.get("tier_exp")
+        return TokenUser(
+            id=payload["uid"],
+            username=payload["sub"],
+            subscription_tier=payload.get("tier"),
+            subscription_expiration=datetime.utcfromtimestamp(expiration) if expiration else None
+        )
+    
+    user = await load_user(payload["sub"])
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    
+    return TokenUser(
+        id=user.id,
+        username=user.username,
+        subscription_tier=user.subscription_tier,
+        subscription_expiration=user.subscription_expiration
+    )
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Allow access only to requests carrying the configured admin token"""
+    if not ADMIN_TOKEN or not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
@@ -0,0 +1,104 @@
+import os
+import copy
+import hashlib
+import json
+import logging
+from typing import Dict, Any, Optional
+
+from models.generation_cache import CachedCourse, COURSE_CACHE_TTL_SECONDS
+from utils.cache import TTLCache
+from utils.metrics import register_cache
+
+logger = logging.getLogger(__name__)
+
+# Cache configuration
+COURSE_CACHE_ENABLED = os.getenv("COURSE_CACHE_ENABLED", "true").lower() == "true"
+COURSE_CACHE_PERSISTENT = os.getenv("COURSE_CACHE_PERSISTENT", "true").lower() == "true"
+COURSE_CACHE_SIZE = int(os.getenv("COURSE_CACHE_SIZE", "256"))
+
+# Fast in-process tier, in front of the persistent MongoDB tier
+_memory_cache = TTLCache(maxsize=COURSE_CACHE_SIZE, ttl=COURSE_CACHE_TTL_SECONDS)
+
+# Counters for the persistent tier
+_persistent_stats = {"hits": 0, "misses": 0, "errors": 0}
+
+register_cache("course_memory", _memory_cache.stats)
+register_cache("course_persistent", lambda: _persistent_stats)
+
+
+def _normalize(value: str) -> str:
+    """Lowercase and collapse whitespace so trivial differences share a cache entry"""
+    return " ".join(value.lower().split())
+
+
+def make_cache_key(topic: str, experience_level: str, available_time: str,
+                   model: str, template_version: str) -> str:
+    """Build the content address of a generation request"""
+    parts = [
+        template_version,
+        model,
+        _normalize(topic),
+        _normalize(experience_level),
+        _normalize(available_time)
+    ]
+    return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+
+async def get_cached_course(key: str) -> Optional[Dict[str, Any]]:
+    """Look a course up in memory first, then in MongoDB"""
+    if not COURSE_CACHE_ENABLED:
+        return None
+
+    course = _memory_cache.get(key)
+    if course is not None:
+        return copy.deepcopy(course)
+
+    if not COURSE_CACHE_PERSISTENT:
+        return None
+
+    try:
+        cached = await CachedCourse.get(key)
+    except Exception as e:
+        _persistent_stats["errors"] += 1
+        logger.warning("Course cache lookup failed: %s", e)
+        return None
+
+    if cached is None:
+        _persistent_stats["misses"] += 1
+        return None
+
+    _persistent_stats["hits"] += 1
+    _memory_cache.set(key, cached.content)
+    return copy.deepcopy(cached.content)
+
+
+async def store_course(key: str, course: Dict[str, Any], model: str):
+    """Store a generated course in both cache tiers"""
+    if not COURSE_CACHE_ENABLED:
+        return
+
+    content = copy.deepcopy(course)
+    _memory_cache.set(key, content)
+
+    if not COURSE_CACHE_PERSISTENT:
+        return
+
+    try:
+        await CachedCourse(id=key, content=content, model=model).save()
+    except Exception as e:
+        _persistent_stats["errors"] += 1
+        logger.warning("Course cache store failed: %s", e)
+
+
+def clear_memory_cache():
+    """Drop every entry of the in-process tier"""
+    _memory_cache.clear()
+
+
+def cache_stats() -> Dict[str, Any]:
+    """Hit/miss counters of both cache tiers"""
+    return {
+        "enabled": COURSE_CACHE_ENABLED,
+        "memory": _memory_cache.stats(),
+        "persistent": dict(_persistent_stats, enabled=COURSE_CACHE_PERSISTENT)
+    }
@@ -0,0 +1,167 @@
+import os
+import json
+import asyncio
+import logging
+from typing import Any, Dict, List, Tuple
+
+from utils.openrouter import request_completion, fill_missing_fields
+from utils.json_extract import parse_json_object
+from utils.resilience import CircuitOpenError
+from utils.token_budget import plan_course, steps_for_level
+
+logger = logging.getLogger(__name__)
+
+# Upstream calls allowed at the same time for one course
+COURSE_PIPELINE_CONCURRENCY = int(os.getenv("COURSE_PIPELINE_CONCURRENCY", "4"))
+
+# Token budgets of each phase
+OUTLINE_MAX_TOKENS = 700
+MODULE_BODY_MAX_TOKENS = 450
+EXTRAS_MAX_TOKENS = 450
+
+
+def build_outline_prompt(topic: str, experience_level: str, available_time: str) -> str:
+    """Prompt for the course outline: everything except module bodies, FAQs and errors"""
+    plan = plan_course(experience_level, available_time)
+    return f"""Create the outline of a structured course about {topic} for a {experience_level} learner with {available_time} of study time available.
+
+Your output should be a structured JSON with the following format:
+{{
+  "title": "Course title",
+  "objective": "A concise paragraph explaining what the student will learn",
+  "prerequisites": ["prerequisite 1", "prerequisite 2", ...],
+  "definitions": ["concept 1: explanation", "concept 2: explanation", ...],
+  "roadmap": {{"Week 1": ["topic 1", "topic 2"], "Week 2": ["topic 3", "topic 4"], ...}},
+  "module_titles": ["Module 1 title", "Module 2 title", ...],
+  "resources": ["resource 1", "resource 2", ...],
+  "downloads": ["name - URL", ...],
+  "summary": "A concise summary of the entire course content"
+}}
+
+Only respond with the valid JSON, with no explanation or additional text.
+Do not include any markdown formatting or code blocks, just the JSON object.
+List exactly {plan.module_count} module titles and a roadmap with {plan.roadmap_sections} sections.
+"""
+
+
+def build_module_prompt(outline: Dict[str, Any], module_title: str, experience_level: str) -> str:
+    """Prompt for the body of one module of the outline"""
+    return f"""You are writing the course "{outline.get('title', '')}" for a {experience_level} learner.
+Course objective: {outline.get('objective', '')}
+Modules of the course: {json.dumps(outline.get('module_titles', []), ensure_ascii=False)}
+
+Write the module "{module_title}".
+Your output should be a JSON object with the following format:
+{{"title": "{module_title}", "steps": ["step 1", "step 2", ...], "example": "An example related to the module"}}
+
+Only respond with the valid JSON, with no explanation or additional text.
+Write {steps_for_level(experience_level)} short steps, one sentence each.
+"""
+
+
+def build_extras_prompt(outline: Dict[str, Any], experience_level: str) -> str:
+    """Prompt for the FAQs and common errors of the outline"""
+    return f"""You are writing the course "{outline.get('title', '')}" for a {experience_level} learner.
+Course objective: {outline.get('objective', '')}
+Modules of the course: {json.dumps(outline.get('module_titles', []), ensure_ascii=False)}
+
+Your output should be a JSON object with the following format:
+{{"faqs": ["Q: question? A: answer", ...], "errors": ["Common error 1: How to fix it", ...]}}
+
+Only respond with the valid JSON, with no explanation or additional text.
+"""
+
+
+async def _complete_json(prompt: str, model: str, max_tokens: int) -> Dict[str, Any]:
+    ai_response = await request_completion(prompt, model, max_tokens=max_tokens)
+    data = parse_json_object(ai_response)
+    if not isinstance(data, dict):
+        raise ValueError("No valid JSON found in response")
+    return data
+
+
+async def generate_course_fanout(topic: str, experience_level: str, available_time: str,
+                                 model: str) -> Tuple[Dict[str, Any], bool]:
+    """
+    Generate a course in two phases: one call for the outline, then the module bodies
+    and the FAQs/errors concurrently (bounded by COURSE_PIPELINE_CONCURRENCY).
+    Wall-clock time is roughly the outline plus the slowest module instead of the sum.
+    Returns the course and whether every part was generated; a degraded course
+    (failed module or extras call) is still returned but should not be cached.
+    """
+    logger.info("Generating course outline for topic: %s", topic)
+    outline = await _complete_json(
+        build_outline_prompt(topic, experience_level, available_time),
+        model,
+        OUTLINE_MAX_TOKENS
+    )
+
+    module_titles: List[str] = [str(title) for title in outline.get("module_titles") or [] if title]
+    outline["module_titles"] = module_titles
+    semaphore = asyncio.Semaphore(COURSE_PIPELINE_CONCURRENCY)
+    failed_parts: List[str] = []
+
+    async def generate_module(module_title: str) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                module = await _complete_json(
+                    build_module_prompt(outline, module_title, experience_level),
+                    model,
+                    MODULE_BODY_MAX_TOKENS
+                )
+            except CircuitOpenError:
+                # Do not assemble (and cache) a hollow course while the provider is down
+                raise
+            except Exception as e:
+                # One failed module should not throw away the rest of the course
+                logger.warning("Error generating module %s: %s", module_title, e)
+                failed_parts.append(module_title)
+                module = {}
+
+        steps = module.get("steps")
+        return {
+            "title": module.get("title") or module_title,
+            "steps": [str(step) for step in steps] if isinstance(steps, list) else [],
+            "example": module.get("example") or ""
+        }
+
+    async def generate_extras() -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                return await _complete_json(build_extras_prompt(outline, experience_level), model, EXTRAS_MAX_TOKENS)
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                logger.warning("Error generating FAQs and errors: %s", e)
+                failed_parts.append("extras")
+                return {}
+
+    logger.info("Generating %s modules concurrently for topic: %s", len(module_titles), topic)
+    parts = [asyncio.ensure_future(generate_extras())]
+    parts += [asyncio.ensure_future(generate_module(title)) for title in module_titles]
+    try:
+        results = await asyncio.gather(*parts)
+    except BaseException:
+        # Circuit open (or this request cancelled): stop the sibling calls instead of
+        # paying for completions nobody will read
+        for part in parts:
+            part.cancel()
+        await asyncio.gather(*parts, return_exceptions=True)
+        raise
+    extras, modules = results[0], list(results[1:])
+
+    outline.pop("module_titles", None)
+    course_data = dict(outline)
+    course_data["modules"] = modules
+    course_data["faqs"] = extras.get("faqs", [])
+    course_data["errors"] = extras.get("errors", [])
+
+    fill_missing_fields(course_data)
+    complete = bool(modules) and not failed_parts
+    if complete:
+        logger.info("Generated course: %s", course_data.get("title", "Unknown title"))
+    else:
+        logger.warning("Generated degraded course: %s", course_data.get("title", "Unknown title"), extra={
+            "failed_parts": failed_parts, "modules": len(modules)
+        })
+    return course_data, complete
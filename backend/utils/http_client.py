@@ -0,0 +1,84 @@
+import os
+from typing import Dict
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Connection pool configuration (applies to every upstream host)
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "20"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+
+# Per-host overrides, e.g. "openrouter.ai=50,sandbox.wompi.co=5"
+HTTP_HOST_LIMITS = os.getenv("HTTP_HOST_LIMITS", "")
+
+# Timeouts in seconds. The read timeout has to cover a full LLM completion.
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "90"))
+HTTP_WRITE_TIMEOUT = float(os.getenv("HTTP_WRITE_TIMEOUT", "10"))
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "10"))
+
+# HTTP/2 is only used when the optional "h2" package is installed
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+HTTP2_ENABLED = HTTP2_AVAILABLE and os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+
+# One pooled client per upstream host, shared by every request in the process
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def _parse_host_limits(value: str) -> Dict[str, int]:
+    """Parse the HTTP_HOST_LIMITS setting into a {host: max_connections} map"""
+    limits = {}
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        host, limit = item.split("=", 1)
+        limits[host.strip()] = int(limit)
+    return limits
+
+
+_host_limits = _parse_host_limits(HTTP_HOST_LIMITS)
+
+
+def get_http_client(url: str) -> httpx.AsyncClient:
+    """
+    Get the shared async client for the host of the given URL.
+    Clients are created on first use and keep their connections alive between requests.
+    """
+    parsed = httpx.URL(url)
+    key = f"{parsed.scheme}://{parsed.host}:{parsed.port or ''}"
+
+    client = _clients.get(key)
+    if client is None or client.is_closed:
+        max_connections = _host_limits.get(parsed.host, HTTP_MAX_CONNECTIONS_PER_HOST)
+        client = httpx.AsyncClient(
+            http2=HTTP2_ENABLED,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=min(HTTP_MAX_KEEPALIVE_CONNECTIONS, max_connections),
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(
+                connect=HTTP_CONNECT_TIMEOUT,
+                read=HTTP_READ_TIMEOUT,
+                write=HTTP_WRITE_TIMEOUT,
+                pool=HTTP_POOL_TIMEOUT
+            )
+        )
+        _clients[key] = client
+
+    return client
+
+
+async def close_http_clients():
+    """Close every pooled client (called on application shutdown)"""
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
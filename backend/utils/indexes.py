@@ -0,0 +1,81 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Type
+from beanie import Document
+from pymongo import IndexModel
+
+logger = logging.getLogger(__name__)
+
+# Result of the last index build per collection
+_build_status: Dict[str, Dict[str, Any]] = {}
+_build_task: Optional[asyncio.Task] = None
+
+
+def declared_indexes(model: Type[Document]) -> List[IndexModel]:
+    """Indexes declared in a document model's Settings"""
+    return list(getattr(model.Settings, "indexes", []) or [])
+
+
+async def build_indexes(models: List[Type[Document]]):
+    """Create the declared indexes of every model, one collection at a time"""
+    for model in models:
+        collection_name = model.get_collection_name()
+        indexes = declared_indexes(model)
+        if not indexes:
+            _build_status[collection_name] = {"status": "no indexes declared"}
+            continue
+
+        _build_status[collection_name] = {"status": "building"}
+        try:
+            created = await model.get_motor_collection().create_indexes(indexes)
+            _build_status[collection_name] = {"status": "ready", "indexes": created}
+        except Exception as e:
+            # e.g. a unique index over existing duplicates; the other collections still get built
+            _build_status[collection_name] = {"status": "failed", "error": str(e)}
+            logger.error("Failed to build indexes for %s: %s", collection_name, e)
+
+    logger.info("Index build finished")
+
+
+def start_index_build(models: List[Type[Document]]) -> asyncio.Task:
+    """Build the declared indexes in the background so startup does not wait for them"""
+    global _build_task
+    _build_task = asyncio.ensure_future(build_indexes(models))
+    return _build_task
+
+
+async def index_report(models: List[Type[Document]]) -> Dict[str, Any]:
+    """
+    Compare declared and existing indexes of every model.
+    "missing" are declared but not present, "undeclared" exist but are not declared,
+    and "unused" have not served a single operation since the server started.
+    """
+    report = {}
+    for model in models:
+        collection_name = model.get_collection_name()
+        collection = model.get_motor_collection()
+        declared = [index.document["name"] for index in declared_indexes(model)]
+
+        try:
+            existing = list((await collection.index_information()).keys())
+        except Exception as e:
+            report[collection_name] = {"error": str(e)}
+            continue
+
+        usage = {}
+        try:
+            async for stats in collection.aggregate([{"$indexStats": {}}]):
+                usage[stats["name"]] = int(stats.get("accesses", {}).get("ops", 0))
+        except Exception:
+            usage = None  # $indexStats is not available on every deployment
+
+        report[collection_name] = {
+            "build": _build_status.get(collection_name, {"status": "not started"}),
+            "declared": declared,
+            "missing": [name for name in declared if name not in existing],
+            "undeclared": [name for name in existing if name != "_id_" and name not in declared],
+            "unused": [name for name, ops in usage.items() if ops == 0 and name != "_id_"] if usage is not None else None,
+            "usage": usage
+        }
+
+    return report
@@ -0,0 +1,354 @@
+import os
+import hmac
+import json
+import asyncio
+import logging
+import hashlib
+import ipaddress
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+import httpx
+from pymongo import ReturnDocument
+
+from models.generation_job import (
+    GenerationJob, JOB_QUEUED, JOB_RUNNING, JOB_SUCCEEDED, JOB_FAILED
+)
+from utils.openrouter import generate_course
+from utils.resilience import CircuitOpenError
+from utils.singleflight import PROCESS_ID
+from utils.logging_config import bind_request_id, request_id_var
+
+logger = logging.getLogger(__name__)
+
+# Generation workers started in this process (0 runs the API without processing jobs)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+
+# A running job whose lease is not renewed (crashed or restarted worker) is picked up again
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "120"))
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "2"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+# Jobs a user may have queued or running at the same time
+JOB_MAX_PENDING_PER_USER = int(os.getenv("JOB_MAX_PENDING_PER_USER", "5"))
+
+# Callbacks are signed with HMAC-SHA256 of the body when a secret is configured
+JOB_CALLBACK_SECRET = os.getenv("JOB_CALLBACK_SECRET", "")
+JOB_CALLBACK_ATTEMPTS = int(os.getenv("JOB_CALLBACK_ATTEMPTS", "3"))
+
+# Hosts callbacks may be sent to, e.g. "hooks.example.com,*.example.org" (empty: callbacks disabled)
+JOB_CALLBACK_ALLOWED_HOSTS = os.getenv("JOB_CALLBACK_ALLOWED_HOSTS", "")
+
+# Callbacks share one small client of their own, separate from the upstream pools
+JOB_CALLBACK_TIMEOUT_SECONDS = float(os.getenv("JOB_CALLBACK_TIMEOUT_SECONDS", "10"))
+JOB_CALLBACK_MAX_CONNECTIONS = int(os.getenv("JOB_CALLBACK_MAX_CONNECTIONS", "10"))
+
+# Wakes idle workers in this process as soon as a job is enqueued (created with the workers)
+_job_available: Optional[asyncio.Event] = None
+_workers: List[asyncio.Task] = []
+_callback_client: Optional[httpx.AsyncClient] = None
+
+_allowed_callback_hosts = [host.strip().lower() for host in JOB_CALLBACK_ALLOWED_HOSTS.split(",") if host.strip()]
+
+
+class CallbackNotAllowedError(Exception):
+    """The callback URL points to a host outside the allowlist or to a non-public address"""
+
+
+async def enqueue_job(user_id: str, topic: str, experience_level: str, available_time: str,
+                      tier: Optional[str] = None, callback_url: Optional[str] = None) -> GenerationJob:
+    """Store a new course generation job and wake a worker"""
+    job = GenerationJob(
+        user_id=user_id,
+        topic=topic,
+        experience_level=experience_level,
+        available_time=available_time,
+        tier=tier,
+        callback_url=callback_url
+    )
+    await job.insert()
+    if _job_available is not None:
+        _job_available.set()
+    return job
+
+
+async def count_pending_jobs(user_id: str) -> int:
+    """Jobs of a user that are still queued or running"""
+    return await GenerationJob.find(
+        {"user_id": user_id, "status": {"$in": [JOB_QUEUED, JOB_RUNNING]}}
+    ).count()
+
+
+async def claim_job(owner: str) -> Optional[GenerationJob]:
+    """
+    Atomically take the oldest available job: a queued job, or a running job whose
+    lease expired because its worker died
+    """
+    now = datetime.utcnow()
+    document = await GenerationJob.get_motor_collection().find_one_and_update(
+        {"$or": [
+            {"status": JOB_QUEUED, "available_at": {"$lte": now}},
+            {"status": JOB_RUNNING, "lease_expires_at": {"$lt": now}}
+        ]},
+        {
+            "$set": {
+                "status": JOB_RUNNING,
+                "lease_owner": owner,
+                "lease_expires_at": now + timedelta(seconds=JOB_LEASE_SECONDS),
+                "started_at": now
+            },
+            "$inc": {"attempts": 1}
+        },
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+    if document is None:
+        return None
+    return GenerationJob.model_validate(document)
+
+
+async def _update_owned(job: GenerationJob, owner: str, update: Dict[str, Any]) -> bool:
+    """Apply an update only while this worker still holds the job's lease"""
+    result = await GenerationJob.get_motor_collection().update_one(
+        {"_id": job.id, "lease_owner": owner},
+        update
+    )
+    return result.modified_count == 1
+
+
+async def _renew_lease(job: GenerationJob, owner: str):
+    while True:
+        await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+        await _update_owned(job, owner, {"$set": {
+            "lease_expires_at": datetime.utcnow() + timedelta(seconds=JOB_LEASE_SECONDS)
+        }})
+
+
+async def _requeue(job: GenerationJob, owner: str, delay: float, count_attempt: bool = True):
+    update: Dict[str, Any] = {"$set": {
+        "status": JOB_QUEUED,
+        "available_at": datetime.utcnow() + timedelta(seconds=delay),
+        "lease_owner": None,
+        "lease_expires_at": None
+    }}
+    if not count_attempt:
+        update["$inc"] = {"attempts": -1}
+    await _update_owned(job, owner, update)
+
+
+async def _finish(job: GenerationJob, owner: str, status: str,
+                  result: Optional[Dict[str, Any]] = None, error: Optional[str] = None) -> bool:
+    job.status = status
+    job.result = result
+    job.error = error
+    job.finished_at = datetime.utcnow()
+    return await _update_owned(job, owner, {"$set": {
+        "status": status,
+        "result": result,
+        "error": error,
+        "finished_at": job.finished_at,
+        "lease_owner": None,
+        "lease_expires_at": None
+    }})
+
+
+async def process_job(job: GenerationJob, owner: str):
+    """Generate the course of a claimed job and record the outcome"""
+    if job.attempts > JOB_MAX_ATTEMPTS:
+        # Claimed again after its workers kept dying: give up instead of looping forever
+        if await _finish(job, owner, JOB_FAILED, error="Job abandoned after repeated worker failures"):
+            await deliver_callback(job)
+        return
+
+    heartbeat = asyncio.ensure_future(_renew_lease(job, owner))
+    try:
+        # The raising variant: a failed generation is retried, then reported as failed
+        course = await generate_course(
+            topic=job.topic,
+            experience_level=job.experience_level,
+            available_time=job.available_time,
+            tier=job.tier
+        )
+    except CircuitOpenError as e:
+        # Provider down: wait for the circuit instead of burning an attempt
+        await _requeue(job, owner, e.retry_after, count_attempt=False)
+        return
+    except asyncio.CancelledError:
+        # Shutting down: hand the job back so another worker can take it right away
+        await _requeue(job, owner, 0, count_attempt=False)
+        raise
+    except Exception as e:
+        logger.exception("Error processing job %s (attempt %s)", job.id, job.attempts)
+        if job.attempts < JOB_MAX_ATTEMPTS:
+            await _requeue(job, owner, 2 ** job.attempts)
+        elif await _finish(job, owner, JOB_FAILED, error=str(e)):
+            await deliver_callback(job)
+        return
+    finally:
+        heartbeat.cancel()
+
+    if await _finish(job, owner, JOB_SUCCEEDED, result=course):
+        await deliver_callback(job)
+
+
+def job_payload(job: GenerationJob) -> Dict[str, Any]:
+    """Public view of a job, as returned by GET /jobs/{id} and sent to callbacks"""
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "attempts": job.attempts,
+        "created_at": job.created_at.isoformat(),
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "result": job.result,
+        "error": job.error,
+        "callback_status": job.callback_status
+    }
+
+
+def callback_host_allowed(url: str) -> bool:
+    """Whether the host of a callback URL is in JOB_CALLBACK_ALLOWED_HOSTS ("*.domain" matches subdomains)"""
+    try:
+        host = httpx.URL(url).host.lower()
+    except Exception:
+        return False
+    for allowed in _allowed_callback_hosts:
+        if host == allowed or (allowed.startswith("*.") and host.endswith(allowed[1:])):
+            return True
+    return False
+
+
+async def _resolve_callback_address(url: httpx.URL) -> str:
+    """
+    Resolve the callback host and return one of its addresses, refusing names that
+    resolve to loopback, private, link-local (cloud metadata) or otherwise non-public
+    addresses. The request is then sent to that address, so the name cannot be
+    re-resolved to something else in between.
+    """
+    port = url.port or (443 if url.scheme == "https" else 80)
+    infos = await asyncio.get_running_loop().getaddrinfo(url.host, port, type=0)
+    addresses = []
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if not address.is_global or address.is_multicast:
+            raise CallbackNotAllowedError(f"{url.host} resolves to non-public address {address}")
+        addresses.append(str(address))
+    if not addresses:
+        raise CallbackNotAllowedError(f"{url.host} did not resolve")
+    return addresses[0]
+
+
+def _get_callback_client() -> httpx.AsyncClient:
+    global _callback_client
+    if _callback_client is None or _callback_client.is_closed:
+        _callback_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=JOB_CALLBACK_MAX_CONNECTIONS,
+                max_keepalive_connections=JOB_CALLBACK_MAX_CONNECTIONS
+            ),
+            timeout=httpx.Timeout(JOB_CALLBACK_TIMEOUT_SECONDS),
+            follow_redirects=False
+        )
+    return _callback_client
+
+
+async def _post_callback(callback_url: str, body: bytes, headers: Dict[str, str]) -> httpx.Response:
+    url = httpx.URL(callback_url)
+    if not callback_host_allowed(callback_url):
+        raise CallbackNotAllowedError(f"{url.host} is not in JOB_CALLBACK_ALLOWED_HOSTS")
+    address = await _resolve_callback_address(url)
+
+    # Connect to the checked address; Host and TLS SNI (and the certificate check) keep the name
+    return await _get_callback_client().post(
+        url.copy_with(host=address),
+        content=body,
+        headers={**headers, "Host": url.netloc.decode("ascii")},
+        extensions={"sni_hostname": url.host}
+    )
+
+
+async def deliver_callback(job: GenerationJob):
+    """POST the finished job to its callback URL, retrying a few times"""
+    if not job.callback_url:
+        return
+
+    payload = job_payload(job)
+    payload.pop("callback_status")
+    body = json.dumps(payload).encode("utf-8")
+    headers = {"Content-Type": "application/json", "X-Job-Id": job.id}
+    if JOB_CALLBACK_SECRET:
+        signature = hmac.new(JOB_CALLBACK_SECRET.encode("utf-8"), body, hashlib.sha256).hexdigest()
+        headers["X-Signature"] = f"sha256={signature}"
+
+    status = "failed"
+    for attempt in range(JOB_CALLBACK_ATTEMPTS):
+        try:
+            response = await _post_callback(job.callback_url, body, headers)
+            if response.status_code < 300:
+                status = "delivered"
+                break
+            status = f"failed: HTTP {response.status_code}"
+        except CallbackNotAllowedError as e:
+            logger.warning("Refusing callback for job %s: %s", job.id, e)
+            status = "failed: callback not allowed"
+            break
+        except Exception as e:
+            status = f"failed: {type(e).__name__}"
+        if attempt + 1 < JOB_CALLBACK_ATTEMPTS:
+            await asyncio.sleep(2 ** attempt)
+
+    job.callback_status = status
+    await GenerationJob.get_motor_collection().update_one(
+        {"_id": job.id},
+        {"$set": {"callback_status": status}}
+    )
+
+
+async def _run_worker(owner: str):
+    while True:
+        try:
+            job = await claim_job(owner)
+        except Exception as e:
+            logger.warning("Failed to claim generation job: %s", e)
+            job = None
+
+        if job is None:
+            # Idle until a job is enqueued here or the poll interval passes (jobs from other processes)
+            try:
+                await asyncio.wait_for(_job_available.wait(), JOB_POLL_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            _job_available.clear()
+            continue
+
+        # Log lines written while the job runs carry its id as their request id
+        token = bind_request_id(f"job-{job.id}")
+        try:
+            await process_job(job, owner)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Generation worker %s failed on job %s", owner, job.id)
+        finally:
+            request_id_var.reset(token)
+
+
+def start_job_workers():
+    """Start the generation workers of this process"""
+    global _job_available
+    if _job_available is None:
+        _job_available = asyncio.Event()
+    for index in range(JOB_WORKERS - len(_workers)):
+        _workers.append(asyncio.ensure_future(_run_worker(f"{PROCESS_ID}-{index}")))
+
+
+async def stop_job_workers():
+    """Stop the workers; jobs they were running are handed back to the queue"""
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+
+    global _callback_client
+    if _callback_client is not None:
+        await _callback_client.aclose()
+        _callback_client = None
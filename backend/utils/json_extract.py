@@ -0,0 +1,106 @@
+import re
+import json
+from typing import Any, List, Optional
+
+_CLOSERS = {'{': '}', '[': ']'}
+
+# A whole string (possibly cut off at the end of the text) or a structural character
+_TOKEN = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*(?:(")|(\\)?\Z)|[{}\[\],]', re.S)
+
+_decoder = json.JSONDecoder(strict=False)
+
+
+def parse_json_object(text: str) -> Optional[Any]:
+    """
+    Find and parse the outermost JSON object in an LLM response.
+
+    Anything before the first '{' (markdown fences, chatter) and after its matching '}'
+    is ignored. A well-formed object is decoded directly by the C decoder; otherwise a
+    single repair pass respects strings and escapes and fixes common model defects:
+      - trailing commas before '}' or ']' are dropped
+      - raw newlines and tabs inside strings are accepted
+      - a reply cut off by max_tokens is closed: an unterminated string is terminated,
+        and if the last value is incomplete the text is cut back to the last complete
+        element before the open brackets are closed
+    Returns the parsed object, or None if no object can be recovered.
+    """
+    start = text.find('{')
+    if start < 0:
+        return None
+
+    try:
+        return _decoder.raw_decode(text, start)[0]
+    except ValueError:
+        return _repair(text, start)
+
+
+def _repair(text: str, start: int) -> Optional[Any]:
+    """Rebuild the object starting at text[start], jumping between structural characters"""
+    out: List[str] = []
+    stack: List[str] = []
+    # Output length and bracket depth right after the last complete element
+    safe_length = 0
+    safe_depth = 0
+    position = start
+
+    for match in _TOKEN.finditer(text, start):
+        index = match.start()
+        if index > position:
+            out.append(text[position:index])
+        position = match.end()
+        token = match.group()
+        ch = token[0]
+
+        if ch == '"':
+            if match.group(1) is None:
+                # Truncated inside a string: drop a dangling backslash and terminate it
+                if match.group(2):
+                    token = token[:-1]
+                token += '"'
+            out.append(token)
+        elif ch == '{' or ch == '[':
+            stack.append(ch)
+            out.append(ch)
+            safe_length, safe_depth = len(out), len(stack)
+        elif ch == '}' or ch == ']':
+            # Drop a trailing comma before the closing bracket
+            while out and not out[-1].strip():
+                out.pop()
+            if out:
+                out[-1] = out[-1].rstrip()
+                if out[-1] == ',':
+                    out.pop()
+            # Close whatever is open, which also fixes a mismatched bracket
+            out.append(_CLOSERS[stack.pop()])
+            safe_length, safe_depth = len(out), len(stack)
+            if not stack:
+                return _loads("".join(out))
+        else:
+            safe_length, safe_depth = len(out), len(stack)
+            out.append(ch)
+
+    if position < len(text):
+        out.append(text[position:])
+
+    # The object was never closed: most likely the reply was truncated
+    result = _loads(_close(out, stack))
+    if result is not None:
+        return result
+
+    # Cut back to the last complete element and close from there
+    return _loads(_close(out[:safe_length], stack[:safe_depth]))
+
+
+def _close(out: List[str], stack: List[str]) -> str:
+    """Close every open bracket of a truncated object"""
+    text = "".join(out).rstrip()
+    while text.endswith(',') or text.endswith(':'):
+        text = text[:-1].rstrip()
+    return text + "".join(_CLOSERS[opener] for opener in reversed(stack))
+
+
+def _loads(text: str) -> Optional[Any]:
+    try:
+        return _decoder.decode(text)
+    except ValueError:
+        return None
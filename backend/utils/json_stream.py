@@ -0,0 +1,122 @@
+import json
+from typing import Any, List, Optional, Sequence, Tuple
+
+# (key, index, value): index is the position inside a split array, None for whole members
+SectionEvent = Tuple[str, Optional[int], Any]
+
+
+class StreamingObjectParser:
+    """
+    Incrementally parse a JSON object that arrives in chunks.
+
+    Every top-level member is emitted as soon as its value is complete. Members listed
+    in split_arrays (e.g. "modules") are emitted element by element instead, so a long
+    array does not have to finish before its first item is available. Only the member
+    (or array element) currently being read is buffered, so memory stays bounded by the
+    size of the largest section rather than the size of the whole response.
+    Sections that fail to parse are skipped and counted in skipped; done is only set
+    once the closing brace of the object has been read.
+    """
+
+    def __init__(self, split_arrays: Sequence[str] = ()):
+        self.split_arrays = set(split_arrays)
+        self.done = False
+        self.skipped = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._key: Optional[str] = None
+        self._buffer: List[str] = []
+        self._item: List[str] = []
+        self._item_index = 0
+        self._splitting = False
+
+    def feed(self, chunk: str) -> List[SectionEvent]:
+        """Consume a chunk of text and return the sections completed by it"""
+        events: List[SectionEvent] = []
+
+        for ch in chunk:
+            if self.done:
+                break
+
+            # Skip anything before the opening brace (markdown fences, chatter)
+            if self._depth == 0:
+                if ch == '{':
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                self._append(ch)
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._append(ch)
+            elif ch in '{[':
+                self._depth += 1
+                if self._splitting and self._depth == 2:
+                    continue  # opening bracket of the split array itself
+                self._append(ch)
+            elif ch in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._finish_member(events)
+                    self.done = True
+                elif self._splitting and self._depth == 1:
+                    self._finish_item(events)
+                else:
+                    self._append(ch)
+            elif ch == ':' and self._depth == 1 and self._key is None:
+                self._start_value()
+            elif ch == ',' and self._depth == 1:
+                self._finish_member(events)
+            elif ch == ',' and self._splitting and self._depth == 2:
+                self._finish_item(events)
+            else:
+                self._append(ch)
+
+        return events
+
+    def _append(self, ch: str):
+        if self._splitting and self._depth >= 2:
+            self._item.append(ch)
+        elif self._splitting:
+            return  # whitespace between the split array and the next member
+        else:
+            self._buffer.append(ch)
+
+    def _start_value(self):
+        try:
+            self._key = json.loads("".join(self._buffer).strip())
+        except ValueError:
+            self._key = "".join(self._buffer).strip().strip('"')
+        self._buffer = []
+        self._splitting = self._key in self.split_arrays
+        self._item_index = 0
+
+    def _finish_item(self, events: List[SectionEvent]):
+        text = "".join(self._item).strip()
+        self._item = []
+        if not text:
+            return
+        try:
+            events.append((self._key, self._item_index, json.loads(text)))
+        except ValueError:
+            self.skipped += 1  # a malformed element is skipped, the rest of the array still streams
+        self._item_index += 1
+
+    def _finish_member(self, events: List[SectionEvent]):
+        if self._key is not None and not self._splitting:
+            try:
+                events.append((self._key, None, json.loads("".join(self._buffer).strip())))
+            except ValueError:
+                self.skipped += 1
+        self._key = None
+        self._buffer = []
+        self._splitting = False
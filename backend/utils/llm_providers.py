@@ -0,0 +1,533 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import hashlib
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional
+from dotenv import load_dotenv
+
+from utils.http_client import get_http_client
+from utils.resilience import CircuitBreaker, CircuitOpenError, LatencyWindow, RetryPolicy, is_retryable
+from utils.metrics import (
+    CallbackGauge, LLM_HEDGES, LLM_REQUEST_DURATION, LLM_RETRIES, LLM_SHORT_CIRCUITED, LLM_TOKENS
+)
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Which backend serves completions: "openrouter" or "stub" (recorded responses, no network)
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openrouter").lower()
+
+# OpenRouter API configuration
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "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")
+OPENROUTER_API_URL = os.getenv("OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions")
+
+# Recorded responses replayed by the stub provider: a directory with one or more
+# "<kind>.txt" / "<kind>-<n>.txt" files per prompt kind, or a single file replayed for every prompt
+STUB_RESPONSES_PATH = os.getenv(
+    "STUB_RESPONSES_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "stub_responses")
+)
+STUB_LATENCY_SECONDS = float(os.getenv("STUB_LATENCY_SECONDS", "0"))
+
+# Model used when a tier has no route of its own
+DEFAULT_MODEL = os.getenv("LLM_DEFAULT_MODEL", "mistralai/mistral-7b-instruct:free")  # Using a more reliable free model
+
+# Per-tier model routing, e.g. "tier_pro=mistralai/mixtral-8x7b-instruct,tier_unlimited=..."
+LLM_MODEL_ROUTES = os.getenv(
+    "LLM_MODEL_ROUTES",
+    "tier_pro=mistralai/mixtral-8x7b-instruct,tier_unlimited=mistralai/mixtral-8x7b-instruct"
+)
+
+# Upstream resilience: every attempt gets its own timeout, and timeouts, connection
+# errors, 429 and 5xx are retried with jittered exponential backoff
+LLM_ATTEMPT_TIMEOUT_SECONDS = float(os.getenv("LLM_ATTEMPT_TIMEOUT_SECONDS", "45"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY_SECONDS = float(os.getenv("LLM_RETRY_BASE_DELAY_SECONDS", "0.5"))
+LLM_RETRY_MAX_DELAY_SECONDS = float(os.getenv("LLM_RETRY_MAX_DELAY_SECONDS", "8"))
+
+# Consecutive failures that open the circuit (0 disables it) and how long it stays open
+LLM_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("LLM_CIRCUIT_FAILURE_THRESHOLD", "5"))
+LLM_CIRCUIT_RESET_SECONDS = float(os.getenv("LLM_CIRCUIT_RESET_SECONDS", "30"))
+
+# Hedged requests: when a completion takes longer than LLM_HEDGE_AFTER_SECONDS (or, if 0,
+# the model's recent p95 latency) a second request goes to LLM_HEDGE_MODEL (empty: the
+# same model) and the first answer wins
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "false").lower() == "true"
+LLM_HEDGE_AFTER_SECONDS = float(os.getenv("LLM_HEDGE_AFTER_SECONDS", "0"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_MODEL = os.getenv("LLM_HEDGE_MODEL", "")
+
+
+class Completion(NamedTuple):
+    """Result of a chat completion"""
+    text: str
+    model: str
+    finish_reason: Optional[str]
+    prompt_tokens: int
+    completion_tokens: int
+    latency: float
+
+
+class LLMProvider:
+    """
+    Interface of a completion backend.
+    Providers record request counts, failures, latency and token usage.
+    """
+
+    name = "base"
+
+    def __init__(self):
+        self.stats = {
+            "requests": 0,
+            "failures": 0,
+            "latency_seconds_total": 0.0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0
+        }
+
+    async def complete(self, messages: List[Dict[str, str]], model: str,
+                       max_tokens: int, temperature: float) -> Completion:
+        """Return the full completion for the given messages"""
+        raise NotImplementedError
+
+    def stream(self, messages: List[Dict[str, str]], model: str,
+               max_tokens: int, temperature: float) -> AsyncIterator[str]:
+        """Yield the completion text one delta at a time"""
+        raise NotImplementedError
+
+    def _record(self, started: float, model: str, prompt_tokens: int = 0, completion_tokens: int = 0,
+                failed: bool = False):
+        elapsed = time.perf_counter() - started
+        self.stats["requests"] += 1
+        self.stats["latency_seconds_total"] += elapsed
+        self.stats["prompt_tokens"] += prompt_tokens
+        self.stats["completion_tokens"] += completion_tokens
+        if failed:
+            self.stats["failures"] += 1
+
+        LLM_REQUEST_DURATION.observe(elapsed, (self.name, model, "failure" if failed else "success"))
+        if prompt_tokens:
+            LLM_TOKENS.inc((self.name, "prompt"), prompt_tokens)
+        if completion_tokens:
+            LLM_TOKENS.inc((self.name, "completion"), completion_tokens)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Usage counters, including the average latency"""
+        requests = self.stats["requests"]
+        return dict(
+            self.stats,
+            provider=self.name,
+            avg_latency_seconds=round(self.stats["latency_seconds_total"] / requests, 4) if requests else 0.0
+        )
+
+
+class OpenRouterProvider(LLMProvider):
+    """Completions from the OpenRouter chat completions API"""
+
+    name = "openrouter"
+
+    def __init__(self, api_url: str = OPENROUTER_API_URL, api_key: str = OPENROUTER_API_KEY):
+        super().__init__()
+        self.api_url = api_url
+        self.api_key = api_key
+
+    def _headers(self) -> Dict[str, str]:
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+    async def complete(self, messages: List[Dict[str, str]], model: str,
+                       max_tokens: int, temperature: float) -> Completion:
+        started = time.perf_counter()
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }
+
+        try:
+            client = get_http_client(self.api_url)
+            response = await client.post(self.api_url, headers=self._headers(), json=payload)
+            response.raise_for_status()
+            result = response.json()
+        except Exception:
+            self._record(started, model, failed=True)
+            raise
+
+        choice = (result.get("choices") or [{}])[0]
+        usage = result.get("usage") or {}
+        prompt_tokens = int(usage.get("prompt_tokens") or 0)
+        completion_tokens = int(usage.get("completion_tokens") or 0)
+        self._record(started, model, prompt_tokens, completion_tokens)
+
+        return Completion(
+            text=choice.get("message", {}).get("content") or "",
+            model=result.get("model") or model,
+            finish_reason=choice.get("finish_reason"),
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            latency=time.perf_counter() - started
+        )
+
+    async def stream(self, messages: List[Dict[str, str]], model: str,
+                     max_tokens: int, temperature: float) -> AsyncIterator[str]:
+        started = time.perf_counter()
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True
+        }
+        completion_tokens = 0
+
+        try:
+            client = get_http_client(self.api_url)
+            async with client.stream("POST", self.api_url, headers=self._headers(), json=payload) as response:
+                response.raise_for_status()
+
+                # OpenRouter sends server-sent events: "data: {...}" lines and ": comment" keep-alives
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[5:].strip()
+                    if data == "[DONE]":
+                        break
+                    try:
+                        chunk = json.loads(data)
+                    except ValueError:
+                        continue
+                    delta = (chunk.get("choices") or [{}])[0].get("delta", {}).get("content")
+                    if delta:
+                        completion_tokens += 1
+                        yield delta
+        except Exception:
+            self._record(started, model, completion_tokens=completion_tokens, failed=True)
+            raise
+
+        # Streams carry no usage block; every delta is counted as one token
+        self._record(started, model, completion_tokens=completion_tokens)
+
+
+class StubProvider(LLMProvider):
+    """
+    Deterministic local backend that replays recorded responses.
+    Prompts are told apart by kind (full course, fan-out outline, module and extras,
+    topic and module replacement) and answered with a recording of that kind; within
+    a kind the same prompt always gets the same recording, so tests and benchmarks can
+    run without network access.
+    """
+
+    name = "stub"
+
+    # Checked in order against the prompt; anything else is a full course request
+    PROMPT_KINDS = (
+        ("outline", "Create the outline of a structured course"),
+        ("module_replace", "Write one new module that replaces"),
+        ("module", "Write the module \""),
+        ("topic", "Suggest one new topic"),
+        ("extras", '{"faqs":'),
+    )
+
+    def __init__(self, responses_path: str = STUB_RESPONSES_PATH, latency: float = STUB_LATENCY_SECONDS):
+        super().__init__()
+        self.responses = self._load_responses(responses_path)
+        self.latency = latency
+
+    @classmethod
+    def _load_responses(cls, path: str) -> Dict[str, List[str]]:
+        """Recordings by prompt kind; files without a known kind in their name are full courses"""
+        if os.path.isdir(path):
+            files = sorted(
+                os.path.join(path, name) for name in os.listdir(path) if name.endswith(".txt")
+            )
+        else:
+            files = [path]
+
+        kinds = {kind for kind, _ in cls.PROMPT_KINDS}
+        responses: Dict[str, List[str]] = {}
+        for file_path in files:
+            kind = os.path.splitext(os.path.basename(file_path))[0].split("-")[0]
+            with open(file_path, encoding="utf-8") as f:
+                responses.setdefault(kind if kind in kinds else "course", []).append(f.read())
+
+        if not responses.get("course"):
+            raise ValueError(f"No recorded course responses found in {path}")
+        return responses
+
+    @classmethod
+    def prompt_kind(cls, messages: List[Dict[str, str]]) -> str:
+        prompt = messages[0]["content"] if messages else ""
+        for kind, marker in cls.PROMPT_KINDS:
+            if marker in prompt:
+                return kind
+        return "course"
+
+    def pick_response(self, messages: List[Dict[str, str]]) -> str:
+        """Choose a recording of the prompt's kind from a hash of the prompt"""
+        responses = self.responses.get(self.prompt_kind(messages)) or self.responses["course"]
+        digest = hashlib.sha256(json.dumps(messages, sort_keys=True).encode("utf-8")).digest()
+        return responses[int.from_bytes(digest[:4], "big") % len(responses)]
+
+    async def complete(self, messages: List[Dict[str, str]], model: str,
+                       max_tokens: int, temperature: float) -> Completion:
+        started = time.perf_counter()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        text = self.pick_response(messages)
+        prompt_tokens = sum(len(message["content"].split()) for message in messages)
+        completion_tokens = len(text.split())
+        self._record(started, model, prompt_tokens, completion_tokens)
+
+        return Completion(
+            text=text,
+            model=model,
+            finish_reason="stop",
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            latency=time.perf_counter() - started
+        )
+
+    async def stream(self, messages: List[Dict[str, str]], model: str,
+                     max_tokens: int, temperature: float) -> AsyncIterator[str]:
+        started = time.perf_counter()
+        text = self.pick_response(messages)
+        chunks = [text[i:i + 16] for i in range(0, len(text), 16)]
+        delay = self.latency / len(chunks) if self.latency and chunks else 0
+
+        for chunk in chunks:
+            if delay:
+                await asyncio.sleep(delay)
+            yield chunk
+
+        self._record(started, model, completion_tokens=len(chunks))
+
+
+class ResilientProvider(LLMProvider):
+    """
+    Wraps a provider with per-attempt timeouts, retries, a circuit breaker and
+    optional hedged requests. Raises CircuitOpenError without calling upstream
+    while the provider is known to be failing.
+    """
+
+    def __init__(self, inner: LLMProvider):
+        super().__init__()
+        self.inner = inner
+        self.name = inner.name
+        self.attempt_timeout = LLM_ATTEMPT_TIMEOUT_SECONDS
+        self.retry_policy = RetryPolicy(LLM_MAX_RETRIES, LLM_RETRY_BASE_DELAY_SECONDS, LLM_RETRY_MAX_DELAY_SECONDS)
+        self.breaker = CircuitBreaker(inner.name, LLM_CIRCUIT_FAILURE_THRESHOLD, LLM_CIRCUIT_RESET_SECONDS)
+        self.hedge_enabled = LLM_HEDGE_ENABLED
+        self.latencies: Dict[str, LatencyWindow] = {}
+        self.stats = {"retries": 0, "timeouts": 0, "hedged": 0, "hedge_wins": 0}
+
+    def _before_call(self):
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            LLM_SHORT_CIRCUITED.inc((self.name,))
+            raise
+
+    def _record_outcome(self, error: BaseException):
+        """Count an upstream failure against the circuit; other errors mean upstream answered"""
+        if isinstance(error, asyncio.TimeoutError):
+            self.stats["timeouts"] += 1
+        if is_retryable(error):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def _hedge_delay(self, model: str) -> Optional[float]:
+        if not self.hedge_enabled:
+            return None
+        if LLM_HEDGE_AFTER_SECONDS > 0:
+            return LLM_HEDGE_AFTER_SECONDS
+        window = self.latencies.get(model)
+        if window is None or len(window) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return window.percentile(0.95)
+
+    async def _attempt(self, messages: List[Dict[str, str]], model: str,
+                       max_tokens: int, temperature: float) -> Completion:
+        return await asyncio.wait_for(
+            self.inner.complete(messages, model, max_tokens, temperature),
+            self.attempt_timeout
+        )
+
+    async def _hedged_attempt(self, messages: List[Dict[str, str]], model: str,
+                              max_tokens: int, temperature: float) -> Completion:
+        """One attempt, with a backup request once the primary is slower than the hedge delay"""
+        hedge_delay = self._hedge_delay(model)
+        if hedge_delay is None:
+            return await self._attempt(messages, model, max_tokens, temperature)
+
+        primary = asyncio.ensure_future(self._attempt(messages, model, max_tokens, temperature))
+        pending = {primary}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=hedge_delay)
+            if done:
+                return primary.result()
+
+            self.stats["hedged"] += 1
+            backup = asyncio.ensure_future(
+                self._attempt(messages, LLM_HEDGE_MODEL or model, max_tokens, temperature)
+            )
+            pending.add(backup)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup:
+                            self.stats["hedge_wins"] += 1
+                        LLM_HEDGES.inc((self.name, "backup" if task is backup else "primary"))
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # The slower request is abandoned
+            for task in pending:
+                task.cancel()
+
+    async def complete(self, messages: List[Dict[str, str]], model: str,
+                       max_tokens: int, temperature: float) -> Completion:
+        attempt = 0
+        while True:
+            self._before_call()
+            try:
+                completion = await self._hedged_attempt(messages, model, max_tokens, temperature)
+            except asyncio.CancelledError:
+                # Cancelled callers (client gone, shutdown) must not keep the half-open trial
+                self.breaker.release_trial()
+                raise
+            except Exception as e:
+                self._record_outcome(e)
+                if attempt >= self.retry_policy.max_retries or not is_retryable(e):
+                    raise
+                delay = self.retry_policy.delay(attempt, e)
+                logger.warning("LLM request failed (%s: %s), retrying in %.2fs", type(e).__name__, e, delay)
+                self.stats["retries"] += 1
+                LLM_RETRIES.inc((self.name,))
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+
+            self.breaker.record_success()
+            self.latencies.setdefault(model, LatencyWindow()).add(completion.latency)
+            return completion
+
+    async def stream(self, messages: List[Dict[str, str]], model: str,
+                     max_tokens: int, temperature: float) -> AsyncIterator[str]:
+        # Only the wait for the first delta is retried: once text has been relayed
+        # to the client the stream cannot be restarted
+        attempt = 0
+        while True:
+            self._before_call()
+            deltas = self.inner.stream(messages, model, max_tokens, temperature).__aiter__()
+            try:
+                first = await asyncio.wait_for(deltas.__anext__(), self.attempt_timeout)
+            except StopAsyncIteration:
+                self.breaker.record_success()
+                return
+            except asyncio.CancelledError:
+                self.breaker.release_trial()
+                await deltas.aclose()
+                raise
+            except Exception as e:
+                await deltas.aclose()
+                self._record_outcome(e)
+                if attempt >= self.retry_policy.max_retries or not is_retryable(e):
+                    raise
+                self.stats["retries"] += 1
+                LLM_RETRIES.inc((self.name,))
+                attempt += 1
+                await asyncio.sleep(self.retry_policy.delay(attempt - 1, e))
+                continue
+            break
+
+        try:
+            yield first
+            async for delta in deltas:
+                yield delta
+        except Exception as e:
+            self._record_outcome(e)
+            raise
+        except BaseException:
+            # Cancelled, or closed early by the consumer (GeneratorExit)
+            self.breaker.release_trial()
+            raise
+        finally:
+            await deltas.aclose()
+        self.breaker.record_success()
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = self.inner.get_stats()
+        stats["resilience"] = dict(self.stats, circuit=self.breaker.get_stats())
+        return stats
+
+
+def _parse_routes(value: str) -> Dict[str, str]:
+    """Parse LLM_MODEL_ROUTES into a {tier_id: model} map"""
+    routes = {}
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        tier_id, model = item.split("=", 1)
+        routes[tier_id.strip()] = model.strip()
+    return routes
+
+
+_model_routes = _parse_routes(LLM_MODEL_ROUTES)
+_providers: Dict[str, LLMProvider] = {}
+
+
+def select_model(tier_id: Optional[str]) -> str:
+    """Pick the model for a request: free users get the fast small model, paid tiers their route"""
+    if tier_id and tier_id in _model_routes:
+        return _model_routes[tier_id]
+    return DEFAULT_MODEL
+
+
+def get_provider(name: Optional[str] = None) -> LLMProvider:
+    """Get the configured provider (created on first use)"""
+    name = (name or LLM_PROVIDER).lower()
+    provider = _providers.get(name)
+    if provider is None:
+        if name == "stub":
+            provider = StubProvider()
+        elif name == "openrouter":
+            provider = OpenRouterProvider()
+        else:
+            raise ValueError(f"Unknown LLM provider: {name}")
+        provider = ResilientProvider(provider)
+        _providers[name] = provider
+    return provider
+
+
+def _circuit_states() -> Dict[tuple, float]:
+    return {
+        (provider.name,): 0.0 if provider.breaker.state == CircuitBreaker.CLOSED else 1.0
+        for provider in _providers.values()
+        if isinstance(provider, ResilientProvider)
+    }
+
+
+CallbackGauge("llm_circuit_open", "Whether the provider's circuit breaker is open or half-open", ("provider",),
+              _circuit_states)
+
+
+def circuit_retry_after() -> float:
+    """Seconds the configured provider's circuit stays open (0 when it accepts calls)"""
+    provider = get_provider()
+    return provider.breaker.retry_after() if isinstance(provider, ResilientProvider) else 0.0
+
+
+def provider_stats() -> List[Dict[str, Any]]:
+    """Usage counters of every provider used so far"""
+    return [provider.get_stats() for provider in _providers.values()]
@@ -0,0 +1,190 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from utils.metrics import Counter, Histogram, route_template
+
+# Continuous event-loop lag measurement, and a watchdog for callbacks that block the loop
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "true").lower() == "true"
+LOOP_MONITOR_INTERVAL_SECONDS = float(os.getenv("LOOP_MONITOR_INTERVAL_SECONDS", "0.05"))
+
+# A callback running longer than this is reported with its stack and the route being served
+LOOP_BLOCK_THRESHOLD_SECONDS = float(os.getenv("LOOP_BLOCK_THRESHOLD_SECONDS", "0.1"))
+
+# Blocked-loop reports kept for the admin endpoint, and stack frames kept per report
+LOOP_BLOCK_REPORTS = int(os.getenv("LOOP_BLOCK_REPORTS", "50"))
+LOOP_BLOCK_STACK_DEPTH = 30
+
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds", "How late the event loop woke up from a timer", buckets=LAG_BUCKETS
+)
+EVENT_LOOP_BLOCKED = Counter(
+    "event_loop_blocked_total", "Callbacks that blocked the event loop past the threshold", ("route",)
+)
+
+logger = logging.getLogger(__name__)
+
+# ASGI scope of the request each task is serving; read by the watchdog thread
+_task_scopes: Dict[asyncio.Task, Dict[str, Any]] = {}
+
+
+class TaskRouteMiddleware:
+    """Pure ASGI middleware recording which request each task serves, for the watchdog"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        task = asyncio.current_task()
+        if scope["type"] != "http" or task is None:
+            await self.app(scope, receive, send)
+            return
+
+        _task_scopes[task] = scope
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _task_scopes.pop(task, None)
+
+
+class LoopMonitor:
+    """
+    A task on the event loop wakes up every interval and records how late it was.
+    A watchdog thread checks that the task keeps waking up; when the loop has been
+    stuck for longer than the threshold it captures the loop thread's stack and the
+    route of the running task, while the blocking call is still on the stack.
+    """
+
+    def __init__(self, interval: float, threshold: float, max_reports: int):
+        self.interval = interval
+        self.threshold = threshold
+        self.reports: deque = deque(maxlen=max_reports)
+        self.stats = {"blocked": 0, "max_lag_seconds": 0.0}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        # When the monitor task last went to sleep, and the report of the stall in progress
+        self._beat: Optional[float] = None
+        self._stall: Optional[Dict[str, Any]] = None
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._stop.clear()
+        self._task = asyncio.ensure_future(self._measure())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._beat = None
+
+    async def _measure(self):
+        while True:
+            started = time.monotonic()
+            self._beat = started
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - started - self.interval)
+            EVENT_LOOP_LAG.observe(lag)
+            if lag > self.stats["max_lag_seconds"]:
+                self.stats["max_lag_seconds"] = lag
+
+            stall = self._stall
+            if stall is not None:
+                # The loop is running again: the lag is how long the callback blocked it
+                stall["blocked_seconds"] = round(lag, 4)
+                self._stall = None
+                logger.warning("Event loop blocked for %.3fs", lag, extra={
+                    "route": stall["route"], "task": stall["task"], "stack": "".join(stall["stack"][-5:])
+                })
+
+    def _watch(self):
+        while not self._stop.wait(self.threshold / 2):
+            beat = self._beat
+            if beat is None or self._stall is not None:
+                continue
+            if time.monotonic() - beat > self.interval + self.threshold:
+                self._capture(beat)
+
+    def _capture(self, beat: float):
+        """Runs in the watchdog thread while the loop thread is blocked"""
+        frame = sys._current_frames().get(self._loop_thread)
+        task = asyncio.current_task(self._loop)
+        if frame is None or self._beat != beat:
+            # The loop woke up in the meantime
+            return
+
+        scope = _task_scopes.get(task) if task is not None else None
+        if scope is not None:
+            route = f"{scope['method']} {route_template(scope)}"
+        else:
+            route = "background"
+
+        self._stall = {
+            "detected_at": datetime.utcnow().isoformat(),
+            "route": route,
+            "path": scope["path"] if scope is not None else None,
+            "task": task.get_coro().__qualname__ if task is not None else None,
+            "blocked_seconds": None,
+            "stack": traceback.format_stack(frame)[-LOOP_BLOCK_STACK_DEPTH:],
+        }
+        self.reports.append(self._stall)
+        self.stats["blocked"] += 1
+        EVENT_LOOP_BLOCKED.inc((route,))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Lag histogram, blocked callbacks by route and the most recent reports"""
+        counts, total = EVENT_LOOP_LAG.totals().get((), [[0] * (len(LAG_BUCKETS) + 1), 0.0])
+        observations = sum(counts)
+        return {
+            "enabled": self._task is not None,
+            "interval_seconds": self.interval,
+            "threshold_seconds": self.threshold,
+            "lag": {
+                "count": observations,
+                "mean_seconds": total / observations if observations else 0.0,
+                "max_seconds": self.stats["max_lag_seconds"],
+                "buckets": {
+                    str(bound): count for bound, count in zip(LAG_BUCKETS + ("+Inf",), counts)
+                },
+            },
+            "blocked": self.stats["blocked"],
+            "blocked_by_route": {labels[0]: int(count) for labels, count in EVENT_LOOP_BLOCKED.values().items()},
+            "recent_blocks": list(reversed(self.reports)),
+        }
+
+
+loop_monitor = LoopMonitor(LOOP_MONITOR_INTERVAL_SECONDS, LOOP_BLOCK_THRESHOLD_SECONDS, LOOP_BLOCK_REPORTS)
+
+
+def start_loop_monitor():
+    """Start measuring the lag of the running event loop (no-op when disabled)"""
+    if LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
+
+
+async def stop_loop_monitor():
+    await loop_monitor.stop()
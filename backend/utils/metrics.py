@@ -0,0 +1,323 @@
+import os
+import time
+import bisect
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+from pymongo import monitoring
+
+# Request latency buckets, in seconds (LLM calls run for tens of seconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+# Bearer token required by GET /metrics (empty: open, e.g. behind a private network)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+LabelValues = Tuple[str, ...]
+
+_registry: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        _registry.append(self)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+
+class _Sharded(_Metric):
+    """
+    Metric whose values are written to one shard per thread, so updates take no lock:
+    the event loop, the bcrypt pool and Motor's executor threads each write their own
+    shard, and the shards are summed when the metrics are rendered.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._shards: Dict[int, Dict[LabelValues, Any]] = {}
+
+    def _shard(self) -> Dict[LabelValues, Any]:
+        ident = threading.get_ident()
+        shard = self._shards.get(ident)
+        if shard is None:
+            shard = self._shards.setdefault(ident, {})
+        return shard
+
+
+class Counter(_Sharded):
+    """Monotonically increasing count"""
+
+    type = "counter"
+
+    def inc(self, labels: LabelValues = (), amount: float = 1.0):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0.0) + amount
+
+    def values(self) -> Dict[LabelValues, float]:
+        totals: Dict[LabelValues, float] = {}
+        for shard in list(self._shards.values()):
+            for labels, value in list(shard.items()):
+                totals[labels] = totals.get(labels, 0.0) + value
+        return totals
+
+    def _samples(self) -> Iterable[str]:
+        for labels, value in sorted(self.values().items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram(_Sharded):
+    """Distribution of observed values in cumulative buckets"""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, labels: LabelValues = ()):
+        shard = self._shard()
+        entry = shard.get(labels)
+        if entry is None:
+            # Per-bucket counts (the last one is +Inf) and the sum of observations
+            entry = shard[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def totals(self) -> Dict[LabelValues, list]:
+        """Per-bucket counts (not cumulative) and the sum of observations, by labels"""
+        totals: Dict[LabelValues, list] = {}
+        for shard in list(self._shards.values()):
+            for labels, (counts, total) in list(shard.items()):
+                merged = totals.setdefault(labels, [[0] * len(counts), 0.0])
+                merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                merged[1] += total
+        return totals
+
+    def _samples(self) -> Iterable[str]:
+        bounds = self.buckets + (float("inf"),)
+        for labels, (counts, total) in sorted(self.totals().items()):
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Gauge(_Metric):
+    """Value that goes up and down; only updated from the event loop"""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, labels: LabelValues = ()):
+        self._values[labels] = value
+
+    def inc(self, labels: LabelValues = (), amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, labels: LabelValues = (), amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) - amount
+
+    def _samples(self) -> Iterable[str]:
+        for labels, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class CallbackGauge(_Metric):
+    """Gauge read from a function when the metrics are rendered, e.g. cache counters"""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str],
+                 callback: Callable[[], Dict[LabelValues, float]]):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def _samples(self) -> Iterable[str]:
+        try:
+            values = self.callback()
+        except Exception:
+            return
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class CallbackCounter(CallbackGauge):
+    """Counter kept elsewhere (e.g. in a cache) and read when the metrics are rendered"""
+
+    type = "counter"
+
+
+# Hit/miss counters of in-process caches, by cache name
+_cache_sources: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+
+def register_cache(name: str, stats: Callable[[], Dict[str, Any]]):
+    """Export a cache's counters; stats must return a dict with "hits" and "misses" """
+    _cache_sources[name] = stats
+
+
+def _cache_lookups() -> Dict[LabelValues, float]:
+    values = {}
+    for name, stats in _cache_sources.items():
+        counters = stats()
+        values[(name, "hit")] = counters["hits"]
+        values[(name, "miss")] = counters["misses"]
+    return values
+
+
+def _cache_hit_ratios() -> Dict[LabelValues, float]:
+    values = {}
+    for name, stats in _cache_sources.items():
+        counters = stats()
+        lookups = counters["hits"] + counters["misses"]
+        values[(name,)] = counters["hits"] / lookups if lookups else 0.0
+    return values
+
+
+def render_metrics() -> str:
+    """Every registered metric in the Prometheus text format"""
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# HTTP
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests", ("method", "route", "status"))
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP request latency until the response is complete", ("method", "route")
+)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests being served")
+
+# MongoDB
+MONGO_COMMAND_DURATION = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency", ("command",), buckets=FAST_BUCKETS
+)
+MONGO_COMMAND_FAILURES = Counter("mongodb_command_failures_total", "Failed MongoDB commands", ("command",))
+
+# LLM provider
+LLM_REQUEST_DURATION = Histogram(
+    "llm_request_duration_seconds", "LLM completion latency per attempt", ("provider", "model", "outcome")
+)
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens used by LLM completions", ("provider", "kind"))
+LLM_RETRIES = Counter("llm_retries_total", "Retried LLM requests", ("provider",))
+LLM_HEDGES = Counter("llm_hedged_requests_total", "Hedged LLM requests, by whether the backup won", ("provider", "winner"))
+LLM_SHORT_CIRCUITED = Counter("llm_short_circuited_total", "LLM calls refused by an open circuit", ("provider",))
+COURSE_FALLBACKS = Counter("course_fallbacks_total", "Placeholder courses returned after a generation error")
+COURSE_CONTINUATIONS = Counter("course_continuations_total", "Continuations requested for truncated courses")
+
+# Password hashing
+PASSWORD_HASH_DURATION = Histogram(
+    "password_hash_duration_seconds", "bcrypt hash/verify latency including the wait for a worker",
+    ("operation",), buckets=FAST_BUCKETS
+)
+PASSWORD_HASH_REJECTED = Counter("password_hash_rejected_total", "Password hashing jobs rejected with 503")
+
+
+# Caches
+CallbackCounter("cache_lookups_total", "Cache lookups by result", ("cache", "result"), _cache_lookups)
+CallbackGauge("cache_hit_ratio", "Share of cache lookups that were hits", ("cache",), _cache_hit_ratios)
+
+
+# Path template of each route endpoint, filled on first use
+_route_paths: Dict[Any, str] = {}
+
+
+def route_template(scope) -> str:
+    """
+    Path template of the route that served a request (e.g. /courses/{course_id}), so
+    labels stay bounded; "unmatched" before routing or when no route matched.
+    """
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    path = _route_paths.get(endpoint)
+    if path is None:
+        _route_paths.update(
+            (getattr(route, "endpoint", None), route.path) for route in scope["app"].routes
+        )
+        path = _route_paths.get(endpoint, "unmatched")
+    return path
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording latency, status and in-flight requests per route.
+    Routes are labelled with their path template (e.g. /courses/{course_id}) so the
+    number of series stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = route_template(scope)
+            method = scope["method"]
+            HTTP_REQUESTS.inc((method, route, str(status_code)))
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, (method, route))
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every MongoDB command; register with the client's event_listeners"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_COMMAND_DURATION.observe(event.duration_micros / 1_000_000, (event.command_name,))
+
+    def failed(self, event):
+        MONGO_COMMAND_DURATION.observe(event.duration_micros / 1_000_000, (event.command_name,))
+        MONGO_COMMAND_FAILURES.inc((event.command_name,))
@@ -1,21 +1,74 @@
 import os
-import requests
+import copy
 import json
-import re
-from typing import List, Dict, Any
+import logging
+from typing import List, Dict, Any, AsyncIterator, Optional, Tuple
 from dotenv import load_dotenv
 
+from utils.llm_providers import get_provider, select_model
+from utils.course_cache import (
+    make_cache_key, get_cached_course, store_course, COURSE_CACHE_ENABLED, COURSE_CACHE_PERSISTENT
+)
+from utils.singleflight import SingleFlight
+from utils.json_extract import parse_json_object
+from utils.resilience import CircuitOpenError
+from utils.token_budget import CoursePlan, plan_course
+from utils.metrics import COURSE_CONTINUATIONS, COURSE_FALLBACKS
+
+logger = logging.getLogger(__name__)
+
 load_dotenv()
 
-# API configuration
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "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")
-OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+# Completion settings (the provider and model are chosen in utils.llm_providers)
+COURSE_MAX_TOKENS = 2000  # Default budget; full courses are sized by utils.token_budget
+COURSE_TEMPERATURE = 0.7
 
-async def generate_course_with_ai(topic: str, experience_level: str, available_time: str) -> Dict[str, Any]:
-    """
-    Generate a complete course structure using OpenRouter AI
-    """
-    prompt = f"""Create a structured course about {topic} for a {experience_level} learner with {available_time} of study time available.
+# A course cut off by max_tokens is continued from where it stopped, at most this many times
+COURSE_MAX_CONTINUATIONS = int(os.getenv("COURSE_MAX_CONTINUATIONS", "2"))
+CONTINUATION_MAX_TOKENS = int(os.getenv("CONTINUATION_MAX_TOKENS", "800"))
+
+# Token budgets for regenerating a single section of an existing course
+TOPIC_MAX_TOKENS = 60
+MODULE_MAX_TOKENS = 400
+
+# Longest roadmap topic accepted from the model
+TOPIC_MAX_LENGTH = 120
+
+# Bump whenever the course prompt changes so cached courses are not reused
+PROMPT_TEMPLATE_VERSION = "2"
+
+# "single" generates a course with one completion, "fanout" with an outline followed by concurrent module calls
+COURSE_PIPELINE = os.getenv("COURSE_PIPELINE", "single").lower()
+
+# Concurrent identical generations share one upstream call; the MongoDB lock extends this across workers
+SINGLEFLIGHT_DISTRIBUTED = os.getenv("SINGLEFLIGHT_DISTRIBUTED", "false").lower() == "true"
+SINGLEFLIGHT_LOCK_TTL_SECONDS = float(os.getenv("SINGLEFLIGHT_LOCK_TTL_SECONDS", "120"))
+
+# Waiting workers pick the result up from the persistent cache; without it they would
+# wait for the lock and then call upstream anyway, so only coalesce within the process
+if SINGLEFLIGHT_DISTRIBUTED and not (COURSE_CACHE_ENABLED and COURSE_CACHE_PERSISTENT):
+    logger.warning("SINGLEFLIGHT_DISTRIBUTED needs the persistent course cache, ignoring it")
+    SINGLEFLIGHT_DISTRIBUTED = False
+
+course_flight = SingleFlight(
+    distributed=SINGLEFLIGHT_DISTRIBUTED,
+    lock_ttl=SINGLEFLIGHT_LOCK_TTL_SECONDS,
+    wait_timeout=SINGLEFLIGHT_LOCK_TTL_SECONDS
+)
+
+# Fields every generated course must contain
+REQUIRED_FIELDS = [
+    "title", "objective", "prerequisites", "definitions",
+    "roadmap", "modules", "resources", "faqs", "errors",
+    "downloads", "summary"
+]
+LIST_FIELDS = ["prerequisites", "definitions", "modules", "resources", "faqs", "errors", "downloads"]
+
+def build_course_prompt(topic: str, experience_level: str, available_time: str,
+                        plan: Optional[CoursePlan] = None) -> str:
+    """Build the prompt used to generate a full course, sized by the course plan"""
+    plan = plan or plan_course(experience_level, available_time)
+    return f"""Create a structured course about {topic} for a {experience_level} learner with {available_time} of study time available.
 
 Your output should be a structured JSON with the following format:
 {{
@@ -41,142 +94,273 @@ Your output should be a structured JSON with the following format:
 
 Only respond with the valid JSON, with no explanation or additional text.
 Do not include any markdown formatting or code blocks, just the JSON object.
-Ensure it's detailed and comprehensive but reasonable for the available time.
+Write exactly {plan.module_count} modules with {plan.steps_per_module} steps each and a roadmap with {plan.roadmap_sections} sections.
+Keep every item short: one sentence per step, definition, FAQ and error.
 """
 
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json"
-    }
+def fill_missing_fields(course_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Add any required course field the model left out"""
+    for field in REQUIRED_FIELDS:
+        if field not in course_data:
+            if field in LIST_FIELDS:
+                course_data[field] = []
+            elif field == "roadmap":
+                course_data[field] = {"Basics": ["Getting Started"]}
+            else:
+                course_data[field] = f"Generated {field}"
+    return course_data
+
+def missing_course_fields(course_data: Dict[str, Any]) -> List[str]:
+    """Required fields the model did not produce (an empty module list counts as missing)"""
+    missing = [field for field in REQUIRED_FIELDS if field not in course_data]
+    if "modules" not in missing and not course_data.get("modules"):
+        missing.append("modules")
+    return missing
 
-    payload = {
-        "model": "mistralai/mistral-7b-instruct:free",  # Using a more reliable free model
-        "messages": [
-            {"role": "user", "content": prompt}
+def build_fallback_course(topic: str, experience_level: str, available_time: str, error: Exception) -> Dict[str, Any]:
+    """Minimal course structure returned when generation fails"""
+    return {
+        "title": f"Course on {topic}",
+        "objective": f"Learn about {topic} at {experience_level} level in {available_time}",
+        "prerequisites": [],
+        "definitions": [],
+        "roadmap": {"Basics": ["Getting Started", "Core Concepts"]},
+        "modules": [
+            {
+                "title": f"Introduction to {topic}",
+                "steps": ["Understand the basics", "Practice with examples"],
+                "example": ""
+            }
         ],
-        "temperature": 0.7,
-        "max_tokens": 2000  # Reducing token count to avoid timeouts
+        "resources": [],
+        "faqs": [],
+        "errors": [f"Note: There was an error generating detailed content: {str(error)}"],
+        "downloads": [],
+        "summary": f"A course on {topic} for {experience_level} learners with {available_time} available."
     }
 
-    try:
-        print(f"Sending request to OpenRouter API for topic: {topic}")
-        response = requests.post(OPENROUTER_API_URL, headers=headers, json=payload)
-        response.raise_for_status()
-        
-        print("Received response from OpenRouter API")
-        result = response.json()
-        ai_response = result.get("choices", [{}])[0].get("message", {}).get("content", "")
-        
-        # Log response for debugging
-        print(f"Response length: {len(ai_response)}")
-        print(f"Response preview: {ai_response[:100]}...")
-        
-        # Extract JSON object from response
-        json_str = extract_json_from_text(ai_response)
-        if not json_str:
-            print("Failed to extract JSON from response")
-            raise ValueError("No valid JSON found in response")
-            
-        # Parse the JSON string
-        course_data = json.loads(json_str)
-        
-        # Validate basic structure
-        required_fields = [
-            "title", "objective", "prerequisites", "definitions", 
-            "roadmap", "modules", "resources", "faqs", "errors", 
-            "downloads", "summary"
-        ]
-        
-        # Add missing fields if needed
-        for field in required_fields:
-            if field not in course_data:
-                if field in ["prerequisites", "definitions", "modules", "resources", "faqs", "errors", "downloads"]:
-                    course_data[field] = []
-                elif field == "roadmap":
-                    course_data[field] = {"Basics": ["Getting Started"]}
-                else:
-                    course_data[field] = f"Generated {field}"
-        
-        print(f"Successfully generated course: {course_data.get('title', 'Unknown title')}")
-        return course_data
-        
-    except Exception as e:
-        print(f"Error generating course: {str(e)}")
-        # Return a minimal structure in case of error
-        return {
-            "title": f"Course on {topic}",
-            "objective": f"Learn about {topic} at {experience_level} level in {available_time}",
-            "prerequisites": [],
-            "definitions": [],
-            "roadmap": {"Basics": ["Getting Started", "Core Concepts"]},
-            "modules": [
-                {
-                    "title": f"Introduction to {topic}",
-                    "steps": ["Understand the basics", "Practice with examples"],
-                    "example": ""
-                }
-            ],
-            "resources": [],
-            "faqs": [],
-            "errors": [f"Note: There was an error generating detailed content: {str(e)}"],
-            "downloads": [],
-            "summary": f"A course on {topic} for {experience_level} learners with {available_time} available."
-        }
-
-def extract_json_from_text(text: str) -> str:
-    """
-    Extract a JSON object from a text response, handling cases where the JSON might be
-    embedded in markdown or surrounded by other text
-    """
-    # Clean up markdown code blocks
-    text = re.sub(r'```json', '', text)
-    text = re.sub(r'```', '', text)
+def course_cache_key(topic: str, experience_level: str, available_time: str, model: str,
+                     pipeline: str = COURSE_PIPELINE) -> str:
+    """Cache key of a full course generated with the given model, pipeline and the current prompt"""
+    return make_cache_key(
+        topic, experience_level, available_time,
+        model, f"{PROMPT_TEMPLATE_VERSION}-{pipeline}"
+    )
+
+async def request_completion(prompt: str, model: str, max_tokens: int = COURSE_MAX_TOKENS) -> str:
+    """
+    Send a prompt to the configured LLM provider and return the text of the completion
+    """
+    completion = await get_provider().complete(
+        messages=[{"role": "user", "content": prompt}],
+        model=model,
+        max_tokens=max_tokens,
+        temperature=COURSE_TEMPERATURE
+    )
+    return completion.text
+
+async def request_completion_with_continuation(prompt: str, model: str,
+                                               max_tokens: int) -> Tuple[str, Optional[str]]:
+    """
+    Send a prompt and return the full text with the finish_reason of its last part.
+    When the reply is cut off by max_tokens (finish_reason "length"), the partial reply
+    is sent back as an assistant prefill so the model continues it instead of starting over.
+    """
+    provider = get_provider()
+    messages = [{"role": "user", "content": prompt}]
+    completion = await provider.complete(
+        messages=messages,
+        model=model,
+        max_tokens=max_tokens,
+        temperature=COURSE_TEMPERATURE
+    )
+    text = completion.text
+
+    continuations = 0
+    while completion.finish_reason == "length" and continuations < COURSE_MAX_CONTINUATIONS:
+        continuations += 1
+        COURSE_CONTINUATIONS.inc()
+        logger.info("Completion cut off after %s tokens, continuing (%s)", completion.completion_tokens, continuations)
+        completion = await provider.complete(
+            messages=messages + [{"role": "assistant", "content": text}],
+            model=model,
+            max_tokens=CONTINUATION_MAX_TOKENS,
+            temperature=COURSE_TEMPERATURE
+        )
+        text += completion.text
+
+    return text, completion.finish_reason
+
+async def request_course_from_ai(topic: str, experience_level: str, available_time: str,
+                                 model: str) -> Tuple[Dict[str, Any], bool]:
+    """
+    Request a course from the LLM provider, raising on any upstream or parsing error.
+    Returns the course and whether it is complete: a reply still cut off after the
+    continuations, or missing required fields, is repaired but should not be cached.
+    """
+    plan = plan_course(experience_level, available_time)
+    prompt = build_course_prompt(topic, experience_level, available_time, plan)
+
+    logger.info("Requesting course", extra={
+        "provider": get_provider().name, "model": model, "topic": topic,
+        "modules": plan.module_count, "max_tokens": plan.max_tokens
+    })
+    ai_response, finish_reason = await request_completion_with_continuation(prompt, model, plan.max_tokens)
+
+    # Sampled: written for a share of requests only (LOG_DEBUG_SAMPLE_RATE)
+    logger.debug("Course response received (%s chars): %.100s", len(ai_response), ai_response)
     
-    # Try to find JSON object boundaries
-    json_start = text.find('{')
-    json_end = text.rfind('}')
+    # Extract and parse the JSON object in one pass, repairing truncated replies
+    course_data = parse_json_object(ai_response)
+    if not isinstance(course_data, dict):
+        logger.warning("No JSON object in course response (%s chars)", len(ai_response))
+        raise ValueError("No valid JSON found in response")
     
-    if json_start >= 0 and json_end > json_start:
-        # Extract the JSON string
-        json_str = text[json_start:json_end+1]
-        try:
-            # Validate by parsing
-            json.loads(json_str)
-            return json_str
-        except:
-            # If parsing fails, log for debugging
-            print(f"Failed to parse extracted JSON: {json_str[:100]}...")
+    # Add missing fields if needed
+    missing = missing_course_fields(course_data)
+    fill_missing_fields(course_data)
     
-    # If direct extraction failed, try a more aggressive approach
+    complete = finish_reason != "length" and not missing
+    if complete:
+        logger.info("Generated course: %s", course_data.get("title", "Unknown title"))
+    else:
+        logger.warning("Generated incomplete course: %s", course_data.get("title", "Unknown title"), extra={
+            "finish_reason": finish_reason, "missing": missing
+        })
+    return course_data, complete
+
+async def generate_course(topic: str, experience_level: str, available_time: str,
+                          tier: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Generate a complete course structure using the model routed for the user's tier,
+    raising on any upstream or parsing error.
+    Identical requests are served from the generation cache without calling the model,
+    and identical requests in flight at the same time share a single upstream call.
+    """
+    model = select_model(tier)
+    cache_key = course_cache_key(topic, experience_level, available_time, model)
+    cached_course = await get_cached_course(cache_key)
+    if cached_course is not None:
+        return cached_course
+
+    async def generate_and_store() -> Dict[str, Any]:
+        if COURSE_PIPELINE == "fanout":
+            from utils.course_pipeline import generate_course_fanout
+            course_data, complete = await generate_course_fanout(topic, experience_level, available_time, model)
+        else:
+            course_data, complete = await request_course_from_ai(topic, experience_level, available_time, model)
+        # A degraded or truncated course is returned to this request but not kept for the next ones
+        if complete:
+            await store_course(cache_key, course_data, model)
+        return course_data
+
+    course_data = await course_flight.do(
+        cache_key,
+        generate_and_store,
+        lookup=lambda: get_cached_course(cache_key)
+    )
+
+    # Every caller gets its own copy of the shared result
+    return copy.deepcopy(course_data)
+
+async def generate_course_with_ai(topic: str, experience_level: str, available_time: str,
+                                  tier: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Generate a course like generate_course, returning a minimal fallback course
+    instead of raising when generation fails
+    """
     try:
-        # Look for structured data in any format
-        print("Attempting to construct valid JSON from response")
-        # Create a fallback JSON with minimal structure
-        fallback_json = {
-            "title": "Generated Course",
-            "objective": "Learn new skills",
-            "prerequisites": [],
-            "definitions": [],
-            "roadmap": {"Basics": ["Getting Started"]},
-            "modules": [{"title": "Introduction", "steps": ["Step 1", "Step 2"], "example": ""}],
-            "resources": [],
-            "faqs": [],
-            "errors": [],
-            "downloads": [],
-            "summary": "Course generated from AI"
-        }
-        
-        # Try to extract meaningful content from the text
-        if len(text) > 0:
-            lines = text.split('\n')
-            for line in lines:
-                if "title" in line.lower() and len(line) > 10:
-                    fallback_json["title"] = line.split(":", 1)[1].strip() if ":" in line else line.strip()
-                    break
-            
-            fallback_json["summary"] = text[:100] + "..." if len(text) > 100 else text
-        
-        return json.dumps(fallback_json)
+        return await generate_course(topic, experience_level, available_time, tier)
+    except CircuitOpenError:
+        # The provider is known to be down: let the caller answer 503 right away
+        raise
     except Exception as e:
-        print(f"Failed to construct fallback JSON: {str(e)}")
-        raise ValueError("No valid JSON found in response") 
\ No newline at end of file
+        logger.exception("Error generating course, returning the fallback course")
+        COURSE_FALLBACKS.inc()
+        # Return a minimal structure in case of error
+        return build_fallback_course(topic, experience_level, available_time, e)
+
+async def stream_course_with_ai(topic: str, experience_level: str, available_time: str,
+                                model: str) -> AsyncIterator[str]:
+    """
+    Stream the raw text of a course completion, one token delta at a time
+    """
+    plan = plan_course(experience_level, available_time)
+    prompt = build_course_prompt(topic, experience_level, available_time, plan)
+
+    logger.info("Streaming course", extra={"provider": get_provider().name, "model": model, "topic": topic})
+    async for delta in get_provider().stream(
+        messages=[{"role": "user", "content": prompt}],
+        model=model,
+        max_tokens=plan.max_tokens,
+        temperature=COURSE_TEMPERATURE
+    ):
+        yield delta
+
+async def generate_topic_with_ai(course_title: str, section: str, current_topic: str,
+                                 experience_level: str, section_topics: List[str],
+                                 tier: Optional[str] = None) -> str:
+    """
+    Generate a replacement for a single roadmap topic the learner already knows.
+    Only the course title and the neighbouring topics are sent, with a small token budget.
+    """
+    other_topics = [topic for topic in section_topics if topic != current_topic]
+    prompt = f"""You are editing the roadmap of the course "{course_title}" for a {experience_level} learner.
+The learner already knows the topic "{current_topic}" from the section "{section}".
+Other topics in this section: {json.dumps(other_topics, ensure_ascii=False)}
+
+Suggest one new topic for this section that is more advanced than "{current_topic}" and not already listed.
+Respond with the topic name only, on a single line, without quotes or explanation.
+"""
+
+    logger.info("Requesting topic replacement for: %s", current_topic)
+    ai_response = await request_completion(prompt, select_model(tier), max_tokens=TOPIC_MAX_TOKENS)
+
+    # Keep the first non-empty line, without list markers or quotes
+    line = next((line.strip() for line in ai_response.splitlines() if line.strip()), "")
+    topic = line.lstrip("-*0123456789. ").strip().strip('"\'`').strip()
+
+    # Anything else would be written into the user's roadmap as is
+    if not topic:
+        raise ValueError("Empty topic in response")
+    if any(ch in topic for ch in "{}[]") or line.startswith("```"):
+        raise ValueError(f"Topic response looks like JSON or markup: {line[:40]!r}")
+    if len(topic) > TOPIC_MAX_LENGTH:
+        raise ValueError(f"Topic response is too long ({len(topic)} chars)")
+    if topic.casefold() in {existing.casefold() for existing in section_topics + [current_topic]}:
+        raise ValueError(f"Topic response repeats an existing topic: {topic!r}")
+
+    return topic
+
+async def generate_module_with_ai(course_title: str, course_objective: str, current_module_title: str,
+                                  experience_level: str, module_titles: List[str],
+                                  tier: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Generate a replacement for a single course module the learner already knows.
+    Only the course title, objective and module titles are sent, with a small token budget.
+    """
+    other_modules = [title for title in module_titles if title != current_module_title]
+    prompt = f"""You are editing the course "{course_title}" for a {experience_level} learner.
+Course objective: {course_objective}
+The learner already knows the module "{current_module_title}".
+Other modules in the course: {json.dumps(other_modules, ensure_ascii=False)}
+
+Write one new module that replaces "{current_module_title}" with more advanced content and does not repeat the other modules.
+Your output should be a JSON object with the following format:
+{{"title": "Module title", "steps": ["step 1", "step 2", ...], "example": "An example related to the module"}}
+
+Only respond with the valid JSON, with no explanation or additional text.
+"""
+
+    logger.info("Requesting module replacement for: %s", current_module_title)
+    ai_response = await request_completion(prompt, select_model(tier), max_tokens=MODULE_MAX_TOKENS)
+
+    module = parse_json_object(ai_response)
+    if not isinstance(module, dict) or not module.get("title") or not isinstance(module.get("steps"), list):
+        raise ValueError("No valid module found in response")
+
+    return {
+        "title": module["title"],
+        "steps": [str(step) for step in module["steps"]],
+        "example": module.get("example") or ""
+    }
@@ -1,9 +1,14 @@
 import os
+import logging
 from datetime import datetime, timedelta
 from typing import Dict, Any, Optional
 from models.user import User
 from models.course import Course
-from models.subscription import SubscriptionTier
+from models.payment import Payment, PAYMENT_APPROVED
+from utils.auth import invalidate_user_cache
+from utils.tier_catalog import TierInfo, get_tier
+
+logger = logging.getLogger(__name__)
 
 # Import the payment service
 try:
@@ -12,11 +17,11 @@ try:
 except ImportError:
     # If the payment service module is not available, disable payment functionality
     PAYMENT_ENABLED = False
-    print("WARNING: Payment service not available")
+    logger.warning("Payment service not available")
 
-async def get_subscription_tier(tier_id: str) -> Optional[SubscriptionTier]:
-    """Get a subscription tier by its ID"""
-    return await SubscriptionTier.find_one(SubscriptionTier.id == tier_id)
+async def get_subscription_tier(tier_id: str) -> Optional[TierInfo]:
+    """Get a subscription tier by its ID from the in-memory catalog"""
+    return await get_tier(tier_id)
 
 async def is_subscription_active(user: User) -> bool:
     """Check if the user's subscription is still active"""
@@ -28,8 +33,8 @@ async def is_subscription_active(user: User) -> bool:
     
     return user.subscription_expiration > datetime.utcnow()
 
-async def get_remaining_courses(user: User) -> int:
-    """Get the number of courses remaining for the user"""
+async def get_course_limit(user: User) -> int:
+    """Get how many courses the user's tier allows (-1 means unlimited)"""
     if not user.subscription_tier:
         return 1  # Default to free tier
     
@@ -38,16 +43,67 @@ async def get_remaining_courses(user: User) -> int:
     if not tier:
         return 1  # Default to free tier
     
+    return tier.course_limit
+
+async def get_course_count(user: User) -> int:
+    """
+    Get the number of courses the user has saved.
+    The counter is stored on the user; users created before it existed get it
+    computed once from their courses.
+    """
+    if user.course_count is not None:
+        return user.course_count
+    
+    courses_count = await Course.find(Course.user_id == user.id).count()
+    
+    # Only initialize the counter if no other request did it in the meantime
+    await User.get_motor_collection().update_one(
+        {"_id": user.id, "course_count": None},
+        {"$set": {"course_count": courses_count}}
+    )
+    user.course_count = courses_count
+    invalidate_user_cache(user)
+    
+    return courses_count
+
+async def get_remaining_courses(user: User) -> int:
+    """Get the number of courses remaining for the user"""
+    course_limit = await get_course_limit(user)
+    
     # Check for unlimited courses
-    if tier.course_limit < 0:
+    if course_limit < 0:
         return -1  # Unlimited
     
-    # Count how many courses the user has created
-    courses_count = await Course.find(Course.user_id == user.id).count()
-    remaining = max(0, tier.course_limit - courses_count)
+    courses_count = await get_course_count(user)
+    remaining = max(0, course_limit - courses_count)
     
     return remaining
 
+async def reserve_course_slot(user: User) -> bool:
+    """
+    Atomically check the quota and count a new course in a single update.
+    Returns False when the user has reached the limit of their tier.
+    """
+    course_limit = await get_course_limit(user)
+    await get_course_count(user)
+    
+    query: Dict[str, Any] = {"_id": user.id}
+    if course_limit >= 0:
+        query["course_count"] = {"$lt": course_limit}
+    
+    result = await User.get_motor_collection().update_one(query, {"$inc": {"course_count": 1}})
+    invalidate_user_cache(user)
+    
+    return result.modified_count == 1
+
+async def release_course_slot(user) -> None:
+    """Give back a course slot after a course is deleted (or its insert failed)"""
+    await User.get_motor_collection().update_one(
+        {"_id": user.id, "course_count": {"$gt": 0}},
+        {"$inc": {"course_count": -1}}
+    )
+    invalidate_user_cache(user)
+
 async def create_payment(user: User, tier_id: str) -> Dict[str, Any]:
     """Create a payment for a subscription"""
     if not PAYMENT_ENABLED:
@@ -59,7 +115,7 @@ async def create_payment(user: User, tier_id: str) -> Dict[str, Any]:
         return {"success": False, "error": "Invalid subscription tier"}
     
     # Create payment
-    payment_result = create_payment_link(
+    payment_result = await create_payment_link(
         user_id=user.id,
         plan_id=tier.id,
         plan_name=tier.name,
@@ -68,35 +124,57 @@ async def create_payment(user: User, tier_id: str) -> Dict[str, Any]:
     
     return payment_result
 
+async def set_user_subscription(user: User, tier_id: str, expiration: Optional[datetime]) -> None:
+    """
+    Set only the subscription fields of the user. The user may be a cached copy, so
+    saving the whole document would write back a stale course_count.
+    """
+    await User.get_motor_collection().update_one(
+        {"_id": user.id},
+        {"$set": {"subscription_tier": tier_id, "subscription_expiration": expiration}}
+    )
+    invalidate_user_cache(user)
+    user.subscription_tier = tier_id
+    user.subscription_expiration = expiration
+
+async def apply_payment_subscription(user: User, payment_result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Grant the tier of an approved payment. The payment is claimed with a conditional
+    update first, so verifying the same payment twice (or from two workers) grants it once.
+    """
+    tier = await get_subscription_tier(payment_result["plan_id"])
+    if not tier:
+        return {"success": False, "error": "Invalid subscription tier"}
+    
+    claimed = await Payment.get_motor_collection().update_one(
+        {"reference": payment_result["reference"], "status": PAYMENT_APPROVED, "subscription_applied_at": None},
+        {"$set": {"subscription_applied_at": datetime.utcnow()}}
+    )
+    
+    if claimed.modified_count == 1:
+        await set_user_subscription(user, tier.id, datetime.utcnow() + timedelta(days=30))
+    else:
+        # Already granted by an earlier verification; report the stored subscription
+        user = await User.get(user.id) or user
+    
+    return {
+        "success": True,
+        "subscription": {
+            "tier": tier.name,
+            "expiration": user.subscription_expiration.isoformat() if user.subscription_expiration else None
+        }
+    }
+
 async def verify_and_update_subscription(user: User, reference: str) -> Dict[str, Any]:
     """Verify a payment and update the user's subscription"""
     if not PAYMENT_ENABLED:
         return {"success": False, "error": "Payment service is not available"}
     
-    # Verify payment
-    payment_result = verify_payment(reference)
-    
-    if payment_result["success"] and payment_result["status"] == "APPROVED":
-        # Extract tier ID from reference
-        parts = reference.split("_")
-        if len(parts) >= 3:
-            tier_id = parts[1]
-            
-            # Get subscription details
-            tier = await get_subscription_tier(tier_id)
-            if tier:
-                # Update user subscription
-                user.subscription_tier = tier_id
-                user.subscription_expiration = datetime.utcnow() + timedelta(days=30)
-                await user.save()
-                
-                return {
-                    "success": True,
-                    "subscription": {
-                        "tier": tier.name,
-                        "expiration": user.subscription_expiration.isoformat()
-                    }
-                }
+    # Verify payment (only the user's own payments)
+    payment_result = await verify_payment(reference, user_id=user.id)
+    
+    if payment_result["success"] and payment_result["status"] == PAYMENT_APPROVED:
+        return await apply_payment_subscription(user, payment_result)
     
     return payment_result
 
@@ -109,28 +187,9 @@ async def approve_simulated_payment_and_update(user: User, reference: str) -> Di
         return {"success": False, "error": "This function is only available in simulation mode"}
     
     # Approve payment
-    payment_result = approve_simulated_payment(reference)
+    payment_result = await approve_simulated_payment(reference, user_id=user.id)
     
     if payment_result["success"]:
-        # Extract tier ID from reference
-        parts = reference.split("_")
-        if len(parts) >= 3:
-            tier_id = parts[1]
-            
-            # Get subscription details
-            tier = await get_subscription_tier(tier_id)
-            if tier:
-                # Update user subscription
-                user.subscription_tier = tier_id
-                user.subscription_expiration = datetime.utcnow() + timedelta(days=30)
-                await user.save()
-                
-                return {
-                    "success": True,
-                    "subscription": {
-                        "tier": tier.name,
-                        "expiration": user.subscription_expiration.isoformat()
-                    }
-                }
-    
-    return payment_result 
\ No newline at end of file
+        return await apply_payment_subscription(user, payment_result)
+    
+    return payment_result
@@ -0,0 +1,223 @@
+import os
+import sys
+import time
+import hmac
+import uuid
+import random
+import asyncio
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from utils.auth import ADMIN_TOKEN
+from utils.metrics import route_template
+
+# Opt-in request profiling; when disabled the middleware is not installed at all
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+
+# Share of requests profiled at random (admins can also ask with the X-Profile: 1 header)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_SECONDS = float(os.getenv("PROFILE_INTERVAL_SECONDS", "0.005"))
+
+# Where collapsed stacks are written, and how long / how many of them are kept
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_RETENTION_SECONDS = float(os.getenv("PROFILE_RETENTION_SECONDS", "86400"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+
+PROFILE_SUFFIX = ".collapsed"
+
+logger = logging.getLogger(__name__)
+
+_BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    filename = code.co_filename
+    if filename.startswith(_BACKEND_DIR):
+        filename = os.path.relpath(filename, _BACKEND_DIR)
+    else:
+        filename = "/".join(filename.split(os.sep)[-2:])
+    return f"{code.co_name} ({filename})"
+
+
+def _awaiting_frames(coro) -> List[Any]:
+    """Frames of a suspended coroutine chain, outermost first"""
+    frames = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return frames
+
+
+class RequestProfiler:
+    """
+    Samples what one request's task is doing from a background thread.
+    When the task is running, the event loop thread's stack is recorded under "running";
+    while it waits (network, database, locks), the chain of awaiting coroutines is
+    recorded under "waiting". The samples are written as collapsed stacks
+    ("frame;frame;frame count" per line), which flamegraph.pl and speedscope read.
+    """
+
+    def __init__(self, task: asyncio.Task, interval: float):
+        self.task = task
+        self.interval = interval
+        self.loop = task.get_loop()
+        self.loop_thread = threading.get_ident()
+        self.root_code = getattr(task.get_coro(), "cr_code", None)
+        self.counts: Dict[str, int] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample_until_stopped, name="request-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _sample(self):
+        if asyncio.current_task(self.loop) is self.task:
+            frame = sys._current_frames().get(self.loop_thread)
+            frames = []
+            while frame is not None:
+                frames.append(frame)
+                if frame.f_code is self.root_code:
+                    break
+                frame = frame.f_back
+            frames.reverse()
+            state = "running"
+        else:
+            frames = _awaiting_frames(self.task.get_coro())
+            state = "waiting"
+
+        if frames:
+            stack = ";".join([state] + [_frame_name(frame) for frame in frames])
+            self.counts[stack] = self.counts.get(stack, 0) + 1
+
+    def _sample_until_stopped(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self._sample()
+            except Exception:
+                # Frames can vanish while they are being walked; skip the sample
+                continue
+
+    def stop(self, directory: str, name: str):
+        """Stop sampling, then write the collapsed stacks and apply the retention policy (in the thread)"""
+        self._stop.set()
+        threading.Thread(
+            target=self._write, args=(directory, name), name="request-profiler-writer", daemon=True
+        ).start()
+
+    def _write(self, directory: str, name: str):
+        self._thread.join()
+        path = os.path.join(directory, name)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(path, "w") as f:
+                for stack, count in sorted(self.counts.items()):
+                    f.write(f"{stack} {count}\n")
+            prune_profiles(directory)
+        except OSError as e:
+            logger.warning("Failed to write profile %s: %s", path, e)
+
+
+def prune_profiles(directory: str = PROFILE_DIR):
+    """Delete profiles older than the retention period, and the oldest beyond PROFILE_MAX_FILES"""
+    try:
+        entries = [entry for entry in os.scandir(directory) if entry.name.endswith(PROFILE_SUFFIX)]
+    except FileNotFoundError:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    cutoff = time.time() - PROFILE_RETENTION_SECONDS
+    for index, entry in enumerate(entries):
+        if index >= PROFILE_MAX_FILES or entry.stat().st_mtime < cutoff:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles(directory: str = PROFILE_DIR) -> List[Dict[str, Any]]:
+    """Stored profiles, newest first"""
+    try:
+        entries = [entry for entry in os.scandir(directory) if entry.name.endswith(PROFILE_SUFFIX)]
+    except FileNotFoundError:
+        return []
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    return [
+        {
+            "name": entry.name,
+            "size": entry.stat().st_size,
+            "created_at": datetime.utcfromtimestamp(entry.stat().st_mtime).isoformat()
+        }
+        for entry in entries
+    ]
+
+
+def profile_path(name: str, directory: str = PROFILE_DIR) -> Optional[str]:
+    """Path of a stored profile, or None if the name is not one of ours"""
+    if os.path.basename(name) != name or not name.endswith(PROFILE_SUFFIX):
+        return None
+    path = os.path.join(directory, name)
+    return path if os.path.isfile(path) else None
+
+
+def _requested_by_admin(scope) -> bool:
+    profile = admin_token = None
+    for name, value in scope["headers"]:
+        if name == b"x-profile":
+            profile = value
+        elif name == b"x-admin-token":
+            admin_token = value.decode("latin-1")
+    return (
+        profile == b"1"
+        and bool(ADMIN_TOKEN)
+        and admin_token is not None
+        and hmac.compare_digest(admin_token, ADMIN_TOKEN)
+    )
+
+
+class ProfilerMiddleware:
+    """
+    Pure ASGI middleware profiling a request when an admin sends X-Profile: 1 (with
+    X-Admin-Token) or, at random, a PROFILE_SAMPLE_RATE share of requests. The profile
+    name is returned in the X-Profile-Id header. Only installed when PROFILING_ENABLED.
+    """
+
+    def __init__(self, app, sample_rate: float = PROFILE_SAMPLE_RATE,
+                 interval: float = PROFILE_INTERVAL_SECONDS, directory: str = PROFILE_DIR):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.directory = directory
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not (
+            (self.sample_rate and random.random() < self.sample_rate) or _requested_by_admin(scope)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        name = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        profiler = RequestProfiler(asyncio.current_task(), self.interval)
+
+        def filename() -> str:
+            # Named after the route, which is known once the request has been routed
+            route = route_template(scope).strip("/").replace("/", "_").replace("{", "").replace("}", "")
+            return f"{name}-{scope['method']}-{route or 'root'}{PROFILE_SUFFIX}"
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-profile-id", filename().encode("latin-1"))
+                ]
+            await send(message)
+
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.stop(self.directory, filename())
+            logger.info("Profiled %s %s", scope["method"], scope["path"], extra={"profile": filename()})
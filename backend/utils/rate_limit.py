@@ -0,0 +1,257 @@
+import os
+import math
+import time
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, NamedTuple, Optional
+from fastapi import Depends, HTTPException, status
+from pymongo.errors import DuplicateKeyError
+
+from models.user import User
+from models.rate_limit import RateLimitBucket
+from utils.auth import get_current_user
+from utils.cache import TTLCache
+from utils.metrics import CallbackGauge, Counter
+
+# Token buckets for the generation endpoints
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+
+# "memory" keeps buckets per worker process, "mongo" shares them between workers
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+
+# Per-user limits by tier as "tier_id=requests_per_minute:burst"
+RATE_LIMIT_USER_LIMITS = os.getenv(
+    "RATE_LIMIT_USER_LIMITS",
+    "tier_free=6:3,tier_pro=30:10,tier_unlimited=60:20"
+)
+RATE_LIMIT_DEFAULT = os.getenv("RATE_LIMIT_DEFAULT", "6:3")
+
+# Optional limits shared by every user of a tier, same format (empty: none)
+RATE_LIMIT_TIER_LIMITS = os.getenv("RATE_LIMIT_TIER_LIMITS", "")
+
+# In-flight LLM requests per worker process, and how many more may wait for a slot
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "32"))
+LLM_MAX_QUEUED = int(os.getenv("LLM_MAX_QUEUED", "64"))
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "10"))
+
+
+class BucketLimit(NamedTuple):
+    """Refill rate in tokens per second and bucket capacity"""
+    rate: float
+    burst: float
+
+    @property
+    def refill_seconds(self) -> float:
+        """Time an empty bucket takes to fill up again"""
+        return self.burst / self.rate
+
+
+def _parse_limit(value: str) -> BucketLimit:
+    per_minute, _, burst = value.partition(":")
+    per_minute = float(per_minute)
+    return BucketLimit(rate=per_minute / 60.0, burst=float(burst) if burst else max(per_minute, 1.0))
+
+
+def _parse_limits(value: str) -> Dict[str, BucketLimit]:
+    """Parse "tier_id=requests_per_minute:burst,..." into a {tier_id: limit} map"""
+    limits = {}
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        tier_id, limit = item.split("=", 1)
+        limits[tier_id.strip()] = _parse_limit(limit.strip())
+    return limits
+
+
+def _refill(tokens: float, updated: float, now: float, limit: BucketLimit) -> float:
+    return min(limit.burst, tokens + max(now - updated, 0.0) * limit.rate)
+
+
+class MemoryBucketStore:
+    """Token buckets of this worker process"""
+
+    def __init__(self, maxsize: int = 100000):
+        # An idle bucket is full again after refill_seconds, so it can simply expire
+        self.buckets = TTLCache(maxsize=maxsize)
+
+    async def take(self, key: str, limit: BucketLimit) -> float:
+        """Take a token; returns 0 if allowed, otherwise the seconds until one is available"""
+        now = time.monotonic()
+        tokens, updated = self.buckets.get(key, (limit.burst, now))
+        tokens = _refill(tokens, updated, now, limit)
+        if tokens < 1:
+            return (1 - tokens) / limit.rate
+        self.buckets.set(key, (tokens - 1, now), ttl=limit.refill_seconds)
+        return 0.0
+
+
+class MongoBucketStore:
+    """Token buckets shared by every worker through MongoDB, updated with compare-and-set"""
+
+    def __init__(self, max_conflicts: int = 5):
+        self.max_conflicts = max_conflicts
+
+    async def take(self, key: str, limit: BucketLimit) -> float:
+        collection = RateLimitBucket.get_motor_collection()
+
+        for _ in range(self.max_conflicts):
+            now = time.time()
+            document = await collection.find_one({"_id": key})
+
+            if document is None:
+                try:
+                    await collection.insert_one({
+                        "_id": key,
+                        "tokens": limit.burst - 1,
+                        "updated": now,
+                        "updated_at": datetime.utcnow()
+                    })
+                    return 0.0
+                except DuplicateKeyError:
+                    continue
+
+            tokens = _refill(document["tokens"], document["updated"], now, limit)
+            if tokens < 1:
+                return (1 - tokens) / limit.rate
+
+            # Only applies if no other worker took a token since we read the bucket
+            result = await collection.update_one(
+                {"_id": key, "updated": document["updated"]},
+                {"$set": {"tokens": tokens - 1, "updated": now, "updated_at": datetime.utcnow()}}
+            )
+            if result.modified_count == 1:
+                return 0.0
+
+        # Heavy contention on one bucket: treat it as exhausted
+        return 1.0 / limit.rate
+
+
+class RateLimiter:
+    """Per-user token buckets sized by tier, plus optional buckets shared by a whole tier"""
+
+    def __init__(self, store, user_limits: Dict[str, BucketLimit], default_limit: BucketLimit,
+                 tier_limits: Dict[str, BucketLimit]):
+        self.store = store
+        self.user_limits = user_limits
+        self.default_limit = default_limit
+        self.tier_limits = tier_limits
+        self.stats = {"allowed": 0, "limited": 0}
+
+    async def check(self, user_id: str, tier_id: Optional[str]) -> float:
+        """Take a token for a request; returns 0 if allowed, otherwise the Retry-After in seconds"""
+        limit = self.user_limits.get(tier_id or "", self.default_limit)
+        retry_after = await self.store.take(f"user:{user_id}", limit)
+
+        tier_limit = self.tier_limits.get(tier_id or "")
+        if not retry_after and tier_limit is not None:
+            retry_after = await self.store.take(f"tier:{tier_id}", tier_limit)
+
+        self.stats["limited" if retry_after else "allowed"] += 1
+        return retry_after
+
+
+class ConcurrencyLimiter:
+    """
+    Caps in-flight LLM requests. Requests beyond the cap wait in a bounded queue;
+    when the queue is full, or the wait exceeds queue_timeout, they are shed with 429.
+    """
+
+    def __init__(self, max_in_flight: int, max_queued: int, queue_timeout: float):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.stats = {"admitted": 0, "shed": 0}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _shed(self) -> HTTPException:
+        self.stats["shed"] += 1
+        RATE_LIMITED.inc(("llm_concurrency",))
+        return HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="The course generator is busy, please try again shortly",
+            headers={"Retry-After": str(max(1, math.ceil(self.queue_timeout)))}
+        )
+
+    async def acquire(self):
+        # Created on first use so it belongs to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        if self._semaphore.locked():
+            if self.waiting >= self.max_queued:
+                raise self._shed()
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise self._shed()
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+
+        self.in_flight += 1
+        self.stats["admitted"] += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(
+            self.stats,
+            in_flight=self.in_flight,
+            waiting=self.waiting,
+            max_in_flight=self.max_in_flight,
+            max_queued=self.max_queued
+        )
+
+
+rate_limiter = RateLimiter(
+    store=MongoBucketStore() if RATE_LIMIT_BACKEND == "mongo" else MemoryBucketStore(),
+    user_limits=_parse_limits(RATE_LIMIT_USER_LIMITS),
+    default_limit=_parse_limit(RATE_LIMIT_DEFAULT),
+    tier_limits=_parse_limits(RATE_LIMIT_TIER_LIMITS)
+)
+llm_limiter = ConcurrencyLimiter(LLM_MAX_IN_FLIGHT, LLM_MAX_QUEUED, LLM_QUEUE_TIMEOUT_SECONDS)
+
+RATE_LIMITED = Counter("rate_limited_requests_total", "Requests rejected with 429", ("reason",))
+CallbackGauge("llm_requests_in_flight", "Generation requests holding an LLM slot", (),
+              lambda: {(): llm_limiter.in_flight})
+CallbackGauge("llm_requests_waiting", "Generation requests waiting for an LLM slot", (),
+              lambda: {(): llm_limiter.waiting})
+
+
+async def limit_generation_rate(current_user: User = Depends(get_current_user)):
+    """Dependency: reject generation requests over the user's (and tier's) rate limit with 429"""
+    if not RATE_LIMIT_ENABLED:
+        return
+
+    retry_after = await rate_limiter.check(current_user.id, current_user.subscription_tier)
+    if retry_after:
+        RATE_LIMITED.inc(("rate",))
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many generation requests, please slow down",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+
+async def limit_llm_concurrency():
+    """Dependency: hold an LLM slot for the whole request, streaming included"""
+    await llm_limiter.acquire()
+    try:
+        yield
+    finally:
+        llm_limiter.release()
+
+
+def rate_limit_stats() -> Dict[str, Any]:
+    """Counters of the rate and concurrency limiters"""
+    return {
+        "backend": RATE_LIMIT_BACKEND,
+        "rate_limiter": dict(rate_limiter.stats, enabled=RATE_LIMIT_ENABLED),
+        "llm_concurrency": llm_limiter.get_stats()
+    }
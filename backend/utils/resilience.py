@@ -0,0 +1,135 @@
+import time
+import random
+import asyncio
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+import httpx
+
+# HTTP statuses worth retrying: rate limiting and upstream failures
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream that is known to be failing"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit for {name} is open, retry in {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether an upstream error is transient: timeouts, connection errors, 429 and 5xx"""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError))
+
+
+class RetryPolicy:
+    """Bounded retries with full-jitter exponential backoff"""
+
+    def __init__(self, max_retries: int, base_delay: float, max_delay: float):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int, error: Optional[BaseException] = None) -> float:
+        """Seconds to wait before retry number attempt + 1, honouring a Retry-After header"""
+        if isinstance(error, httpx.HTTPStatusError):
+            retry_after = error.response.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    return min(max(float(retry_after), 0.0), self.max_delay)
+                except ValueError:
+                    pass
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+    After failure_threshold failures in a row the circuit opens and calls fail fast
+    for reset_timeout seconds; then a single trial call is let through (half-open)
+    and its outcome closes or re-opens the circuit.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.stats = {"opened": 0, "short_circuited": 0}
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call is allowed right now"""
+        if self.state == self.CLOSED or self.failure_threshold <= 0:
+            return
+
+        if self.state == self.OPEN:
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0:
+                self.stats["short_circuited"] += 1
+                raise CircuitOpenError(self.name, remaining)
+            self.state = self.HALF_OPEN
+            self.trial_in_flight = False
+
+        # Half-open: only one trial call at a time
+        if self.trial_in_flight:
+            self.stats["short_circuited"] += 1
+            raise CircuitOpenError(self.name, self.reset_timeout)
+        self.trial_in_flight = True
+
+    def retry_after(self) -> float:
+        """Seconds until an open circuit lets a trial call through (0 when calls are allowed)"""
+        if self.state != self.OPEN or self.failure_threshold <= 0:
+            return 0.0
+        return max(self.opened_at + self.reset_timeout - time.monotonic(), 0.0)
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trial_in_flight = False
+
+    def release_trial(self):
+        """Give back the half-open trial slot without an outcome (the call was cancelled)"""
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.failure_threshold <= 0:
+            return
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.stats["opened"] += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self.stats, state=self.state, consecutive_failures=self.failures)
+
+
+class LatencyWindow:
+    """Latencies of the most recent successful calls, for percentile estimates"""
+
+    def __init__(self, size: int = 200):
+        self.samples: Deque[float] = deque(maxlen=size)
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def __len__(self) -> int:
+        return len(self.samples)
@@ -0,0 +1,129 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional
+from pymongo.errors import DuplicateKeyError
+
+from models.generation_lock import GenerationLock
+
+logger = logging.getLogger(__name__)
+
+# Identifies this worker process as a lock owner
+PROCESS_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key into a single execution.
+
+    The first caller for a key runs the function in its own task; every caller that
+    arrives while it is in flight awaits the same task and receives the same result
+    (or exception). Cancelling one caller does not cancel the shared call.
+
+    With distributed=True a MongoDB lock also coordinates worker processes: a worker
+    that finds the lock taken polls lookup() until the holder has published a result,
+    and only runs the function itself if the lock disappears or the wait times out.
+    """
+
+    def __init__(self, distributed: bool = False, lock_ttl: float = 120,
+                 wait_timeout: float = 120, poll_interval: float = 0.5):
+        self.distributed = distributed
+        self.lock_ttl = lock_ttl
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.leaders = 0
+        self.followers = 0
+        self._calls: Dict[str, asyncio.Future] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]],
+                 lookup: Optional[Callable[[], Awaitable[Any]]] = None) -> Any:
+        """Run fn once per key at a time and share its result with concurrent callers"""
+        task = self._calls.get(key)
+        if task is not None:
+            self.followers += 1
+            return await asyncio.shield(task)
+
+        self.leaders += 1
+        if self.distributed:
+            task = asyncio.ensure_future(self._run_with_lock(key, fn, lookup))
+        else:
+            task = asyncio.ensure_future(fn())
+        self._calls[key] = task
+        task.add_done_callback(lambda _: self._calls.pop(key, None))
+
+        return await asyncio.shield(task)
+
+    def in_flight(self) -> int:
+        """Number of keys currently being computed"""
+        return len(self._calls)
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for monitoring"""
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "distributed": self.distributed
+        }
+
+    async def _run_with_lock(self, key: str, fn: Callable[[], Awaitable[Any]],
+                             lookup: Optional[Callable[[], Awaitable[Any]]]) -> Any:
+        try:
+            acquired = await self._acquire(key)
+        except Exception as e:
+            # Coordination is an optimization: without MongoDB, fall back to a local call
+            logger.warning("Failed to acquire generation lock %s: %s", key, e)
+            return await fn()
+
+        if acquired:
+            try:
+                return await fn()
+            finally:
+                await self._release(key)
+
+        # Another worker is generating this key: wait for it to publish the result
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.poll_interval)
+
+            if lookup is not None:
+                result = await lookup()
+                if result is not None:
+                    return result
+
+            if await GenerationLock.get(key) is None:
+                break
+
+        return await fn()
+
+    async def _acquire(self, key: str) -> bool:
+        now = datetime.utcnow()
+        lock = GenerationLock(id=key, owner=PROCESS_ID, expires_at=now + timedelta(seconds=self.lock_ttl))
+
+        try:
+            await lock.insert()
+            return True
+        except DuplicateKeyError:
+            pass
+
+        # Take over a lock that expired but has not been removed by the TTL monitor yet
+        collection = GenerationLock.get_motor_collection()
+        result = await collection.delete_one({"_id": key, "expires_at": {"$lt": now}})
+        if result.deleted_count == 0:
+            return False
+
+        try:
+            await lock.insert()
+            return True
+        except DuplicateKeyError:
+            return False
+
+    async def _release(self, key: str):
+        try:
+            collection = GenerationLock.get_motor_collection()
+            await collection.delete_one({"_id": key, "owner": PROCESS_ID})
+        except Exception as e:
+            logger.warning("Failed to release generation lock %s: %s", key, e)
@@ -0,0 +1,96 @@
+import os
+import json
+import asyncio
+import logging
+import hashlib
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional
+
+from models.subscription import SubscriptionTier
+
+logger = logging.getLogger(__name__)
+
+# How often every worker reloads the catalog from MongoDB (0 disables the refresh loop)
+TIER_CATALOG_REFRESH_SECONDS = float(os.getenv("TIER_CATALOG_REFRESH_SECONDS", "300"))
+
+
+class TierInfo(NamedTuple):
+    """Immutable snapshot of a subscription tier"""
+    id: str
+    name: str
+    price: float
+    course_limit: int
+    description: Optional[str]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return self._asdict()
+
+
+class TierCatalog(NamedTuple):
+    """The tiers together with their serialized listing and its ETag"""
+    tiers: Mapping[str, TierInfo]
+    listing: List[Dict[str, Any]]
+    etag: Optional[str]
+
+
+# Replaced as a whole on every load, so readers always see a consistent catalog
+_catalog = TierCatalog(tiers=MappingProxyType({}), listing=[], etag=None)
+_refresh_task: Optional[asyncio.Task] = None
+
+
+async def load_tier_catalog() -> TierCatalog:
+    """Load every tier from MongoDB and swap in the new catalog"""
+    global _catalog
+
+    documents = await SubscriptionTier.find_all().sort("price").to_list()
+    tiers = {
+        tier.id: TierInfo(
+            id=tier.id,
+            name=tier.name,
+            price=tier.price,
+            course_limit=tier.course_limit,
+            description=tier.description
+        )
+        for tier in documents
+    }
+    listing = [tier.to_dict() for tier in tiers.values()]
+    etag = '"' + hashlib.sha256(json.dumps(listing, sort_keys=True).encode("utf-8")).hexdigest()[:32] + '"'
+
+    _catalog = TierCatalog(tiers=MappingProxyType(tiers), listing=listing, etag=etag)
+    return _catalog
+
+
+def get_catalog() -> TierCatalog:
+    """Get the current catalog"""
+    return _catalog
+
+
+async def get_tier(tier_id: str) -> Optional[TierInfo]:
+    """Get a tier from the catalog, loading the catalog first if it is still empty"""
+    if not _catalog.tiers:
+        await load_tier_catalog()
+    return _catalog.tiers.get(tier_id)
+
+
+async def _refresh_periodically():
+    while True:
+        await asyncio.sleep(TIER_CATALOG_REFRESH_SECONDS)
+        try:
+            await load_tier_catalog()
+        except Exception as e:
+            logger.warning("Failed to refresh subscription tier catalog: %s", e)
+
+
+def start_tier_catalog_refresh():
+    """Start reloading the catalog on the configured interval"""
+    global _refresh_task
+    if TIER_CATALOG_REFRESH_SECONDS > 0 and _refresh_task is None:
+        _refresh_task = asyncio.ensure_future(_refresh_periodically())
+
+
+def stop_tier_catalog_refresh():
+    """Stop the refresh loop"""
+    global _refresh_task
+    if _refresh_task is not None:
+        _refresh_task.cancel()
+        _refresh_task = None
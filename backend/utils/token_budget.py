@@ -0,0 +1,147 @@
+import os
+import re
+import math
+from typing import NamedTuple, Optional
+
+# Upper bound of max_tokens for a single-completion course
+TOKEN_BUDGET_MAX_TOKENS = int(os.getenv("TOKEN_BUDGET_MAX_TOKENS", "2000"))
+TOKEN_BUDGET_MIN_TOKENS = int(os.getenv("TOKEN_BUDGET_MIN_TOKENS", "700"))
+
+# Study hours assumed when available_time cannot be parsed (a mid-sized course)
+DEFAULT_STUDY_HOURS = 20.0
+
+# Rough completion size of each part of a course, measured on recorded responses
+BASE_TOKENS = 350  # title, objective, prerequisites, definitions, resources, FAQs, errors, downloads, summary
+TOKENS_PER_ROADMAP_SECTION = 30
+TOKENS_PER_MODULE = 45  # title and example
+TOKENS_PER_STEP = 22
+TOKEN_HEADROOM = 1.25
+
+# Study hours in one unit of available time; a day, week or month of part-time study
+_UNIT_HOURS = {
+    "minute": 1 / 60,
+    "hour": 1.0,
+    "day": 2.0,
+    "week": 10.0,
+    "month": 40.0,
+    "year": 300.0,
+}
+
+# English and Spanish spellings of each unit
+_UNIT_NAMES = {
+    "minute": ["min", "mins", "minute", "minutes", "minuto", "minutos"],
+    "hour": ["h", "hr", "hrs", "hour", "hours", "hora", "horas"],
+    "day": ["day", "days", "dia", "dias", "día", "días"],
+    "week": ["wk", "wks", "week", "weeks", "semana", "semanas"],
+    "month": ["month", "months", "mes", "meses"],
+    "year": ["year", "years", "yr", "yrs", "año", "años", "ano", "anos"],
+}
+_UNITS = {name: unit for unit, names in _UNIT_NAMES.items() for name in names}
+
+_NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "un": 1, "una": 1, "uno": 1,
+    "two": 2, "dos": 2, "three": 3, "tres": 3, "four": 4, "cuatro": 4,
+    "five": 5, "cinco": 5, "six": 6, "seis": 6, "ten": 10, "diez": 10,
+    "half": 0.5, "medio": 0.5, "media": 0.5,
+}
+
+_DURATION = re.compile(
+    r"(?:(\d+(?:[.,]\d+)?)|\b(" + "|".join(sorted(_NUMBER_WORDS, key=len, reverse=True)) + r"))?"
+    r"\s*\b(" + "|".join(sorted(_UNITS, key=len, reverse=True)) + r")\b",
+    re.IGNORECASE
+)
+
+# Steps per module by experience level (English and Spanish)
+_LEVEL_STEPS = {
+    "beginner": 4, "principiante": 4, "basic": 4, "básico": 4, "basico": 4,
+    "intermediate": 5, "intermedio": 5,
+    "advanced": 6, "avanzado": 6, "expert": 6, "experto": 6,
+}
+
+
+class CoursePlan(NamedTuple):
+    """Size of the course to ask for and the completion budget it needs"""
+    study_hours: float
+    module_count: int
+    steps_per_module: int
+    roadmap_sections: int
+    max_tokens: int
+
+
+def _amount(number: str, word: str) -> float:
+    """Quantity in front of a unit: digits, a number word, or 1 when omitted"""
+    if number:
+        return float(number.replace(",", "."))
+    if word:
+        return _NUMBER_WORDS[word.lower()]
+    return 1.0
+
+
+def parse_study_hours(available_time: str) -> Optional[float]:
+    """
+    Parse a free-text duration such as "2 weeks", "1 hour 30 min" or "tres meses"
+    into study hours. Returns None if no duration is found.
+    """
+    hours = 0.0
+    found = False
+    for number, word, unit in _DURATION.findall(available_time or ""):
+        hours += _amount(number, word) * _UNIT_HOURS[_UNITS[unit.lower()]]
+        found = True
+    return hours if found else None
+
+
+def steps_for_level(experience_level: str) -> int:
+    """Steps per module for an experience level (5 when the level is not recognised)"""
+    return _LEVEL_STEPS.get((experience_level or "").strip().lower(), 5)
+
+
+def _module_count(study_hours: float) -> int:
+    for limit, modules in ((2, 2), (6, 3), (15, 4), (40, 5), (100, 6), (200, 7)):
+        if study_hours <= limit:
+            return modules
+    return 8
+
+
+# Roadmap sections per unit of calendar time (a year is split in quarters)
+_UNIT_SECTIONS = {"day": 1, "week": 1, "month": 1, "year": 4}
+
+
+def _roadmap_sections(available_time: str, module_count: int) -> int:
+    """
+    One roadmap section per day, week or month requested (e.g. 3 months -> 3), at most one
+    per module. Courses measured in hours get one section per two modules.
+    """
+    count = math.ceil(module_count / 2)
+    match = _DURATION.search(available_time or "")
+    if match:
+        number, word, unit = match.groups()
+        unit = _UNITS[unit.lower()]
+        if unit in _UNIT_SECTIONS:
+            count = math.ceil(_amount(number, word) * _UNIT_SECTIONS[unit])
+    return max(1, min(count, module_count))
+
+
+def plan_course(experience_level: str, available_time: str) -> CoursePlan:
+    """Pick the module count and max_tokens for a course from the requested time and level"""
+    study_hours = parse_study_hours(available_time)
+    if study_hours is None:
+        study_hours = DEFAULT_STUDY_HOURS
+
+    module_count = _module_count(study_hours)
+    steps_per_module = steps_for_level(experience_level)
+    roadmap_sections = _roadmap_sections(available_time, module_count)
+
+    estimate = (
+        BASE_TOKENS
+        + roadmap_sections * TOKENS_PER_ROADMAP_SECTION
+        + module_count * (TOKENS_PER_MODULE + steps_per_module * TOKENS_PER_STEP)
+    )
+    max_tokens = int(min(TOKEN_BUDGET_MAX_TOKENS, max(TOKEN_BUDGET_MIN_TOKENS, estimate * TOKEN_HEADROOM)))
+
+    return CoursePlan(
+        study_hours=study_hours,
+        module_count=module_count,
+        steps_per_module=steps_per_module,
+        roadmap_sections=roadmap_sections,
+        max_tokens=max_tokens
+    )